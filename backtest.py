@@ -0,0 +1,77 @@
+"""
+Score a whole array of actions against a price window in one call, no env. Stepping BitcoinEnv.execute() per action
+builds a state for the agent every step, which a backtest doesn't need; here it's just the trade accounting (fees,
+min_trade, overdraft, the market move, trade-vs-hold) in one EpisodeState.run() loop (numba-compiled with JIT on).
+The rules are trading.py's, the ones execute() runs, so the totals/signals/cumm_return/sharpe match stepping the env
+with the same actions exactly.
+
+Uses: re-scoring the `signals` & `prices` hypersearch stores in the runs table (replay()), and baseline strategies
+over the full history, eg `backtest('single_discrete', np.full(len(prices_diff), 2), prices_diff)` for always-buy.
+"""
+
+import numpy as np
+from trading import EpisodeState, action_pcts, FEE, MIN_TRADE
+
+# BitcoinEnv's defaults
+START_CASH, START_VALUE = .4, .4
+
+
+def pct_changes(prices, q=None):
+    """Percent-change of a price window, first one 0.
+    :param q: the outlier cutoff BitcoinEnv.diff() used (the run's xform_fit['diff_q']): changes past it (& infs) are
+        forward-filled, like it does. A stored window alone doesn't know the cutoff, so without it they're left be
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    diff = np.zeros(len(prices))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        diff[1:] = prices[1:] / prices[:-1] - 1
+        if q is not None:
+            idx = np.where((diff > q) | ~np.isfinite(diff), 0, np.arange(len(diff)))
+            diff = diff[np.maximum.accumulate(idx)]
+    return diff
+
+
+def backtest(action_type, actions, prices_diff, start_cash=START_CASH, start_value=START_VALUE,
+             min_trade=MIN_TRADE, fee=FEE, kill=True):
+    """
+    :param action_type: single_discrete|single_continuous|multi, as the hyper
+    :param actions: one action per step (multi: dict of action & amount arrays)
+    :param prices_diff: the window's percent-changes, like env.prices_diff (eg all_prices_diff[offset:offset+limit],
+        or pct_changes(prices)). Steps run to the end of the actions or of the window, whichever's first
+    :param kill: end on cash|value < 0, like the env does in TRAIN/TEST
+    :return: a finished EpisodeState (signals, totals, cumm_return(), sharpe())
+    """
+    ep = EpisodeState(max(len(prices_diff) - 1, 0), start_cash, start_value)
+    ep.run(action_pcts(action_type, actions), prices_diff, min_trade, start_cash + start_value, fee, kill)
+    ep.finish()
+    return ep
+
+
+def replay(signals, prices, start_cash=START_CASH, start_value=START_VALUE, min_trade=MIN_TRADE, fee=FEE, kill=True,
+           q=None, prices_diff=None):
+    """Re-score a stored run (the runs table's `signals` & `prices`). Signals are act_btc, what trade() already made
+    of the agent's actions, so they're applied as they are: > 0 bought, < 0 sold (fee'd like trade() does). An
+    overdraft was stored as -start_total whichever way it went; it was a buy if there wasn't min_trade cash at that
+    point (trade() checks that first), so that's how it's taken whenever cash < min_trade.
+    :param q: the run's xform_fit['diff_q'], so outlier moves are masked like the env's were (see pct_changes())
+    :param prices_diff: or the percent-changes the env actually stepped on (its prices_diff), instead of `prices`'.
+        Exact even where an outlier sits right at the window's start, which `q` can't see past
+    :return: a finished EpisodeState
+    """
+    if prices_diff is None: prices_diff = pct_changes(prices, q)
+    start_total = start_cash + start_value
+    ep = EpisodeState(max(len(prices_diff) - 1, 0), start_cash, start_value)
+    for act_btc, pct_change in zip(np.asarray(signals, dtype=np.float64).tolist(), prices_diff[1:].tolist()):
+        if act_btc == -start_total:
+            if ep.cash < min_trade: ep.cash -= act_btc
+            else: ep.value -= start_total
+        elif act_btc > 0:
+            ep.value += act_btc - act_btc*fee
+            ep.cash -= act_btc
+        elif act_btc < 0:
+            ep.cash += abs(act_btc) - abs(act_btc)*fee
+            ep.value -= abs(act_btc)
+        ep.step(act_btc, pct_change)
+        if kill and (ep.value < 0 or ep.cash < 0): break
+    ep.finish()
+    return ep
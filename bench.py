@@ -0,0 +1,345 @@
+"""
+Timing harness for the hot paths (data pulls, feature transforms, env stepping). Not part of any run; use it before &
+after touching one of these to see whether it actually helped. `python bench.py <name> [<name> ...]`, see BENCHES at
+the bottom for what's available.
+"""
+
+import argparse, time
+
+
+def timed(fn, *args, repeat=3, **kwargs):
+    """Best-of-`repeat` wall time (seconds) and the last result"""
+    best, res = float('inf'), None
+    for _ in range(repeat):
+        start = time.time()
+        res = fn(*args, **kwargs)
+        best = min(best, time.time() - start)
+    return best, res
+
+
+def bench_alignment(args):
+    """Fetch time vs history length: per-row `left join lateral` (original query) vs in-process as-of alignment.
+    Needs a Postgres history DB with both arbitrage tables."""
+    from data import data
+    conn = data.engine.connect()
+    print('rows\tlateral(s)\tasof(s)')
+    for n in args.lengths:
+        n = int(n)
+        t_lateral, _ = timed(data._db_to_dataframe_lateral, conn, limit=n, arbitrage=True)
+        t_asof, _ = timed(data._db_to_dataframe_main, conn, limit=n, arbitrage=True)
+        print(f'{n}\t{"%.3f" % t_lateral}\t{"%.3f" % t_asof}')
+    conn.close()
+
+
+def bench_engines(args):
+    """Same uncached pulls against each `--urls` backend (eg your Postgres history DB vs an SQLite copy of it), so
+    query performance can be compared between engines."""
+    from sqlalchemy import create_engine
+    from data import data
+    data.USE_CACHE = False
+    print('url\trows\tcount(s)\tfetch(s)')
+    for url in args.urls or [str(data.engine.url)]:
+        conn = create_engine(url).connect()
+        for n in args.lengths:
+            n = int(n)
+            t_count, _ = timed(data.db_to_dataframe, conn, just_count=True, arbitrage=True)
+            t_fetch, df = timed(data.db_to_dataframe, conn, limit=n, arbitrage=True)
+            print(f'{conn.engine.url.drivername}\t{len(df)}\t{"%.4f" % t_count}\t{"%.3f" % t_fetch}')
+        conn.close()
+
+
+def _synthetic_history(n, arbitrage=True):
+    """Random-walk frame shaped like db_to_dataframe's, so transform/env benches don't need a DB"""
+    import numpy as np
+    import pandas as pd
+    from data import data
+    cols = {}
+    for t in data.get_tables(arbitrage):
+        walk = np.random.randn(n).cumsum() + 10000
+        for c in t['cols']:
+            cols[f"{t['name']}_{c}"] = walk + np.random.rand(n) if c in t['price_cols'] else np.random.rand(n) * 10
+    return pd.DataFrame(cols)
+
+
+def _bare_env(hypers, **cli_args):
+    """BitcoinEnv with just what xform_data & stepping need (no DB connection, no feature store)"""
+    from box import Box
+    from btc_env import BitcoinEnv
+    env = BitcoinEnv.__new__(BitcoinEnv)
+    env.hypers = Box(hypers)
+    env.cli_args = Box(dict(autoencode=False, float32=False), **cli_args)
+    return env
+
+
+def _xform_pandas(env, df):
+    """xform_data as it was before going NumPy-native (Series per column, pct_change/mask/ffill, column_stack, then
+    sklearn's robust_scale over the whole matrix); the baseline for bench_xform"""
+    import numpy as np
+    import pandas as pd
+    from sklearn import preprocessing
+    from data import data
+
+    def diff(arr):
+        diff = pd.Series(arr).pct_change()
+        diff.iloc[0] = 0
+        diff = diff.mask(diff > diff.quantile(0.99), np.nan)
+        return diff.replace([np.inf, -np.inf], np.nan).ffill().bfill().values
+
+    columns = []
+    for table in data.get_tables(env.hypers.arbitrage):
+        for col in table['cols']:
+            name_col = f'{table["name"]}_{col}'
+            if name_col == data.target: columns.append(diff(df[name_col]))
+            elif col in table['price_cols']: columns.append(df[name_col] / df[data.target])
+            else: columns.append(df[name_col])
+    states = np.column_stack(columns)
+    return preprocessing.robust_scale(states, quantile_range=(1., 99.)), df[data.target].values
+
+
+def bench_xform(args):
+    """Feature transform over synthetic histories: the old pandas + robust_scale path vs NumPy-native xform_data
+    (SketchScaler), float64 & float32. mem is the resident size of all_observations; max|diff| is against the old
+    path, so it includes the sketch's quantile error."""
+    import numpy as np
+    hypers = dict(arbitrage=True, indicators_count=0, indicators_window=0)
+    print('rows	pandas(s)	numpy(s)	numpy32(s)	mem64(MB)	mem32(MB)	max|diff|')
+    for n in args.lengths:
+        df = _synthetic_history(int(n))
+        env, env32 = _bare_env(hypers), _bare_env(hypers, float32=True)
+        t_pd, (ref, _) = timed(_xform_pandas, env, df)
+        t_np, (obs, _) = timed(env.xform_data, df)
+        t_32, (obs32, _) = timed(env32.xform_data, df)
+        err = float(np.nanmax(np.abs(obs - ref))) if len(obs) else 0.
+        print(f'{int(n)}\t{"%.3f" % t_pd}\t{"%.3f" % t_np}\t{"%.3f" % t_32}\t'
+              f'{"%.1f" % (obs.nbytes / 1e6)}\t{"%.1f" % (obs32.nbytes / 1e6)}\t{"%.2g" % err}')
+
+
+def _stepping_env(hypers, n_rows=100000, n_cols=20, **cli_args):
+    """_bare_env plus random observations & whatever reset()/execute() touch, ready to step through one episode"""
+    import numpy as np
+    from box import Box
+    from btc_env import Mode
+    env = _bare_env(dict(dict(action_type='single_discrete', step_window=300), **hypers), **cli_args)
+    env.conv2d = env.hypers['net.type'] == 'conv2d'
+    env.mode, env.start_cash, env.start_value, env.min_trade, env.ep = Mode.TRAIN, .4, .4, .01, None
+    env.acc = Box(episode=dict(i=0, total_steps=0, sharpes=[], returns=[], uniques=[]), step=dict(),
+                  tests=dict(i=0, n_tests=0))
+    env.all_observations = np.random.randn(n_rows, n_cols)
+    env.all_prices = np.random.randn(n_rows).cumsum() + 10000
+    env.all_prices_diff = env.diff(env.all_prices)
+    env.offset, env.limit = env.hypers.step_window + 1, env.EPISODE_LEN
+    env.prices_diff = env.all_prices_diff[env.offset:env.offset + env.limit]
+    return env
+
+
+def _run_episode(env, actions):
+    """Steps taken (the episode can end early, on cash|value < 0)"""
+    env.reset()
+    for i, a in enumerate(actions):
+        _, terminal, _ = env.execute(a)
+        if terminal: return i + 1
+    return len(actions)
+
+
+def bench_windows(args):
+    """conv2d observations: per-step slice + expand_dims (before) vs handing out views of one strided window array,
+    and env steps/sec through a whole episode, for each `--windows` step_window. batch64 is get_states() for 64
+    random steps (a memory/batch update's worth)."""
+    import numpy as np
+    print('step_window\tslice(us)\tview(us)\tbatch64(us)\tsteps/sec')
+    for w in args.windows:
+        env = _stepping_env({'net.type': 'conv2d', 'step_window': w})
+        obs, steps = env.all_observations, range(env.limit - 1)
+
+        def sliced():
+            for i in steps:
+                i = i + env.offset
+                np.expand_dims(obs[i - w + 1:i + 1], axis=1)
+
+        def viewed():
+            for i in steps: env.get_next_state(i, None)
+
+        t_slice, _ = timed(sliced)
+        t_view, _ = timed(viewed)
+        t_batch, _ = timed(env.get_states, np.random.randint(0, env.limit, 64))
+        actions = np.random.randint(0, 3, env.limit)
+        t_ep, n_steps = timed(_run_episode, env, actions)
+        per = 1e6 / len(steps)
+        print(f'{w}\t{"%.2f" % (t_slice * per)}\t{"%.2f" % (t_view * per)}\t{"%.1f" % (t_batch * 1e6)}\t'
+              f'{int(n_steps / t_ep)}')
+
+
+def bench_step(args):
+    """Env-only stepping (reset + execute through whole episodes, no agent), steps/sec per action type"""
+    import numpy as np
+    print('action_type\tsteps/sec')
+    for action_type in ('single_discrete', 'single_continuous', 'multi'):
+        env = _stepping_env({'net.type': 'lstm', 'action_type': action_type})
+        if action_type == 'single_discrete':
+            actions = list(np.random.randint(0, 3, env.limit))
+        elif action_type == 'single_continuous':
+            actions = list(np.random.uniform(-.05, .05, env.limit))
+        else:
+            actions = [dict(action=a, amount=b) for a, b in
+                       zip(np.random.randint(0, 3, env.limit), np.random.uniform(0, .05, env.limit))]
+        t, steps = timed(_run_episode, env, actions, repeat=5)
+        print(f'{action_type}\t{int(steps / t)}')
+
+
+def bench_vec(args):
+    """VecBitcoinEnv env-steps/sec (episodes x steps, all rows counted) for each `--n-envs`, single_discrete. Compare
+    with bench_step's single_discrete, the one-episode execute() loop."""
+    import numpy as np
+    from data import data
+    from vec_env import VecBitcoinEnv
+    env = _stepping_env({'net.type': 'lstm', 'arbitrage': False})
+    env.conn = None
+    data.count_rows = lambda *args, **kwargs: len(env.all_prices)  # use_dataset()'s offsets, w/o a DB
+    n_steps = 2000
+    print('n_envs	steps/sec')
+    for n in args.n_envs:
+        vec = VecBitcoinEnv(env, n)
+        actions = np.random.randint(0, 3, (n_steps, n))
+
+        def run():
+            vec.reset()
+            for a in actions: vec.step(a)
+
+        t, _ = timed(run)
+        print(f'{n}\t{int(n * n_steps / t)}')
+
+
+def bench_backtest(args):
+    """Scoring a whole action array: backtest.backtest() (pure Python, and numba-compiled if it's installed) vs
+    stepping execute() through it, steps/sec. Runs the `--lengths` as windows (no kill, so every step counts)"""
+    import numpy as np
+    import trading
+    from backtest import backtest, pct_changes
+    print('rows\texecute\tbacktest\tbacktest(jit)')
+    env = _stepping_env({'net.type': 'lstm'})
+    t_env, steps = timed(_run_episode, env, list(np.random.randint(0, 3, env.limit)))
+    jit = trading.JIT
+    for n in args.lengths:
+        prices_diff = pct_changes(np.random.randn(int(n)).cumsum() + 10000)
+        actions = np.random.randint(0, 3, int(n))
+        rates = []
+        for trading.JIT in ([False, True] if trading.numba else [False]):
+            backtest('single_discrete', actions[:10], prices_diff[:10])  # compile outside the timing
+            t, _ = timed(backtest, 'single_discrete', actions, prices_diff, kill=False)
+            rates.append(str(int(n / t)))
+        print(f'{int(n)}\t{int(steps / t_env)}\t' + '\t'.join(rates))
+    trading.JIT = jit
+
+
+def _rss_mb():
+    """This process's resident set size (Linux)"""
+    with open('/proc/self/status') as f:
+        return int(next(l for l in f if l.startswith('VmRSS')).split()[1]) / 1024
+
+
+def bench_outofcore(args):
+    """Training-style episodes (random offsets via use_dataset, reset + execute through each) over a `--rows` x 32
+    float32 history on disk, loaded three ways: fully into RAM, memory-mapped, and memory-mapped + chunked
+    (OUT_OF_CORE, chunked.py). steps/sec, and how much resident memory that took (MB over the process' baseline),
+    each in a fresh (forked) process."""
+    import os, tempfile, multiprocessing
+    import numpy as np
+    from data import data
+    n = int(args.rows)
+    path = os.path.join(tempfile.gettempdir(), f'bench_outofcore_{n}.npy')
+    if not os.path.exists(path):
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(n, 32))
+        for start in range(0, n, 1 << 20): out[start:start + (1 << 20)] = np.random.randn(min(1 << 20, n - start), 32)
+        del out
+    prices_diff = np.random.randn(n) * 1e-3
+
+    def run(how, queue):
+        data.config_json['OUT_OF_CORE'] = how == 'chunked'
+        data.count_rows = lambda *args, **kwargs: n
+        env = _stepping_env({'net.type': 'lstm', 'arbitrage': False}, n_rows=10)
+        env.conn = None
+        env.all_prices_diff = prices_diff
+        base = _rss_mb()
+        env.all_observations = np.load(path, mmap_mode=None if how == 'ram' else 'r')
+        actions = list(np.random.randint(0, 3, env.EPISODE_LEN))
+        start, steps = time.time(), 0
+        for _ in range(args.episodes):
+            env.use_dataset(Mode.TRAIN)
+            env.get_states(np.arange(env.limit)).sum()  # read the episode's states, like the agent would
+            steps += _run_episode(env, actions)
+        queue.put((steps / (time.time() - start), _rss_mb() - base))
+
+    from btc_env import Mode
+    print(f'{n} rows ({"%.0f" % (n * 32 * 4 / 1e6)}MB), {args.episodes} episodes')
+    print('how\tsteps/sec\t+rss(MB)')
+    for how in ('ram', 'mmap', 'chunked'):
+        queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=run, args=(how, queue))
+        proc.start()
+        rate, rss = queue.get()
+        proc.join()
+        print(f'{how}\t{int(rate)}\t{"%.0f" % rss}')
+
+
+class _MatmulAgent(object):
+    """Stand-in for a TensorForce agent in rollouts: act() is a dense layer over the state (BLAS, so like a TF session
+    run it drops the GIL), observe() a no-op"""
+    def __init__(self, n_in, n_out=256, weights=None):
+        import numpy as np
+        self.weights = np.random.randn(n_in, n_out) * .01 if weights is None else weights
+
+    def reset(self): pass
+
+    def act(self, state):
+        import numpy as np
+        return int(np.argmax((state['series'].reshape(-1) @ self.weights)[:3]))
+
+    def observe(self, terminal, reward): pass
+
+
+def bench_rollouts(args):
+    """Parallel rollouts (rollouts.py): timesteps/sec for each `--workers` K envs in threads, conv2d single_discrete,
+    with _MatmulAgent standing in for the agent. Scaling is against K=1; ~1 means the threads don't overlap (the GIL),
+    see rollouts.py."""
+    import numpy as np
+    from rollouts import ParallelRollouts
+    env = _stepping_env({'net.type': 'conv2d', 'step_window': 300})
+    agent = _MatmulAgent(env.hypers.step_window * env.all_observations.shape[1])
+    n_steps = 5000
+    print('n_envs	steps/sec	scaling')
+    base = None
+    for k in args.workers:
+        rollouts = ParallelRollouts(env, agent, lambda worker_of: _MatmulAgent(0, weights=worker_of.weights), k)
+        t, _ = timed(rollouts.run, n_steps)
+        rollouts.close()
+        base = base or n_steps / t
+        print(f'{k}\t{int(n_steps / t)}\t{"%.2f" % (n_steps / t / base)}')
+
+
+BENCHES = dict(
+    alignment=bench_alignment,
+    engines=bench_engines,
+    xform=bench_xform,
+    windows=bench_windows,
+    step=bench_step,
+    vec=bench_vec,
+    backtest=bench_backtest,
+    outofcore=bench_outofcore,
+    rollouts=bench_rollouts,
+)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('names', nargs='+', choices=list(BENCHES))
+    parser.add_argument('--lengths', type=float, nargs='+', default=[1e4, 1e5, 1e6], help="History lengths (rows)")
+    parser.add_argument('--urls', nargs='*', help="DB URLs to compare (engines)")
+    parser.add_argument('--windows', type=int, nargs='+', default=[50, 100, 200, 300], help="conv2d step_windows (windows); hypersearch's is 300")
+    parser.add_argument('--rows', type=float, default=4e6, help="History length (outofcore)")
+    parser.add_argument('--episodes', type=int, default=50, help="Episodes per run (outofcore)")
+    parser.add_argument('--n-envs', type=int, nargs='+', default=[1, 16, 64, 256], help="Batch sizes (vec)")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16], help="Parallel envs (rollouts), up to your core count")
+    args = parser.parse_args()
+    for name in args.names:
+        print(f'--- {name} ---')
+        BENCHES[name](args)
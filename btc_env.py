@@ -10,20 +10,48 @@ I actually do want to try NervanaSystems/Coach, that one's new since I started d
 env back to Gym format. Anyone wanna give it a go?
 """
 
-import random, time, requests, pdb, gdax, math, pickle, os, shutil
+import random, time, requests, pdb, gdax, math, pickle, os, shutil, copy
+from collections import OrderedDict
 from scipy.stats import truncnorm
 from enum import Enum
 import numpy as np
 import pandas as pd
-import talib.abstract as tlib
 from box import Box
 from tensorforce.environments import Environment
 from tensorforce.execution import Runner
-from sklearn import preprocessing
 from sklearn.pipeline import make_pipeline
-from data.data import Exchange, EXCHANGE
+from data.data import EXCHANGE
 from data import data
+from data.features import FeatureStore, feature_key
+from data import shm
 from autoencoder import AutoEncoder
+import indicators
+from streaming import FeatureStream, Rows
+from chunked import ChunkedObservations
+from evaluator import FeedForwardPolicy
+from scaler import SketchScaler
+from trading import EpisodeState, action_pct, trade, MIN_TRADE
+
+
+def ffill(values, bad):
+    """`values` with the `bad` positions forward-filled from the last good one (back-filled at the very start), ie
+    pandas' .mask(bad).ffill().bfill(), without the Series"""
+    if not bad.any(): return values
+    good = np.flatnonzero(~bad)
+    if not len(good): return np.full(len(values), np.nan)
+    idx = np.where(bad, 0, np.arange(len(values)))
+    np.maximum.accumulate(idx, out=idx)
+    idx[:good[0]] = good[0]
+    return values[idx]
+
+
+def window_view(arr, window):
+    """Every length-`window` run of `arr`'s rows, as a read-only [n - window + 1, window, 1, cols] strided view. No
+    copying: windows[k] is arr[k:k + window] with conv2d's extra height axis, and handing one out allocates nothing."""
+    n, cols = arr.shape
+    s0, s1 = arr.strides
+    return np.lib.stride_tricks.as_strided(arr, shape=(max(n - window + 1, 0), window, 1, cols),
+                                           strides=(s0, s0, 0, s1), writeable=False)
 
 
 class Mode(Enum):
@@ -35,11 +63,47 @@ class Mode(Enum):
 # See 6fc4ed2 for Scaling states/rewards
 
 
+class WarmStart(object):
+    """What a long-lived hypersearch worker (hypersearch.py --persistent) keeps between trials, so each trial's new
+    BitcoinEnv doesn't redo it: the DB connection, the BTC price, and the loaded feature arrays of the last few feature
+    configs (as load_features() got them, mostly memmaps, so holding on is cheap). The ones that came out of /dev/shm
+    stay attached while they're kept, and are released when they drop out."""
+    def __init__(self, n_features=2):
+        self.conn = data.engine.connect()
+        self.btc_price = None
+        self.features = OrderedDict()  # feature key -> stored arrays, most recently used last
+        self.shared = {}  # feature key -> the SharedFeatures holding it, for those in /dev/shm
+        self.n_features = n_features
+
+    def get_features(self, key):
+        stored = self.features.get(key)
+        if stored is not None: self.features.move_to_end(key)
+        return stored
+
+    def put_features(self, key, stored, shared=None):
+        """:param shared: the SharedFeatures `key` is attached in, if it is; released once `key` drops out"""
+        self.features[key] = stored
+        if shared: self.shared[key] = shared
+        while len(self.features) > self.n_features: self._drop(next(iter(self.features)))
+
+    def _drop(self, key):
+        del self.features[key]
+        shared = self.shared.pop(key, None)
+        if shared: shared.release(key)
+
+    def close(self):
+        for key in list(self.features): self._drop(key)
+        self.conn.close()
+
+
 class BitcoinEnv(Environment):
     EPISODE_LEN = 5000
+    LIVE_POLL_SECS = 1  # LIVE/TEST_LIVE: how often to check for new ticks, once caught up to the newest row
 
-    def __init__(self, hypers, cli_args={}):
-        """Initialize hyperparameters (done here instead of __init__ since OpenAI-Gym controls instantiation)"""
+    def __init__(self, hypers, cli_args={}, warm=None):
+        """Initialize hyperparameters (done here instead of __init__ since OpenAI-Gym controls instantiation)
+        :param warm: a WarmStart to take the connection/price/features from (and leave them in), across trials
+        """
         self.hypers = h = Box(hypers)
         self.conv2d = self.hypers['net.type'] == 'conv2d'
         self.cli_args = cli_args
@@ -59,23 +123,26 @@ class BitcoinEnv(Environment):
                 returns=[],
                 uniques=[],
             ),
-            step=dict(),  # setup in reset()
+            step=None,  # an EpisodeState, setup in reset()
             tests=dict(
                 i=0,
                 n_tests=0
             )
         )
         self.mode = Mode.TRAIN
-        self.conn = data.engine.connect()
+        self.ep = None  # current episode's EpisodeState, see reset()
+        self.prefetch = None  # an EpisodePrefetcher, while train_and_test() runs
+        self.warm = warm
+        self.conn = warm.conn if warm else data.engine.connect()
+        self.saved_fit = None  # see load_fit()
+        self.shared_key = None  # the /dev/shm feature entry we're attached to, see load_features()
 
-        # gdax min order size = .01btc; kraken = .002btc
-        self.min_trade = {Exchange.GDAX: .01, Exchange.KRAKEN: .002}[EXCHANGE]
-        self.update_btc_price()
+        self.min_trade = MIN_TRADE
+        if warm and warm.btc_price: self.btc_price = warm.btc_price
+        else: self.update_btc_price()
+        if warm: warm.btc_price = self.btc_price
 
-        # Our data is too high-dimensional for the way MemoryModel handles batched episodes. Reduce it (don't like this)
-        all_data = data.db_to_dataframe(self.conn, arbitrage=h.arbitrage)
-        self.all_observations, self.all_prices = self.xform_data(all_data)
-        self.all_prices_diff = self.diff(self.all_prices, True)
+        self.load_features()
 
         # Action space
         if h.action_type == 'single_discrete':
@@ -106,7 +173,10 @@ class BitcoinEnv(Environment):
 
     def __str__(self): return 'BitcoinEnv'
 
-    def close(self): self.conn.close()
+    def close(self):
+        if self.warm: return  # the connection & features are the worker's, for the next trial
+        self.conn.close()
+        if self.shared_key: shm.shared_features().release(self.shared_key)
 
     @property
     def states(self): return self.states_
@@ -124,19 +194,90 @@ class BitcoinEnv(Environment):
         except:
             self.btc_price = self.btc_price or 8000
 
-    def diff(self, arr, percent=True):
-        series = pd.Series(arr)
-        diff = series.pct_change() if percent else series.diff()
-        diff.iloc[0] = 0  # always NaN, nothing to compare to
-
-        # Remove outliers (turn them to NaN)
-        q = diff.quantile(0.99)
-        diff = diff.mask(diff > q, np.nan)
-
-        # then forward-fill the NaNs.
-        return diff.replace([np.inf, -np.inf], np.nan).ffill().bfill().values
-
-    def xform_data(self, df):
+    def _diff(self, arr, percent=True):
+        arr = np.asarray(arr, dtype=np.float64)
+        diff = np.empty(len(arr))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if percent:
+                arr = ffill(arr, np.isnan(arr))  # pct_change pads gaps first
+                np.divide(arr[1:], arr[:-1], out=diff[1:])
+                diff[1:] -= 1
+            else:
+                np.subtract(arr[1:], arr[:-1], out=diff[1:])
+        diff[:1] = 0  # always NaN, nothing to compare to
+        return diff
+
+    def diff_quantile(self, arr, percent=True):
+        """The outlier cutoff diff() uses for `arr`"""
+        with np.errstate(invalid='ignore'):  # infs (a price of 0) make the interpolation NaN-y, same as pandas'
+            return np.nanpercentile(self._diff(arr, percent), 99)
+
+    def diff(self, arr, percent=True, q=None):
+        diff = self._diff(arr, percent)
+
+        # Remove outliers (and infs/NaNs), then forward-fill over them. `q` overrides the cutoff, eg with one fit
+        # earlier (see xform_fit)
+        with np.errstate(invalid='ignore'):
+            if q is None: q = np.nanpercentile(diff, 99)
+            return ffill(diff, (diff > q) | ~np.isfinite(diff))
+
+    def load_features(self):
+        """Sets all_observations/all_prices/all_prices_diff. These only depend on the data & the feature hypers, so
+        they're stored in data/features.py; trials sharing a feature config mmap them rather than re-running
+        xform_data over the full history. Processes running at the same time also share one copy in RAM (data/shm.py,
+        `SHARED_FEATURES_GB` in config.json, 0 to turn off)."""
+        h = self.hypers
+        self.features = store = FeatureStore(max_bytes=int(data.config_json.get('FEATURE_CACHE_GB', 5) * 1024**3))
+        version = data.data_version(self.conn, arbitrage=h.arbitrage)
+        spec = dict(data=version, arbitrage=bool(h.arbitrage), indicators_count=h.indicators_count,
+                    indicators_window=h.indicators_window, autoencode=bool(self.cli_args.autoencode),
+                    float32=bool(self.cli_args.float32))
+        key = feature_key(**spec)
+        # Unversioned data (cache off) can't tell one process' data from another's, so that stays private
+        shm_gb = data.config_json.get('SHARED_FEATURES_GB', 4)
+        shared = version and shm_gb and shm.available() and shm.shared_features(int(shm_gb * 1024**3))
+        # A persistent worker (WarmStart) still has it from a recent trial, if that used the same feature config
+        warm = version and self.warm
+        stored = (warm and warm.get_features(key)) or (shared and shared.attach(key)) or (version and store.get(key))
+        if not stored:
+            # Our data is too high-dimensional for the way MemoryModel handles batched episodes. Reduce it (don't like
+            # this)
+            all_data = data.db_to_dataframe(self.conn, arbitrage=h.arbitrage)
+            observations, prices = self.xform_data(all_data, data_version=version)
+            # Outliers cut at the fit's diff_q, same as the target column, live ticks & backtest.replay(q=...)
+            stored = dict(observations=observations, prices=prices,
+                          prices_diff=self.diff(prices, True, q=self.xform_fit['diff_q']),
+                          xform_fit=self.xform_fit)
+            if version:
+                store.put(key, spec=spec, pickles=dict(xform_fit=self.xform_fit), observations=observations,
+                          prices=prices, prices_diff=stored['prices_diff'])
+        if shared and key not in shared.attached:
+            # First one here: publish for everyone else, and use the shared copy ourselves (dropping our own). No
+            # room in /dev/shm, we keep ours
+            stored = shared.publish(key, spec=spec, pickles=dict(xform_fit=stored['xform_fit']),
+                                    **{k: stored[k] for k in ('observations', 'prices', 'prices_diff')}) or stored
+        self.all_observations, self.all_prices, self.all_prices_diff = \
+            stored['observations'], stored['prices'], stored['prices_diff']
+        self.xform_fit = stored['xform_fit']
+        if shared and key in shared.attached: self.shared_key = key
+        if warm: warm.put_features(key, stored, shared=self.shared_key and shared)
+
+    def indicator_bank(self, ohlcv, table, data_version=None):
+        """This table's indicators at our `indicators_window`. For a known data version & a window in the bank, these
+        come out of the stored bank (see indicators.py); the first trial to need it builds it for everyone."""
+        w = self.hypers.indicators_window
+        names = {indicators.col_name(table, ind, w): ind for ind in indicators.INDICATORS}
+        if not data_version or w not in indicators.WINDOWS:
+            return {col: indicators.compute(ohlcv, ind, w) for col, ind in names.items()}
+        spec = dict(data=data_version, bank=table, windows=indicators.WINDOWS, indicators=indicators.INDICATORS)
+        key = feature_key(**spec)
+        stored = self.features.get(key, list(names))
+        if stored: return stored
+        bank = indicators.bank(ohlcv, table)
+        self.features.put(key, spec=spec, **bank)
+        return {col: bank[col] for col in names}
+
+    def xform_data(self, df, data_version=None, fit=None):
         """
         Some special handling of the price data. First, we don't want prices to be absolute, since we wan't the agent
         to learn actions _relative_ to states; that is, states need to be transformed into "relative" some how. This
@@ -148,53 +289,53 @@ class BitcoinEnv(Environment):
         Anchor all the price fields to the target (close-price); so they're relative w/i the cross-section. Then set
         target to its percent-change over time. Leave the volume stuff alone, we _do_ want that absolute. Then scale
         everything. Crazy, I know; but IMO makes sense. Hit me if you have a better idea.
+        :param fit: a prior fit (xform_fit, eg loaded by load_fit()) to transform with, rather than fitting on `df`
         """
-        columns = []
         ind_ct = self.hypers.indicators_count
         tables_ = data.get_tables(self.hypers.arbitrage)
-        for table in tables_:
-            for col in table['cols']:
-                name_col = f'{table["name"]}_{col}'
-                if name_col == data.target:
-                    columns.append(self.diff(df[name_col], True))
-                elif col in table['price_cols']:
-                    columns.append(df[name_col]/df[data.target])
-                else:
-                    columns.append(df[name_col])
-
-            # Add extra indicator columns
-            ohlcv = table.get('ohlcv', {})
-            if ohlcv and ind_ct:
-                ind = pd.DataFrame()
-                # TA-Lib requires specifically-named columns (OHLCV)
-                for k, v in ohlcv.items():
-                    ind[k] = df[f"{name}_{v}"]
-
-                # Sort these by effectiveness. I'm no expert, so if this seems off please submit a PR! Later after
-                # you've optimized the other hypers, come back here and create a hyper for every indicator you want to
-                # try (zoom in on indicators)
-                best_indicators = [
-                    tlib.MOM,
-                    tlib.SMA,
-                    # tlib.BBANDS,  # TODO signature different; special handling
-                    tlib.RSI,
-                    tlib.EMA,
-                    tlib.ATR
-                ]
-                for i in range(ind_ct):
-                    columns.append(best_indicators[i](ind, timeperiod=self.hypers.indicators_window) / df[data.target])
-
-        states = np.column_stack(columns)
-        prices = df[data.target].values
+        target = df[data.target].values.astype(np.float64)
 
         # Remove padding at the start of all data. Indicators are aggregate fns, so don't count until we have
         # that much historical data
-        if ind_ct:
-            states = states[self.hypers.indicators_window:]
-            prices = prices[self.hypers.indicators_window:]
+        pad = self.hypers.indicators_window if ind_ct else 0
+
+        # Every column gets written straight into one preallocated matrix (float32 with --float32, which halves
+        # all_observations; the math is still float64, just stored narrower)
+        n_cols = sum(len(t['cols']) + (ind_ct if t.get('ohlcv') else 0) for t in tables_)
+        dtype = np.float32 if self.cli_args.float32 else np.float64
+        states = np.empty((max(len(df) - pad, 0), n_cols), dtype=dtype)
+        j = 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for table in tables_:
+                for col in table['cols']:
+                    name_col = f'{table["name"]}_{col}'
+                    values = df[name_col].values.astype(np.float64)
+                    if name_col == data.target:
+                        diff_q = fit['diff_q'] if fit else self.diff_quantile(values, True)
+                        values = self.diff(values, True, q=diff_q)
+                    elif col in table['price_cols']:
+                        values = values / target
+                    states[:, j] = values[pad:]
+                    j += 1
+
+                # Add extra indicator columns
+                ohlcv = table.get('ohlcv', {})
+                if ohlcv and ind_ct:
+                    # TA-Lib wants OHLCV-named inputs
+                    ind = {k: df[f"{table['name']}_{v}"].values.astype(np.float64) for k, v in ohlcv.items()}
+                    bank = self.indicator_bank(ind, table['name'], data_version)
+                    for name in indicators.INDICATORS[:ind_ct]:
+                        col = indicators.col_name(table['name'], name, self.hypers.indicators_window)
+                        np.divide(bank[col][pad:], target[pad:], out=states[:, j], casting='same_kind')
+                        j += 1
+        prices = target[pad:]
 
         # Pre-scale all price actions up-front, since they don't change. We'll scale changing values real-time elsewhere
-        states = preprocessing.robust_scale(states, quantile_range=(1., 99.))
+        scaler = fit['scaler'] if fit else SketchScaler(quantile_range=(1., 99.)).fit(states)
+        states = scaler.transform(states, copy=False)
+        # What this transform learned from `df`. Saved with the model (save_fit()), and streaming.FeatureStream
+        # carries on from it for live ticks
+        self.xform_fit = dict(diff_q=diff_q, scaler=scaler)
 
         # Reducing the dimensionality of our states (OHLCV + indicators + arbitrage => 5 or 6 weights)
         # because TensorForce's memory branch changed Policy Gradient models' batching from timesteps to episodes.
@@ -213,206 +354,280 @@ class BitcoinEnv(Environment):
         self.mode = mode
         if mode in (Mode.LIVE, Mode.TEST_LIVE):
             self.conn = data.engine_live.connect()
-            # Work with 6000 timesteps up until the present (play w/ diff numbers, depends on LSTM)
-            # Offset=0 data.py currently pulls recent-to-oldest, then reverses
-            rampup = int(1e5)  # 6000  # FIXME temporarily using big number to build up Scaler (since it's not saved)
-            limit, offset = (rampup, 0)  # if not self.conv2d else (self.hypers.step_window + 1, 0)
+            # Work with 6000 timesteps up until the present (play w/ diff numbers, depends on LSTM). limit=x means
+            # the newest x rows; from the cache that's just its tail, the DB is only asked for what's new since.
+            # Without a saved fit (load_fit()) we need a big ramp-up to re-learn the scaler from
+            rampup = 6000 if self.saved_fit else int(1e5)
+            limit, offset = rampup, 0  # if not self.conv2d else self.hypers.step_window + 1
             df, self.last_timestamp = data.db_to_dataframe(
-                self.conn, limit=limit, offset=offset, arbitrage=self.hypers.arbitrage, last_timestamp=True)
-            # save away for now so we can keep transforming it as we add new data (find a more efficient way)
-            self.df = df
+                self.conn, limit=limit, arbitrage=self.hypers.arbitrage, last_timestamp=True)
+            # Transform the ramp-up (with the saved fit, if any), then carry on a tick at a time (see add_ticks())
+            observations, prices = self.xform_data(df, fit=self.saved_fit)
+            self.stream = self.feature_stream()
+            if self.stream: self.stream.warm(df)
+            else: self.df = df  # no stream, so each tick re-transforms the lot (see add_ticks())
+            self._set_live(observations, prices)
+            # (indicator padding leaves fewer rows than `limit` asked for)
+            self.use_window(dict(mode=mode, offset=offset, limit=len(prices) - offset, block=None))
         else:
-            row_ct = data.count_rows(self.conn, arbitrage=self.hypers.arbitrage)
-            split = .9  # Using 90% training data.
-            n_train, n_test = int(row_ct * split), int(row_ct * (1 - split))
-            if mode == mode.TEST:
-                offset = n_train
-                limit = 40000 if full_set else 10000  # should be `n_test` in full_set, getting idx errors
-            else:
-                # Grab a random window from the 90% training data. The random bit is important so the agent
-                # sees a variety of data. The window-size bit is a hack: as long as the agent doesn't die (doesn't cause
-                # `terminal=True`), PPO's MemoryModel can keep filling up until it crashes TensorFlow. This ensures
-                # there's a stopping point (limit). I'd rather see how far he can get w/o dying, figure out a solution.
-                limit = self.EPISODE_LEN
-                offset_start = 0 if not self.conv2d else self.hypers.step_window + 1
-                offset = random.randint(offset_start, n_train - self.EPISODE_LEN)
-
-        self.offset, self.limit = offset, limit
-        self.prices = self.all_prices[offset:offset+limit]
-        self.prices_diff = self.all_prices_diff[offset:offset+limit]
+            self.use_window(self.prepare_window(mode, full_set))
+
+    def prepare_window(self, mode, full_set=False, row_ct=None, read=True):
+        """use_dataset()'s TRAIN/TEST window, ready for use_window(). Doesn't touch the env's current window, so it
+        can be done ahead of time (see prefetch.py).
+        :param row_ct: the history's row count, if you have it (saves counting again)
+        :param read: with OUT_OF_CORE, page in the window's block. False for just the offset & limit (eg
+            VecBitcoinEnv, which indexes the whole history itself)
+        """
+        if row_ct is None: row_ct = data.count_rows(self.conn, arbitrage=self.hypers.arbitrage)
+        split = .9  # Using 90% training data.
+        n_train, n_test = int(row_ct * split), int(row_ct * (1 - split))
+        if mode == mode.TEST:
+            offset = n_train
+            limit = 40000 if full_set else 10000  # should be `n_test` in full_set, getting idx errors
+        else:
+            # Grab a random window from the 90% training data. The random bit is important so the agent
+            # sees a variety of data. The window-size bit is a hack: as long as the agent doesn't die (doesn't cause
+            # `terminal=True`), PPO's MemoryModel can keep filling up until it crashes TensorFlow. This ensures
+            # there's a stopping point (limit). I'd rather see how far he can get w/o dying, figure out a solution.
+            limit = self.EPISODE_LEN
+            offset_start = 0 if not self.conv2d else self.hypers.step_window + 1
+            offset = random.randint(offset_start, n_train - self.EPISODE_LEN)
+        block = None
+        if self.chunked and read:
+            # Out-of-core: page in the window now. conv2d's first window reaches step_window - 1 rows back
+            lo = offset - (self.hypers.step_window - 1 if self.conv2d else 0)
+            block = self.chunked.read(lo, offset + limit)
+        return dict(mode=mode, offset=offset, limit=limit, block=block)
+
+    def use_window(self, window):
+        """Switch to a prepare_window() window"""
+        self.mode, self.offset, self.limit = window['mode'], window['offset'], window['limit']
+        self.prices = self.all_prices[self.offset:self.offset + self.limit]
+        self.prices_diff = self.all_prices_diff[self.offset:self.offset + self.limit]
+        if window['block'] is not None: self.set_block(*window['block'])
+
+    def feature_stream(self):
+        """Incremental xform_data, picking up from the last xform_data() fit (see streaming.py). None if these
+        features can't be streamed (--autoencode refits its autoencoder per transform)"""
+        if self.cli_args.autoencode: return None
+        h = self.hypers
+        return FeatureStream(data.get_tables(h.arbitrage), data.target, h.indicators_count, h.indicators_window,
+                             **self.xform_fit)
+
+    def save_fit(self, directory):
+        """Pickles the feature transform's fit (outlier cutoff + scaler, see xform_data) as `<directory>/scaler.pkl`,
+        next to the saved model, so live mode & other workers can transform the same way without re-fitting"""
+        with open(os.path.join(directory, 'scaler.pkl'), 'wb') as f:
+            pickle.dump(self.xform_fit, f)
+
+    def load_fit(self, directory):
+        """Use a fit saved by save_fit() for live data. Returns whether there was one"""
+        try:
+            with open(os.path.join(directory, 'scaler.pkl'), 'rb') as f:
+                self.saved_fit = pickle.load(f)
+        except FileNotFoundError:
+            self.saved_fit = None
+        return self.saved_fit is not None
+
+    def _set_live(self, observations, prices):
+        """LIVE/TEST_LIVE: (re)start the live arrays from a batch xform_data()"""
+        self.live = dict(observations=Rows(observations), prices=Rows(prices),
+                         prices_diff=Rows(self.diff(prices, True, q=self.xform_fit['diff_q'])))
+        self.all_observations, self.all_prices, self.all_prices_diff = \
+            [self.live[k].array for k in ('observations', 'prices', 'prices_diff')]
+
+    def add_ticks(self):
+        """LIVE/TEST_LIVE: pulls rows newer than last_timestamp and pushes each through the feature stream, so a new
+        tick costs O(1) instead of re-transforming the whole ramp-up. Returns how many came in."""
+        new, n, self.last_timestamp = data.fetch_more(self.conn, self.last_timestamp, self.hypers.arbitrage)
+        if n and self.stream is None:
+            # Can't stream these features: re-transform the whole frame, new rows on (with the same fit)
+            self.df = pd.concat([self.df, new], ignore_index=True)
+            self._set_live(*self.xform_data(self.df, fit=self.xform_fit))
+        for values in (new[self.stream.columns].values if n and self.stream else []):
+            res = self.stream.push(values)
+            if res is None: continue
+            self.live['observations'].append(res[0])
+            self.live['prices'].append(res[1])
+            self.live['prices_diff'].append(self.stream.last_diff)
+        if n and self.stream:
+            self.all_observations, self.all_prices, self.all_prices_diff = \
+                [self.live[k].array for k in ('observations', 'prices', 'prices_diff')]
+        self.prices, self.prices_diff = self.all_prices[self.offset:], self.all_prices_diff[self.offset:]
+        self.limit = len(self.prices)
+        return n
+
+    @property
+    def all_observations(self): return self._all_observations
+
+    @all_observations.setter
+    def all_observations(self, observations):
+        self._all_observations = observations
+        # Out-of-core (see chunked.py), use_dataset() pages in the part each episode needs. Not live mode's, which
+        # grows tick by tick and is small anyway
+        out_of_core = data.config_json.get('OUT_OF_CORE', False) and self.mode not in (Mode.LIVE, Mode.TEST_LIVE)
+        self.chunked = ChunkedObservations(observations) if out_of_core else None
+        self.set_block(observations, 0)
+
+    def set_block(self, observations, base):
+        """What get_next_state() & get_states() index: `observations` being all_observations[base:base + len]"""
+        self.observations, self.obs_base = observations, base
+        # conv2d states are [step_window, 1, cols] windows; view them all at once over the same buffer
+        self.windows = window_view(observations, self.hypers.step_window) if self.conv2d else None
 
     def get_next_state(self, i, stationary):
-        i = i + self.offset
-        series = self.all_observations[i]
+        i = i + self.offset - self.obs_base
+        series = self.observations[i]
 
         if self.conv2d:
             # Take note of the +1 here. LSTM uses a single index [i], which grabs the list's end. Conv uses a window,
             # [-something:i], which _excludes_ the list's end (due to Python indexing). Without this +1, conv would
-            # have a 1-step-behind delayed response.
-            window = self.all_observations[i - self.hypers.step_window + 1:i + 1]
-            series = np.expand_dims(window, axis=1)
+            # have a 1-step-behind delayed response. windows[k] is observations[k:k + step_window].
+            series = self.windows[i - self.hypers.step_window + 1]
         return dict(series=series, stationary=stationary)
 
+    def get_states(self, idx):
+        """Batched get_next_state()['series'] for many (episode-relative) steps at once, eg to fill a memory/batch
+        update in one go. This one's a copy (one contiguous [len(idx), ...] block), not views."""
+        idx = np.asarray(idx) + self.offset - self.obs_base
+        if self.conv2d:
+            return self.windows[idx - self.hypers.step_window + 1]
+        return self.observations[idx]
+
     def reset(self):
-        step_acc, ep_acc = self.acc.step, self.acc.episode
-        step_acc.i = 0
-        step_acc.cash, step_acc.value = self.start_cash, self.start_value
-        step_acc.hold_value = self.start_value
-        step_acc.totals = Box(
-            trade=[self.start_cash + self.start_value],
-            hold=[self.start_cash + self.start_value]
-        )
-        step_acc.signals = []
+        ep_acc = self.acc.episode
+        if self.ep is not None:
+            ep_acc.total_steps += self.ep.i
+        # acc.step is the same object, for outside readers (eg hypersearch saving signals)
+        self.acc.step = self.ep = EpisodeState(self.limit, self.start_cash, self.start_value)
         ep_acc.i += 1
 
         stationary = [1., 1.]
         return self.get_next_state(0, stationary)
 
     def execute(self, actions):
-        step_acc, ep_acc = self.acc.step, self.acc.episode
-        totals = step_acc.totals
-        h = self.hypers
-
-        if h.action_type == 'single_discrete':
-            act_pct = {
-                0: -.02,
-                1: 0,
-                2: .02
-            }[actions]
-        if h.action_type == 'single_continuous':
-            act_pct = actions
-        elif h.action_type == 'multi':
-            # Two actions: `action` (buy/sell/hold) and `amount` (how much)
-            act_pct = {
-                0: -1,  # make amount negative
-                1: 0,  # hold
-                2: 1  # make amount positive
-            }[actions['action']] * actions['amount']
-            # multi-action min_trade accounted for in constructor
-        act_btc = act_pct * (step_acc.cash if act_pct > 0 else step_acc.value)
-
-        fee = {
-            Exchange.GDAX: 0.0025,  # https://support.gdax.com/customer/en/portal/articles/2425097-what-are-the-fees-on-gdax-
-            Exchange.KRAKEN: 0.0026  # https://www.kraken.com/en-us/help/fees
-        }[EXCHANGE]
-
-        # Perform the trade. In training mode, we'll let it dip into negative here, but then kill and punish below.
-        # In testing/live, we'll just block the trade if they can't afford it
-        if act_pct > 0:
-            if step_acc.cash < self.min_trade:
-                act_btc = -(self.start_cash + self.start_value)
-            elif act_btc < self.min_trade:
-                act_btc = 0
-            else:
-                step_acc.value += act_btc - act_btc*fee
-            step_acc.cash -= act_btc
-
-        elif act_pct < 0:
-            if step_acc.value < self.min_trade:
-                act_btc = -(self.start_cash + self.start_value)
-            elif abs(act_btc) < self.min_trade:
-                act_btc = 0
-            else:
-                step_acc.cash += abs(act_btc) - abs(act_btc)*fee
-            step_acc.value -= abs(act_btc)
+        ep = self.ep
+        act_pct = action_pct(self.hypers.action_type, actions)
+        start_total = self.start_cash + self.start_value
+        ep.cash, ep.value, act_btc = trade(act_pct, ep.cash, ep.value, self.min_trade, start_total)
 
-        step_acc.signals.append(float(act_btc))
+        live = self.mode in (Mode.LIVE, Mode.TEST_LIVE)
+        # Caught up with the newest row: wait for the market's next move (ticks come in through add_ticks())
+        while live and ep.i + 1 >= self.limit:
+            if not self.add_ticks(): time.sleep(self.LIVE_POLL_SECS)
 
         # next delta. [1,2,2].pct_change() == [NaN, 1, 0]
-        pct_change = self.prices_diff[step_acc.i + 1]
-
-        step_acc.value += pct_change * step_acc.value
-        total_now = step_acc.value + step_acc.cash
-        totals.trade.append(total_now)
-
-        # calculate what the reward would be "if I held", to calculate the actual reward's _advantage_ over holding
-        hold_before = step_acc.hold_value
-        step_acc.hold_value += pct_change * hold_before
-        totals.hold.append(step_acc.hold_value + self.start_cash)
+        ep.step(float(act_btc), self.prices_diff[ep.i + 1])
 
         reward = 0
 
-        step_acc.i += 1
-        ep_acc.total_steps += 1
-
-        stationary = [step_acc.cash/self.start_cash, step_acc.value/self.start_value]
-        next_state = self.get_next_state(step_acc.i, stationary)
+        stationary = [ep.cash/self.start_cash, ep.value/self.start_value]
+        next_state = self.get_next_state(ep.i, stationary)
 
-        terminal = int(step_acc.i + 1 >= self.limit)
-        if step_acc.value < 0 or step_acc.cash < 0:
+        terminal = int(ep.i + 1 >= self.limit) if not live else False  # live goes on, a tick at a time
+        if ep.value < 0 or ep.cash < 0:
             terminal = True
         if terminal and self.mode in (Mode.TRAIN, Mode.TEST):
             # We're done.
-            step_acc.signals.append(0)  # Add one last signal (to match length)
-            reward = self.sharpe()
+            ep.finish()
+            reward = ep.sharpe()
 
-        if terminal and self.mode in (Mode.LIVE, Mode.TEST_LIVE):
+        if terminal and live:
             # See 6fc4ed2 for prior live-mode code which worked. Much has changed since then and it won't work in
             # that state, so removing and leaving to you to fix (and submit PR please!)
             raise NotImplementedError
 
-        # if step_acc.value <= 0 or step_acc.cash <= 0: terminal = 1
+        # if ep.value <= 0 or ep.cash <= 0: terminal = 1
         return next_state, terminal, reward
 
-    def sharpe(self):
-        """https://www.investopedia.com/terms/s/sharperatio.asp
-        = (portfolio_return - risk_free_rate) / (portfolio_std - risk_free_std)
-        """
-        totals = self.acc.step.totals
-        if np.count_nonzero(totals.trade) == 0:
-            return 0.
-        diff = (pd.Series(totals.trade).pct_change() - pd.Series(totals.hold).pct_change())[1:]
-        numerator = self.cumm_return()  # diff.mean()
-        denominator = 1  # FIXME cumm_return / std() in different scales, getting funky results
-        # denominator = pd.Series(totals.trade).pct_change().std() - pd.Series(totals.hold).pct_change.std()
-        return numerator / denominator
-
-    def cumm_return(self):
-        totals = self.acc.step.totals
-        return (totals.trade[-1] / totals.trade[0] - 1) - (totals.hold[-1] / totals.hold[0] - 1)
+    def sharpe(self): return self.ep.sharpe()
+
+    def cumm_return(self): return self.ep.cumm_return()
 
     def episode_finished(self, runner):
-        step_acc, ep_acc, test_acc = self.acc.step, self.acc.episode, self.acc.tests
-        signals = step_acc.signals
-        totals = step_acc.totals
+        return self.report_episode(self.ep, self.acc.tests.i)
+
+    def report_episode(self, ep, test_i):
+        """Record & print a finished (test) episode, `test_i` being which test run it was"""
+        ep_acc, test_acc = self.acc.episode, self.acc.tests
+        signals = ep.signals
         n_uniques = float(len(np.unique(signals)))
-        sharpe = self.sharpe()
-        cumm_ret = self.cumm_return()
+        sharpe = ep.sharpe()
+        cumm_ret = ep.cumm_return()
 
         ep_acc.sharpes.append(float(sharpe))
         ep_acc.returns.append(float(cumm_ret))
         ep_acc.uniques.append(n_uniques)
 
         # Print (limit to note-worthy)
-        lt_0 = len([s for s in signals if s < 0])
-        eq_0 = len([s for s in signals if s == 0])
-        gt_0 = len([s for s in signals if s > 0])
-        completion = int(test_acc.i / test_acc.n_tests * 100)
-        steps = f"\tSteps: {step_acc.i}"
-        print(f"{completion}%{steps}\tSharpe: {'%.3f'%sharpe}\tReturn: {'%.3f'%cumm_ret}\tTrades:\t{lt_0}[<0]\t{eq_0}[=0]\t{gt_0}[>0]")
+        lt_0 = int(np.count_nonzero(signals < 0))
+        eq_0 = int(np.count_nonzero(signals == 0))
+        gt_0 = int(np.count_nonzero(signals > 0))
+        completion = int(test_i / test_acc.n_tests * 100)
+        steps = f"\tSteps: {ep.i}"
+        # Time the agent sat waiting on data since the last one of these, see prefetch.py
+        stall = f"\tStall: {'%.1f' % (self.prefetch.stalled() * 1000)}ms" if self.prefetch else ""
+        print(f"{completion}%{steps}\tSharpe: {'%.3f'%sharpe}\tReturn: {'%.3f'%cumm_ret}\tTrades:\t{lt_0}[<0]\t{eq_0}[=0]\t{gt_0}[>0]{stall}")
         return True
 
+    def worker_env(self, mode):
+        """A copy of this env to run alongside it (tests in evaluator.py, rollouts in rollouts.py): same data &
+        hypers, its own episode state & accumulators"""
+        env = copy.copy(self)
+        env.acc = Box(episode=dict(i=0, total_steps=0, sharpes=[], returns=[], uniques=[]), step=None,
+                      tests=dict(self.acc.tests))
+        env.ep, env.prefetch, env.mode = None, None, mode
+        return env
+
+    def test_env(self): return self.worker_env(Mode.TEST)
+
     def run_deterministic(self, runner, print_results=True):
+        # conv2d nets: conv layers batched over the window, per step only what needs cash/value (see evaluator.py)
+        policy = FeedForwardPolicy.of(runner.agent, self)
         next_state, terminal = self.reset(), False
         while not terminal:
-            next_state, terminal, reward = self.execute(runner.agent.act(next_state, deterministic=True, independent=True))
+            if policy: actions = policy.act(next_state, self.ep.i)
+            else: actions = runner.agent.act(next_state, deterministic=True, independent=True)
+            next_state, terminal, reward = self.execute(actions)
         if print_results: self.episode_finished(None)
 
-    def train_and_test(self, agent, n_steps, n_tests, early_stop):
+    def train_and_test(self, agent, n_steps, n_tests, early_stop, make_agent=None):
+        """
+        :param make_agent: (worker_of=None) -> a new agent built like `agent` (a worker sharing `worker_of`'s model, if
+            given). With it & --overlap-tests, test runs go on a copy of the agent on another thread while training
+            continues (see evaluator.py); with --n-envs K, K envs train it at once (see rollouts.py)
+        """
+        from prefetch import EpisodePrefetcher  # (imports us)
+        from rollouts import ParallelRollouts  # (imports us)
+        from evaluator import OverlappedTests
         test_acc = self.acc.tests
         n_steps = n_steps * 10000
         test_acc.n_tests = n_tests
         test_acc.i = 0
         timesteps_each = n_steps // n_tests
         runner = Runner(agent=agent, environment=self)
+        n_envs = self.cli_args.n_envs if make_agent else 1
+        rollouts = ParallelRollouts(self, agent, make_agent, n_envs) if n_envs > 1 else None
+        # Next train window(s) & the test windows get loaded in the background while the agent trains
+        self.prefetch = prefetch = EpisodePrefetcher(self, n_train=n_envs)
+        tests = OverlappedTests(self, make_agent) if make_agent and self.cli_args.overlap_tests else None
 
         try:
             while test_acc.i <= n_tests:
-                self.use_dataset(Mode.TRAIN)
                 # max_episode_timesteps not required, since we kill on (cash|value)<0 or max_repeats
-                runner.run(timesteps=timesteps_each)
-                self.use_dataset(Mode.TEST)
-                self.run_deterministic(runner, print_results=True)
+                if rollouts:
+                    prefetch.train(rollouts.envs)
+                    rollouts.run(timesteps_each)
+                else:
+                    prefetch.train()
+                    runner.run(timesteps=timesteps_each)
+                if tests:
+                    tests.submit(agent, test_acc.i)
+                    tests.collect()
+                else:
+                    prefetch.test()
+                    self.run_deterministic(runner, print_results=True)
                 if early_stop > 0:
                     sharpes = np.array(self.acc.episode.sharpes[-early_stop:])
                     if test_acc.i >= early_stop and np.all(sharpes > 0):
@@ -426,8 +641,12 @@ class BitcoinEnv(Environment):
 
         # On last "how would it have done IRL?" run, without getting in the way (no killing on repeats, 0-balance)
         print('Running no-kill test-set')
-        self.use_dataset(Mode.TEST, full_set=True)
+        if tests: tests.close()  # the rest of the overlapped tests, in order; this one's last & has nothing to overlap
+        prefetch.test(full_set=True)
         self.run_deterministic(runner, print_results=True)
+        if rollouts: rollouts.close()
+        prefetch.close()
+        self.prefetch = None
 
     def run_live(self, agent, test=True):
         self.live_at_head = False
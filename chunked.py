@@ -0,0 +1,55 @@
+"""
+Out-of-core access to all_observations, for histories bigger than RAM (multi-year, multi-exchange ticks). The feature
+arrays already come memory-mapped out of the feature store (data/features.py) or /dev/shm, but indexing a memmap
+all over the place over a run pages in everything it touches, and those pages count against us until the kernel
+feels like reclaiming them. Here the history is split into fixed-size chunks of rows and an episode only gets the
+chunks covering its window (plus a prefetch margin), copied into one small in-RAM block, and the mapping's pages are
+released again right after. Resident memory stays about one block, whatever the history's length.
+
+BitcoinEnv uses it with `"OUT_OF_CORE": true` in config.json: use_dataset() (prepare_window()) reads the chunks under
+the episode it picked, and get_next_state()/get_states() index that block. Off, the "block" is just the whole array, as before.
+"""
+
+import mmap
+import numpy as np
+
+CHUNK_ROWS = 1 << 16
+PREFETCH_CHUNKS = 1
+
+
+class ChunkedObservations(object):
+    def __init__(self, array, chunk_rows=CHUNK_ROWS, prefetch=PREFETCH_CHUNKS):
+        """
+        :param array: the [rows, cols] history, normally a read-only np.memmap
+        :param prefetch: extra chunks to page in past the end of each window (eg TEST runs that go long)
+        """
+        self.array, self.chunk_rows, self.prefetch = array, chunk_rows, prefetch
+        self.n_chunks = -(-len(array) // chunk_rows)
+
+    def chunks_for(self, lo, hi):
+        """Chunk indices covering rows [lo, hi), plus the prefetch margin"""
+        c = self.chunk_rows
+        return range(max(lo, 0) // c, min(-(-hi // c) + self.prefetch, self.n_chunks))
+
+    def read(self, lo, hi):
+        """Page in rows [lo, hi) (whole chunks of them, plus the margin) as a new block. Safe from another thread
+        (see prefetch.py).
+        :return: (block, base), block[j] being array[base + j]
+        """
+        chunks, c = self.chunks_for(lo, hi), self.chunk_rows
+        block = np.array(self.array[chunks.start * c:chunks.stop * c])
+        self._release(chunks)  # we've our own copy now
+        return block, chunks.start * c
+
+    def _release(self, chunks):
+        """Drop the mapping's pages for `chunks` from this process. They're clean file/shm pages, so nothing's lost;
+        a later window re-reads them."""
+        mm = getattr(self.array, '_mmap', None)
+        if mm is None or not len(chunks) or not hasattr(mm, 'madvise'): return
+        # np.memmap maps from an allocation-granularity boundary, so the data sits that far into `mm`
+        base = self.array.offset % mmap.ALLOCATIONGRANULARITY
+        row_bytes = self.array.strides[0]
+        start = base + chunks.start * self.chunk_rows * row_bytes
+        end = min(base + chunks.stop * self.chunk_rows * row_bytes, len(mm))
+        start -= start % mmap.PAGESIZE
+        mm.madvise(mmap.MADV_DONTNEED, start, end - start)
@@ -0,0 +1,115 @@
+"""On-disk columnar cache for `data.db_to_dataframe()`. Every hypersearch trial builds a fresh BitcoinEnv, which pulls
+the full history out of the database; with millions of rows that's minutes per trial. Instead we keep one flat
+float64 file per column under `data/cache/<key>/` (plus the primary timestamps), keyed by the table spec + `arbitrage`, plus a `meta.json` which
+tracks the row-count and the newest source timestamp we've cached (the "watermark"). On load we only ask the DB for
+rows newer than the watermark, append them, and memory-map the rest.
+
+Files are append-only; `meta.json` is the source of truth for how many rows are valid. If we crash mid-append, the
+extra bytes get truncated on the next sync. Multiple tabs (hypersearch --gpu-split) may sync at once, so syncing
+holds an exclusive flock on the cache dir.
+"""
+
+import os, json, hashlib, fcntl
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), 'cache')
+DTYPE = np.float64
+TS_COL = '_ts'  # primary-table timestamps, stored alongside the columns
+
+
+def cache_key(tables_, arbitrage, source=''):
+    """Hash of whatever changes the shape/content of the resultant frame. If you edit `data.tables` (add a column,
+    change an F/B/Z rule) or point at another database (`source`, eg history vs history_live), you get a new cache
+    rather than a stale one."""
+    spec = json.dumps(dict(tables=tables_, arbitrage=bool(arbitrage), source=source), sort_keys=True)
+    return hashlib.sha1(spec.encode()).hexdigest()[:16]
+
+
+@contextmanager
+def flock(path):
+    """Exclusive inter-process lock on `path` (created if missing), held for the `with` block"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try: yield
+        finally: fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class ColumnCache(object):
+    def __init__(self, tables_, arbitrage, source='', cache_dir=CACHE_DIR):
+        self.key = cache_key(tables_, arbitrage, source)
+        self.dir = os.path.join(cache_dir, self.key)
+        self.columns = [f"{t['name']}_{c}" for t in tables_ for c in t['cols']]
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _path(self, col): return os.path.join(self.dir, f'{col}.f8')
+
+    @property
+    def _meta_path(self): return os.path.join(self.dir, 'meta.json')
+
+    def read_meta(self):
+        try:
+            with open(self._meta_path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return dict(rows=0, watermark=None)
+
+    def _write_meta(self, meta):
+        tmp = self._meta_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta_path)  # atomic, readers never see a half-written meta
+
+    def lock(self): return flock(os.path.join(self.dir, '.lock'))
+
+    @property
+    def watermark(self): return self.read_meta()['watermark']
+
+    def append(self, df, ts, watermark):
+        """Append rows (already imputed, oldest->newest) with their primary timestamps (int64 ns) and move the
+        watermark. Caller holds the lock."""
+        meta = self.read_meta()
+        nbytes = meta['rows'] * np.dtype(DTYPE).itemsize  # float64 & int64 are both 8 bytes
+        arrays = [(self._path(col), np.ascontiguousarray(df[col].values, dtype=DTYPE)) for col in self.columns]
+        arrays.append((self._path(TS_COL), np.ascontiguousarray(ts, dtype=np.int64)))
+        for path, arr in arrays:
+            with open(path, 'ab') as f:
+                f.truncate(nbytes)  # drop any bytes from a crashed prior append
+                f.seek(nbytes)
+                f.write(arr.tobytes())
+        self._write_meta(dict(rows=meta['rows'] + len(df), watermark=watermark))
+
+    def last_row(self):
+        """Last cached row, in column order. Seeds ffill columns when imputing a top-up (see data.ChunkImputer)"""
+        rows = self.read_meta()['rows']
+        if not rows: return None
+        return np.array([self._memmap(col, rows)[-1] for col in self.columns])
+
+    def _memmap(self, col, rows, dtype=DTYPE):
+        return np.memmap(self._path(col), dtype=dtype, mode='r', shape=(rows,))
+
+    def load_ts(self):
+        """Primary-table timestamps (int64 ns UTC) of every cached row"""
+        rows = self.read_meta()['rows']
+        if not rows: return np.empty(0, dtype=np.int64)
+        return self._memmap(TS_COL, rows, dtype=np.int64)
+
+    def load(self, lo=0, hi=None):
+        """Returns cached rows [lo, hi) as a frame. Columns are read through memmaps, so this is a file-open rather
+        than a DB pull (and only the slice you ask for gets paged in)"""
+        rows = self.read_meta()['rows']
+        if not rows:
+            return pd.DataFrame(columns=self.columns, dtype=DTYPE)
+        return pd.DataFrame({col: np.array(self._memmap(col, rows)[lo:hi]) for col in self.columns},
+                            columns=self.columns)
+
+    def clear(self):
+        from data import catalog  # catalog imports us
+        catalog.invalidate(self.key)
+        with self.lock():
+            for col in self.columns + [TS_COL]:
+                try: os.remove(self._path(col))
+                except FileNotFoundError: pass
+            self._write_meta(dict(rows=0, watermark=None))
@@ -0,0 +1,76 @@
+"""Metadata catalog for the aligned history in data/cache.py. For each cache key (ie table spec + `arbitrage`) it
+tracks the row count, min/max primary timestamps (int64 ns UTC) and the source watermark. `data.sync()`, which does
+all the cache's ingesting, records each batch of rows it appends, so `data.count_rows()` and the train/test split
+read a dict lookup instead of counting the history. Nothing goes stale silently: an entry only changes through
+`record()` or an explicit `invalidate()`, and `count_rows()` syncs first whenever the source's newest row is past
+the entry's watermark.
+"""
+
+import os, json
+from data.cache import CACHE_DIR, flock
+
+CATALOG_PATH = os.path.join(CACHE_DIR, 'catalog.json')
+
+_catalog, _mtime = {}, None  # in-process copy, re-read only when the file changes
+
+
+def _read():
+    global _catalog, _mtime
+    try:
+        mtime = os.stat(CATALOG_PATH).st_mtime
+    except FileNotFoundError:
+        _catalog, _mtime = {}, None
+        return _catalog
+    if mtime != _mtime:
+        with open(CATALOG_PATH) as f:
+            _catalog, _mtime = json.load(f), mtime
+    return _catalog
+
+
+def _write(catalog):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = CATALOG_PATH + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(catalog, f)
+    os.replace(tmp, CATALOG_PATH)
+
+
+def get(key):
+    """Catalog entry for a cache key, or None if it's never been recorded (or was invalidated)"""
+    return _read().get(key)
+
+
+def record(key, arbitrage, prior_rows, ts, watermark):
+    """Extend `key`'s entry with newly-appended rows.
+    :param prior_rows: rows already in the cache before this append
+    :param ts: primary timestamps (int64 ns) of the appended rows
+    """
+    if not len(ts): return
+    with flock(CATALOG_PATH + '.lock'):
+        catalog = dict(_read())
+        entry = catalog.get(key) or dict(arbitrage=bool(arbitrage), rows=0, min_ts=int(ts[0]))
+        if entry['rows'] != prior_rows:
+            # Catalog and cache disagree (eg the catalog was invalidated mid-stream). Don't guess; start over
+            # and let the next count rebuild it from the cache.
+            catalog.pop(key, None)
+        else:
+            entry.update(rows=prior_rows + len(ts), max_ts=int(ts[-1]), watermark=watermark)
+            catalog[key] = entry
+        _write(catalog)
+
+
+def rebuild(key, arbitrage, ts, watermark):
+    """Recompute an entry from scratch from the full cached timestamp column"""
+    invalidate(key)
+    record(key, arbitrage, 0, ts, watermark)
+
+
+def invalidate(key=None):
+    """Drop one entry (or all of them, key=None). Do this whenever you change the history behind the cache's back,
+    eg deleting/re-importing rows rather than appending."""
+    with flock(CATALOG_PATH + '.lock'):
+        catalog = dict(_read())
+        if key is None: catalog = {}
+        else: catalog.pop(key, None)
+        _write(catalog)
+
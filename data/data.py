@@ -1,18 +1,31 @@
 import time, json, re
 from enum import Enum
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, Float, String, types
 from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
 import os
+from data.cache import ColumnCache, cache_key
+from data import catalog
 
 # From connecting source file, `import engine` and run `engine.connect()`. Need each connection to be separate
 # (see https://stackoverflow.com/questions/3724900/python-ssl-problem-with-multiprocessing)
+# The storage backend is whatever the URLs in config.json point at. Postgres is the main one; an embedded SQLite file
+# (eg `sqlite:///data/history.db`) works too, for benchmarks, CI and offline research without a DB server. Everything
+# in here sticks to SQL both understand, except `_db_to_dataframe_lateral` (Postgres-only, kept for reference).
 config_json = json.load(open(os.path.dirname(__file__) + '/../config.json'))
 DB = config_json['DB_HISTORY'].split('/')[-1]
 engine = create_engine(config_json['DB_HISTORY'])
 engine_live = create_engine(config_json['DB_HISTORY_LIVE'])
 engine_runs = create_engine(config_json['DB_RUNS'])
 
+# Cache full-history pulls on disk (see data/cache.py). Turn off if you're tinkering with the query itself.
+USE_CACHE = config_json.get('DATA_CACHE', True)
+
+# Rows per fetch when streaming the history off a server-side cursor (see `stream_chunks`)
+CHUNK_SIZE = 50000
+
 
 
 # Decide which exchange you want to trade on (significant even in training). Pros & cons; Kraken's API provides more
@@ -158,8 +171,19 @@ def n_cols(indicators=False, arbitrage=True):
 row_count = 0
 already_asked = False
 def count_rows(conn, arbitrage=True):
+    """Number of rows `db_to_dataframe(conn, arbitrage=arbitrage)` gives you. With the cache on, that's a catalog
+    lookup (data/catalog.py), after checking its watermark against the newest source row (one index lookup). If
+    rows have landed since, or there's no entry yet, the cache is synced first, so the count is never behind."""
     global row_count, already_asked
 
+    if USE_CACHE and db_to_dataframe is _db_to_dataframe_cached:
+        key = cache_key(get_tables(arbitrage), arbitrage, source=str(conn.engine.url))
+        entry, latest = catalog.get(key), _latest_timestamp(conn, arbitrage)
+        if entry is None or (latest is not None and str(latest) != entry.get('watermark')):
+            sync(conn, arbitrage)
+            entry = catalog.get(key)
+        return entry['rows'] if entry else 0
+
     # This fn might be called suddenly a bunch in parallel - try to let one instance fetch the count first & cache
     if row_count:
         return row_count  # cached
@@ -172,15 +196,18 @@ def count_rows(conn, arbitrage=True):
     return row_count
 
 
-def _db_to_dataframe_ohlc(conn, limit='ALL', offset=0, just_count=False, arbitrage=True):
+def _db_to_dataframe_ohlc(conn, limit='ALL', since=None, until=None, just_count=False, arbitrage=True):
     """This fn is currently not used anywhere. You'd use this if using the CryptoWat.ch OHLCV data (see
-    data/populate/cryptowatch_ohlcv.py). Fantastic dataset, with hierarchical candlesticks! But not enough history to
-    train on. I hope they sell full history some day.
+    data/populate/cryptowatch.py). Fantastic dataset, with hierarchical candlesticks! But not enough history to
+    train on. I hope they sell full history some day. `since`/`until` are close_time bounds, same as
+    `_db_to_dataframe_main`.
     """
     # 600, 300, 1800
+    where, params = _range_where('g.close_time', since, until)
+    where = where.replace(' where ', ' and ')
     if just_count:
         select = 'select count(*) over () '
-        limit, offset = 1, 0
+        limit = 1
     else:
         select = """
         select 
@@ -190,43 +217,236 @@ def _db_to_dataframe_ohlc(conn, limit='ALL', offset=0, just_count=False, arbitra
     {select}
     from ohlc_gdax as g 
     inner join ohlc_okcoin as o on g.close_time=o.close_time
-    where g.period='60' and o.period='60'
-    order by g.close_time::integer desc
-    limit {limit} offset {offset}
+    where g.period='60' and o.period='60'{where}
+    order by cast(g.close_time as integer) desc
+    limit {limit}
     """
     if just_count:
-        return conn.execute(query).fetchone()[0]
+        return conn.execute(text(query), **params).fetchone()[0]
 
-    return pd.read_sql_query(query, conn).iloc[::-1].ffill()
+    return pd.read_sql_query(text(query), conn, params=params).iloc[::-1].ffill()
 
 
-def _db_to_dataframe_main(conn, limit='ALL', offset=0, just_count=False, arbitrage=True, last_timestamp=False):
+def _impute(df, tables_):
+    """Fill NaNs according to each column's F/B/Z rule (see top of file)"""
+    for t in tables_:
+        for k, method in t['cols'].items():
+            fill = {'value': 0} if method == Z else {'method': 'ffill' if method == F else 'bfill'}
+            col_name = f"{t['name']}_{k}"
+            df[col_name] = df[col_name].fillna(**fill)
+    return df.astype('float64')
+
+
+class ChunkImputer(object):
+    """Applies the F/B/Z rules to consecutive chunks (oldest->newest) written into one preallocated array, giving the
+    same result as `_impute()` on the whole thing. ffill state (each column's last value) carries across chunk
+    boundaries; bfill runs that hit the end of a chunk stay pending and get written back once a value shows up.
+    """
+    def __init__(self, tables_, out, seed=None):
+        self.out = out
+        methods = np.array([m for t in tables_ for m in t['cols'].values()])
+        self.f, self.b, self.z = methods == F, methods == B, methods == Z
+        # Last known value of every column; `seed` lets a top-up continue where a prior load left off
+        self.last = np.full(len(methods), np.nan) if seed is None else np.array(seed, dtype=np.float64)
+        self.pending = np.full(len(methods), -1)  # row where a still-open bfill run started, per column
+        self.pos = 0
+
+    @staticmethod
+    def _ffill(chunk, seed):
+        rows = np.arange(len(chunk))[:, None]
+        idx = np.maximum.accumulate(np.where(np.isnan(chunk), -1, rows), axis=0)
+        filled = chunk[np.maximum(idx, 0), np.arange(chunk.shape[1])]
+        return np.where(idx < 0, seed, filled)
+
+    def write(self, chunk):
+        n, pos, out = len(chunk), self.pos, self.out
+        chunk[:, self.z] = np.where(np.isnan(chunk[:, self.z]), 0, chunk[:, self.z])
+        chunk[:, self.f] = self._ffill(chunk[:, self.f], self.last[self.f])
+
+        if self.b.any():
+            b_cols = np.where(self.b)[0]
+            chunk[:, b_cols] = self._ffill(chunk[::-1, b_cols], np.nan)[::-1]
+            for c in b_cols:
+                if self.pending[c] >= 0 and not np.isnan(chunk[0, c]):
+                    out[self.pending[c]:pos, c] = chunk[0, c]
+                    self.pending[c] = -1
+                if np.isnan(chunk[-1, c]) and self.pending[c] < 0:
+                    self.pending[c] = pos + np.argmax(np.isnan(chunk[:, c]))
+
+        out[pos:pos + n] = chunk
+        self.last = np.where(np.isnan(chunk[-1]), self.last, chunk[-1])
+        self.pos += n
+
+
+def _latest_timestamp(conn, arbitrage=True):
+    """Newest timestamp in the primary table, ie the row `db_to_dataframe` would end on"""
+    first = get_tables(arbitrage)[0]
+    query = f"select {first['ts']} from {first['name']} order by {first['ts']} desc limit 1"
+    row = conn.execute(query).fetchone()
+    return row and row[first['ts']]
+
+
+def _ts_ns(values):
+    """DB timestamps -> int64 nanoseconds (UTC), so tables can be aligned with np.searchsorted"""
+    return pd.to_datetime(pd.Series(values), utc=True).values.astype(np.int64)
+
+
+def _range_where(field, since=None, until=None):
+    where, params = [], {}
+    if since is not None:
+        where.append(f"{field} > :since")
+        params['since'] = since
+    if until is not None:
+        where.append(f"{field} <= :until")
+        params['until'] = until
+    return (" where " + " and ".join(where) if where else ""), params
+
+
+def _count(conn, table, since=None, until=None):
+    where, params = _range_where(table['ts'], since, until)
+    return conn.execute(text(f"select count(*) from {table['name']}{where}"), **params).fetchone()[0]
+
+
+def _secondary_arrays(rows, n_cols):
+    ts_ns = _ts_ns([r[0] for r in rows]) if rows else np.empty(0, dtype=np.int64)
+    return ts_ns, np.array([tuple(r)[1:] for r in rows], dtype=np.float64).reshape(len(rows), n_cols)
+
+
+def _load_secondary(conn, table, lo=None, hi=None, seed=None):
+    """Everything needed to as-of match primary rows whose timestamps fall in (lo, hi]: the rows in that range, plus
+    the last row at-or-before `lo` (which is what the first primary row may match). Returns (ts_ns, values).
+    :param seed: that last row, if the caller already has it as a (ts_ns, values) pair (eg the end of the previous
+        chunk's range, see stream_chunks); else it's looked up
+    """
+    name, ts, cols = table['name'], table['ts'], ', '.join(table['cols'])
+    where, params = _range_where(ts, lo, hi)
+    rows = conn.execute(text(f"select {ts}, {cols} from {name}{where} order by {ts} asc"), **params).fetchall()
+    ts_ns, values = _secondary_arrays(rows, len(table['cols']))
+    if lo is not None:
+        if seed is None:
+            seed = _secondary_arrays(conn.execute(
+                text(f"select {ts}, {cols} from {name} where {ts} <= :lo order by {ts} desc limit 1"), lo=lo
+            ).fetchall(), len(table['cols']))
+        ts_ns, values = np.concatenate([seed[0], ts_ns]), np.concatenate([seed[1], values])
+    return ts_ns, values
+
+
+def _align(ts_ns, secondaries):
+    """In-process as-of join: for each primary timestamp, the most recent secondary row at-or-before it (NaN if none).
+    Same matching as the `left join lateral (... order by ts desc limit 1)` SQL in `_db_to_dataframe_lateral`, but
+    a binary search over arrays we already hold instead of an index probe per row per table."""
+    parts = []
+    for sec_ts, sec_values in secondaries:
+        if not len(sec_ts):
+            parts.append(np.full((len(ts_ns), sec_values.shape[1]), np.nan))  # nothing yet (eg early chunks)
+            continue
+        idx = np.searchsorted(sec_ts, ts_ns, side='right') - 1
+        part = sec_values[np.maximum(idx, 0)]
+        part[idx < 0] = np.nan
+        parts.append(part)
+    return parts
+
+
+def stream_chunks(conn, arbitrage=True, since=None, until=None, limit='ALL', chunksize=CHUNK_SIZE):
+    """Generator over the history, oldest->newest, `chunksize` rows at a time as (ts_ns, raw float64 array) with NaNs
+    not yet imputed. The primary table comes off a server-side cursor (`stream_results`), so the driver never holds
+    more than a chunk; secondary tables (arbitrage) are fetched for each chunk's time span & as-of aligned to it
+    in-process (see `_align`), so they're never held whole either.
+    :param limit: same as `_db_to_dataframe_main`, the newest `limit` rows of (since, until]
+    """
+    tables_ = get_tables(arbitrage)
+    first, secondaries = tables_[0], tables_[1:]
+    ts, cols = first['ts'], ', '.join(first['cols'])
+    where, params = _range_where(ts, since, until)
+    query = f"select {ts}, {cols} from {first['name']}{where}"
+    if limit != 'ALL':
+        # Walks the ts index backwards from `until`, so this costs `limit` rows no matter where `until` sits
+        query = f"select * from ({query} order by {ts} desc limit {int(limit)}) w"
+    query += f" order by {ts} asc"
+
+    result = conn.execution_options(stream_results=True).execute(text(query), **params)
+    try:
+        prev_hi, seeds = None, [None] * len(secondaries)
+        while True:
+            rows = result.fetchmany(chunksize)
+            if not rows: break
+            # Secondaries just for this chunk, so they're bounded by the chunk too: the rows since the previous chunk's
+            # last timestamp, seeded with the last row we had (the first chunk looks up the one at-or-before its start)
+            lo = rows[0][0] if prev_hi is None else prev_hi
+            loaded = [_load_secondary(conn, t, lo=lo, hi=rows[-1][0], seed=seed) for t, seed in zip(secondaries, seeds)]
+            seeds = [(sec_ts[-1:], sec_values[-1:]) if len(sec_ts) else seed
+                     for (sec_ts, sec_values), seed in zip(loaded, seeds)]
+            prev_hi = rows[-1][0]
+            ts_ns = _ts_ns([r[0] for r in rows])
+            chunk = np.array([tuple(r)[1:] for r in rows], dtype=np.float64)  # None -> NaN
+            yield ts_ns, np.column_stack([chunk] + _align(ts_ns, loaded))
+    finally:
+        result.close()
+
+
+def load_streaming(conn, arbitrage=True, since=None, until=None, limit='ALL', seed=None, chunksize=CHUNK_SIZE):
+    """Loads (since, until] into one preallocated array via `stream_chunks`, imputing as it goes. Peak memory is the
+    final array plus a chunk, rather than the 3-4 copies the read_sql -> reverse -> fillna -> astype route makes.
+    :param seed: last imputed row prior to `since`, so ffill columns carry over (see data/cache.py)
+    :return: (pd.DataFrame wrapping the array (no copy), int64 primary timestamps)
+    """
+    tables_ = get_tables(arbitrage)
+    if until is None:
+        until = _latest_timestamp(conn, arbitrage)  # pin it, so the count below matches what we stream
+    n = _count(conn, tables_[0], since, until)
+    if limit != 'ALL': n = min(n, int(limit))
+    columns = [f"{t['name']}_{c}" for t in tables_ for c in t['cols']]
+    out = np.empty((n, len(columns)), dtype=np.float64)
+    ts_out = np.empty(n, dtype=np.int64)
+
+    imputer = ChunkImputer(tables_, out, seed=seed)
+    for ts_ns, chunk in stream_chunks(conn, arbitrage=arbitrage, since=since, until=until, limit=limit,
+                                      chunksize=chunksize):
+        chunk = chunk[:n - imputer.pos]  # paranoia: rows with ts == until inserted after the count
+        if not len(chunk): break
+        ts_out[imputer.pos:imputer.pos + len(chunk)] = ts_ns[:len(chunk)]
+        imputer.write(chunk)
+    return pd.DataFrame(out[:imputer.pos], columns=columns, copy=False), ts_out[:imputer.pos]
+
+
+def _db_to_dataframe_main(conn, limit='ALL', since=None, until=None, just_count=False, arbitrage=True,
+                          last_timestamp=False):
     """
     Fetches data from your `history` database. During training, this'll fetch 80% of the data (TODO: buffer that
     instead so it's not so RAM-heavy). During testing, 20% unseen data.
+    Windows are addressed by primary-table timestamp, (since, until], never by row offset: `offset N` makes Postgres
+    walk & discard N rows, so deep windows got slower the further back they sat. A timestamp range is an index
+    range-scan wherever it is. Rows always come back old->new.
     :param conn: a database connection
-    :param limit: num rows to fetch
-    :param offset: n-rows to start from. Note! This function fetches from newest-to-oldest, so offset=0 means
-        most-recent. The function reverses that in the end so we're properly sequential. I don't remember why I did
-        this.. maybe makes limit/offset easier since I don't need to track database end? Perhaps this can change.
+    :param limit: num rows to fetch; the newest `limit` rows of the range
+    :param since: only rows whose primary timestamp is > since (eg the last one you've already got)
+    :param until: only rows whose primary timestamp is <= until
     :param just_count: True if you just want to count the rows (used up-front in btc_env to set some internals).
-        You may be thinking "just do a `select count(*)`, why fn(just_count=True)? Because the `arbitrage` arg may
-        change the resultant row-count, see below.
-    :param arbitrage: Whether to use "risk arbitrage" (effects the row count due to time-phase alignment). See
-        hypersearch.py for info on this arg.
+        Secondary tables are as-of matched onto the primary's rows (see `_align`), so that's just the primary count.
+    :param arbitrage: Whether to use "risk arbitrage" (joins in the secondary tables). See hypersearch.py for info
+        on this arg.
     :param last_timestamp: When we're in live-mode, we run till the last row in our database, use this arg to track
         where we left off, wait, poll if new rows, repeat.
     :return: pd.DataFrame, with NaNs imputed according to the F/B/Z rules
     """
-    tables_ = get_tables(arbitrage)
-
     if just_count:
-        query = 'select count(*) over ()'
-    else:
-        query = 'select ' + ', '.join(
-            ', '.join(f"{t['name']}.{c} as {t['name']}_{c}" for c in t['cols'])
-            for t in tables_
-        )
+        return _count(conn, get_tables(arbitrage)[0], since, until)
+
+    df, _ = load_streaming(conn, arbitrage=arbitrage, since=since, until=until, limit=limit)
+    if last_timestamp:
+        # Save away last-timestamp (used in LIVE mode to inform how many new steps are added between polls
+        return df, _latest_timestamp(conn, arbitrage)
+    return df
+
+
+def _db_to_dataframe_lateral(conn, limit='ALL', arbitrage=True):
+    """The original query: secondary tables matched via a `left join lateral` per primary row, in Postgres. Kept as
+    the reference `_align` must agree with, and for the fetch-time comparison in bench.py."""
+    tables_ = get_tables(arbitrage)
+    query = 'select ' + ', '.join(
+        ', '.join(f"{t['name']}.{c} as {t['name']}_{c}" for c in t['cols'])
+        for t in tables_
+    )
 
     # Currently matching main-table to nearest secondary-tables' time (https://stackoverflow.com/questions/28839524/join-two-tables-based-on-nearby-timestamps)
     # The current method is an OUTER JOIN, which means all primary-table's rows are kept, and any most-recent
@@ -252,62 +472,139 @@ def _db_to_dataframe_main(conn, limit='ALL', offset=0, just_count=False, arbitra
             ) {name} on true
             """
 
-    if just_count:
-        query += " limit 1"
-        return conn.execute(query).fetchone()[0]
-
     order_field = f"{first['name']}.{first['ts']}" if len(tables_) > 1 else first['ts']
-    query += f" order by {order_field} desc limit {limit} offset {offset}"
+    query += f" order by {order_field} desc limit {limit}"
 
     # order by date DESC (for limit to cut right), then reverse again (so old->new)
     df = pd.read_sql_query(query, conn).iloc[::-1]
-    for t in tables_:
-        for k, method in t['cols'].items():
-            fill = {'value': 0} if method == Z else {'method': 'ffill' if method == F else 'bfill'}
-            col_name = f"{t['name']}_{k}"
-            df[col_name] = df[col_name].fillna(fill)
-    df = df.astype('float64')
+    return _impute(df, tables_)
 
+
+def sync(conn, arbitrage=True):
+    """Tops up the on-disk aligned history (data/cache.py) with any rows newer than its watermark, and records them
+    in the catalog (data/catalog.py). This is the one place the cache gets ingested into.
+    :return: (ColumnCache, latest source timestamp)
+    """
+    cache = ColumnCache(get_tables(arbitrage), arbitrage, source=str(conn.engine.url))
+    with cache.lock():
+        meta, latest = cache.read_meta(), _latest_timestamp(conn, arbitrage)
+        if latest is not None and str(latest) != meta['watermark']:
+            # Pin `until` so rows landing mid-fetch don't slip in under a watermark that doesn't cover them
+            new, ts = load_streaming(conn, arbitrage=arbitrage, since=meta['watermark'], until=latest,
+                                     seed=cache.last_row())
+            if len(new):
+                cache.append(new, ts, str(latest))
+                catalog.record(cache.key, arbitrage, meta['rows'], ts, str(latest))
+        if catalog.get(cache.key) is None:
+            catalog.rebuild(cache.key, arbitrage, cache.load_ts(), cache.watermark)
+    return cache, latest
+
+
+def data_version(conn, arbitrage=True):
+    """Identifies the exact history `db_to_dataframe(conn, arbitrage=arbitrage)` would return (cache key +
+    watermark), so derived data (data/features.py) can be keyed by it. None if we can't tell cheaply (cache off, or
+    the OHLC path)."""
+    if not USE_CACHE or db_to_dataframe is not _db_to_dataframe_cached:
+        return None
+    cache, _ = sync(conn, arbitrage)
+    return f'{cache.key}@{cache.watermark}'
+
+
+def _db_to_dataframe_cached(conn, limit='ALL', since=None, until=None, just_count=False, arbitrage=True,
+                            last_timestamp=False):
+    """Same signature as `_db_to_dataframe_main`. Served from the on-disk cache (data/cache.py), the materialised
+    aligned history, after topping it up with rows newer than its watermark. (since, until] and `limit` become a
+    binary search over the cached timestamps, then a slice of the column files.
+    """
+    if not USE_CACHE:
+        return _db_to_dataframe_main(conn, limit=limit, since=since, until=until, just_count=just_count,
+                                     arbitrage=arbitrage, last_timestamp=last_timestamp)
+
+    cache, latest = sync(conn, arbitrage)
+    ts = cache.load_ts()
+    lo = 0 if since is None else int(np.searchsorted(ts, _ts_ns([since])[0], side='right'))
+    hi = len(ts) if until is None else int(np.searchsorted(ts, _ts_ns([until])[0], side='right'))
+    if limit != 'ALL':
+        lo = max(lo, hi - int(limit))
+    if just_count:
+        return max(hi - lo, 0)
+
+    df = cache.load(lo, hi)
     if last_timestamp:
-        # Save away last-timestamp (used in LIVE mode to inform how many new steps are added between polls
-        query = f"select {first['ts']} from {first['name']} order by {first['ts']} desc limit 1"
-        last_timestamp = conn.execute(query).fetchone()[first['ts']]
-        return df, last_timestamp
+        return df, latest
     return df
 
 
-db_to_dataframe = _db_to_dataframe_ohlc if 'coins' in DB else _db_to_dataframe_main
+db_to_dataframe = _db_to_dataframe_ohlc if 'coins' in DB else _db_to_dataframe_cached
 
 
 def fetch_more(conn, last_timestamp, arbitrage):
-    """Function used to fetch more data in `live` mode in a polling loop.
+    """Function used to fetch more data in `live` mode in a polling loop. Keyed on the last timestamp we've seen, so
+    it's a range-scan of just the new rows.
     TODO this approach won't work if we switch the `arbitrage` method from OUTER JOIN to INNER (see comments in
-    _db_to_dataframe_main()
+    _db_to_dataframe_lateral()
     """
-    t = tables[0]
-    query = f"select count(*) as ct from {t['name']} where {t['ts']} > :last_timestamp"
-    n_new = conn.execute(text(query), last_timestamp=last_timestamp).fetchone()['ct']
-    if n_new == 0:
+    new_data, latest_timestamp = db_to_dataframe(conn, since=last_timestamp, arbitrage=arbitrage, last_timestamp=True)
+    if not len(new_data):
         return None, 0, last_timestamp
-    new_data, latest_timestamp = db_to_dataframe(conn, limit=n_new, arbitrage=arbitrage, last_timestamp=True)
-    return new_data, n_new, latest_timestamp
+    return new_data, len(new_data), latest_timestamp
+
+
+class _Json(types.TypeDecorator):
+    """jsonb on Postgres; JSON-encoded text elsewhere (SQLite). Either way you bind/get plain Python objects"""
+    impl = types.Text
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.JSONB())
+        return dialect.type_descriptor(types.Text())
+
+    def process_bind_param(self, value, dialect):
+        if dialect.name == 'postgresql' or value is None: return value
+        return json.dumps(value)
+
+    def process_result_value(self, value, dialect):
+        if dialect.name == 'postgresql' or value is None: return value
+        return json.loads(value)
+
+
+class _FloatArray(_Json):
+    """double precision[] on Postgres; JSON-encoded text elsewhere"""
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.ARRAY(Float))
+        return dialect.type_descriptor(types.Text())
+
+    def process_bind_param(self, value, dialect):
+        if value is not None: value = [float(v) for v in value]
+        return super(_FloatArray, self).process_bind_param(value, dialect)
+
+
+# Query/insert through this table (rather than raw SQL) and the column types take care of backend differences
+runs = Table(
+    'runs', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('hypers', _Json, nullable=False),
+    Column('sharpes', _FloatArray),
+    Column('returns', _FloatArray),
+    Column('signals', _FloatArray),
+    Column('prices', _FloatArray),
+    Column('uniques', _FloatArray),
+    Column('flag', String(16)),
+    Column('agent', String(64), server_default='ppo_agent', nullable=False),
+)
 
 
 def setup_runs_table():
-    """Run this function once during project setup (see README). Or just copy/paste the SQL into your runs database
-    """
-    conn_runs = engine_runs.connect()
-    conn_runs.execute("""
-        create table if not exists runs
-        (
-            id serial not null,
+    """Run this function once during project setup (see README). On Postgres this is:
+        create table if not exists runs (
+            id serial primary key,
             hypers jsonb not null,
-            sharpes double precision[],
-            returns double precision[],
-            signals double precision[],
-            prices double precision[],
-            uniques double precision[],
+            sharpes double precision[], returns double precision[], signals double precision[],
+            prices double precision[], uniques double precision[],
             flag varchar(16),
-            agent varchar(64) default 'ppo_agent'::character varying not null
+            agent varchar(64) default 'ppo_agent' not null
         );
-    """)
\ No newline at end of file
+    (copy/paste that into your runs database if you prefer)
+    """
+    runs.metadata.create_all(engine_runs, checkfirst=True)
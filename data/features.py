@@ -0,0 +1,112 @@
+"""Content-addressed store for BitcoinEnv's transformed features. `xform_data` (percent-diffs, price ratios, TA-Lib
+indicators, robust_scale, maybe the autoencoder) over the full history costs far more than pulling the history, and
+its output only depends on the data itself (the aligned cache's key + watermark, see data/cache.py) and a few hypers.
+So we hash those into a key and keep the resultant arrays as .npy files under `data/cache/features/<key>/`. Any
+later trial with the same feature config memory-maps them rather than recomputing.
+
+Entries are immutable: they're written to a temp dir and renamed into place, so concurrent trials (hypersearch
+--gpu-split) never see half an entry; if two compute the same one, the first rename wins. New data means a new
+watermark means a new key, the old entries just age out. The store is capped at `max_bytes`, evicting
+least-recently-used entries (by their meta.json mtime, which `get()` touches) when a `put()` would go over.
+"""
+
+import os, json, hashlib, shutil, uuid, pickle
+import numpy as np
+from data.cache import CACHE_DIR, flock
+
+FEATURES_DIR = os.path.join(CACHE_DIR, 'features')
+MAX_BYTES = 5 * 1024**3
+
+# Bump this when you change what xform_data computes, so stored features from the old code aren't served
+VERSION = 3
+
+
+def feature_key(**spec):
+    """Hash of everything the features depend on, eg data version, indicators_count, indicators_window, autoencode"""
+    spec = json.dumps(dict(spec, version=VERSION), sort_keys=True, default=str)
+    return hashlib.sha1(spec.encode()).hexdigest()[:16]
+
+
+class FeatureStore(object):
+    def __init__(self, features_dir=FEATURES_DIR, max_bytes=MAX_BYTES):
+        self.dir = features_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _entry(self, key): return os.path.join(self.dir, key)
+
+    def _meta_path(self, key): return os.path.join(self._entry(key), 'meta.json')
+
+    def get(self, key, names=None):
+        """Stored arrays for `key` as a {name: read-only memmap} dict (plus any pickles), or None if there's no such
+        entry.
+        :param names: only these arrays (eg one column-group out of a bigger entry); default all of them
+        """
+        try:
+            with open(self._meta_path(key)) as f:
+                meta = json.load(f)
+            os.utime(self._meta_path(key))  # mark as recently used
+        except (IOError, ValueError):
+            return None
+        names, pickles = names or meta['names'], meta.get('pickles', [])
+        if not set(names) <= set(meta['names']) | set(pickles): return None
+        out = {}
+        try:
+            for n in names:
+                if n in pickles: continue
+                out[n] = np.load(os.path.join(self._entry(key), f'{n}.npy'), mmap_mode='r')
+            for n in pickles:
+                with open(os.path.join(self._entry(key), f'{n}.pkl'), 'rb') as f:
+                    out[n] = pickle.load(f)
+        except IOError:
+            return None  # evicted (by another process) since we read meta.json
+        return out
+
+    def put(self, key, spec=None, pickles=None, **arrays):
+        """Store `arrays` (name=ndarray) under `key`. `spec` is kept in meta.json just so humans can tell what an
+        entry is. `pickles` (name=object) is for the odd small non-array that belongs with them, eg the fit that
+        produced them. No-op if the key's already there."""
+        if os.path.exists(self._meta_path(key)): return
+        tmp = self._entry(f'.{key}.{uuid.uuid4().hex}')
+        os.makedirs(tmp)
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp, f'{name}.npy'), np.ascontiguousarray(arr))
+        for name, obj in (pickles or {}).items():
+            with open(os.path.join(tmp, f'{name}.pkl'), 'wb') as f:
+                pickle.dump(obj, f)
+        nbytes = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(dict(names=list(arrays), pickles=list(pickles or {}), bytes=nbytes, spec=spec), f, default=str)
+        with flock(os.path.join(self.dir, '.lock')):
+            self._evict(self.max_bytes - nbytes)
+            try:
+                os.rename(tmp, self._entry(key))
+            except OSError:
+                shutil.rmtree(tmp, ignore_errors=True)  # someone else stored it first
+
+    def entries(self):
+        """[(key, bytes, last-used)] for every complete entry"""
+        entries = []
+        for key in os.listdir(self.dir):
+            if key.startswith('.'): continue  # .lock, temp dirs of in-flight puts
+            try:
+                with open(self._meta_path(key)) as f:
+                    nbytes = json.load(f)['bytes']
+                entries.append((key, nbytes, os.stat(self._meta_path(key)).st_mtime))
+            except (IOError, ValueError, KeyError):
+                continue
+        return entries
+
+    def _evict(self, budget):
+        """Drop least-recently-used entries until the rest fit in `budget` bytes. Caller holds the lock. Readers who
+        already mmap'd an evicted entry keep working (the inode lives until they close it)."""
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(e[1] for e in entries)
+        for key, nbytes, _ in entries:
+            if total <= budget: break
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= nbytes
+
+    def clear(self):
+        with flock(os.path.join(self.dir, '.lock')):
+            self._evict(0)
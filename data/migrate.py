@@ -1,9 +1,8 @@
-import json
-from sqlalchemy.sql import text
-from data import engine_runs
+from sqlalchemy.sql import select
+from data.data import engine_runs, runs
 
 conn = engine_runs.connect()
-rows = conn.execute('select id, hypers from runs').fetchall()
+rows = conn.execute(select([runs.c.id, runs.c.hypers])).fetchall()
 for i, r in enumerate(rows):
     h = r['hypers']
     h['reward_type'] = 'raw'
@@ -12,4 +11,4 @@ for i, r in enumerate(rows):
     del h['advantage_reward']
     # print(i, h)
     # print()
-    conn.execute(text('update runs set hypers=:h where id=:id'), h=json.dumps(h), id=r['id'])
\ No newline at end of file
+    conn.execute(runs.update().where(runs.c.id == r['id']).values(hypers=h))
\ No newline at end of file
@@ -0,0 +1,211 @@
+"""Collects CryptoWat.ch market data into the history DB: market-summary tickers (one table per market, every
+SLEEP_TICKER seconds) and 1min+ OHLC candles (ohlc_<exchange>, every SLEEP_OHLC seconds). Replaces the old
+cryptowatch_ticker.py / cryptowatch_ohlcv.py scripts with one asyncio service:
+
+- endpoints are polled concurrently (requests in a thread pool, so no extra deps)
+- tables are created once and remembered, not `CREATE TABLE IF NOT EXISTS` every poll
+- each poll writes parameterised batch inserts (multi-row for candles) inside one transaction
+- every cycle reports its latency and rows written (actually inserted, so not the overlapping candles the conflict
+  clause drops); totals are in `Collector.stats`
+
+`python data/populate/cryptowatch.py`. To benchmark offline, `--stub` serves canned Cryptowatch responses from a
+local HTTP server and points the collector at it (or run `--serve-stub PORT` in one tab, `--api http://localhost:PORT`
+in another). `--cycles N` stops after N ticker polls.
+"""
+
+import argparse, asyncio, functools, json, random, threading, time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from os import getcwd
+from sys import path as sys_path
+sys_path.append(getcwd())
+import requests
+from sqlalchemy import MetaData, Table, Column, Integer, Float, String, DateTime, PrimaryKeyConstraint, func
+from sqlalchemy.dialects import postgresql
+from data.data import engine
+
+API = 'https://api.cryptowat.ch'
+SLEEP_TICKER = 6  # https://cryptowat.ch/docs/api#rate-limit roughly 3s
+SLEEP_OHLC = 10*60  # can probably be 500*60
+OHLC_MARKETS = dict(gdax='gdax/btcusd', okcoin='okcoin/btccny')
+
+
+class Collector(object):
+    def __init__(self, conn, api=API):
+        self.conn = conn
+        self.api = api
+        self.meta = MetaData()
+        self.tables = {}  # known (already created) tables, by name
+        self.stats = dict(ticker_cycles=0, ohlc_cycles=0, rows=0, last_latency=0.)
+
+    def ticker_table(self, name):
+        if name not in self.tables:
+            table = Table(
+                name, self.meta,
+                Column('id', Integer, primary_key=True),
+                Column('last', Float),
+                Column('high', Float),
+                Column('low', Float),
+                Column('change_percent', Float),
+                Column('change_absolute', Float),
+                Column('volume', Float),
+                Column('ts', DateTime(timezone=True), server_default=func.now(), nullable=False, index=True),
+            )
+            table.create(self.conn, checkfirst=True)
+            self.tables[name] = table
+        return self.tables[name]
+
+    def ohlc_table(self, exchange):
+        name = f'ohlc_{exchange}'
+        if name not in self.tables:
+            table = Table(
+                name, self.meta,
+                Column('close_time', Integer, nullable=False),
+                Column('period', String(16), nullable=False),  # "60" for 1min candles, "180" for 3m, etc
+                Column('open_price', Float),
+                Column('high_price', Float),
+                Column('low_price', Float),
+                Column('close_price', Float),
+                Column('volume', Float),
+                PrimaryKeyConstraint('close_time', 'period'),
+            )
+            table.create(self.conn, checkfirst=True)
+            self.tables[name] = table
+        return self.tables[name]
+
+    def insert_ignore(self, table):
+        """There _will_ be overlapping candles each poll, which don't change"""
+        if self.conn.engine.dialect.name == 'postgresql':
+            return postgresql.insert(table).on_conflict_do_nothing()
+        return table.insert().prefix_with('OR IGNORE')
+
+    async def fetch(self, path):
+        loop = asyncio.get_event_loop()
+        res = await loop.run_in_executor(None, functools.partial(requests.get, f'{self.api}/{path}', timeout=10))
+        return res.json()['result']
+
+    def save_tickers(self, res):
+        rows = 0
+        with self.conn.begin():
+            for key, val in res.items():
+                table = self.ticker_table(key.replace(':', '_').replace('-', '_'))
+                price = val['price']
+                rows += self.conn.execute(table.insert(), [dict(
+                    last=price['last'],
+                    high=price['high'],
+                    low=price['low'],
+                    change_percent=price['change']['percentage'],
+                    change_absolute=price['change']['absolute'],
+                    volume=val['volume']
+                )]).rowcount
+        return rows
+
+    def save_ohlc(self, res):
+        rows = 0
+        with self.conn.begin():
+            for exchange, periods in res.items():
+                table = self.ohlc_table(exchange)
+                candles = [
+                    dict(close_time=c[0], period=period, open_price=c[1], high_price=c[2], low_price=c[3],
+                         close_price=c[4], volume=c[5])
+                    for period, candles in periods.items() for c in candles
+                ]
+                if candles:
+                    # One multi-row VALUES. rowcount is what actually went in, not the duplicates it ignored
+                    rows += self.conn.execute(self.insert_ignore(table).values(candles)).rowcount
+        return rows
+
+    async def cycle(self, kind):
+        start = time.time()
+        try:
+            if kind == 'ticker':
+                rows = self.save_tickers(await self.fetch('markets/summaries'))
+            else:
+                results = await asyncio.gather(*[self.fetch(f'markets/{m}/ohlc') for m in OHLC_MARKETS.values()])
+                rows = self.save_ohlc(dict(zip(OHLC_MARKETS, results)))
+        except Exception as e:
+            # raise Exception("Cryptowatch allowance out")
+            print(f"{kind}: fetch failed (Cryptowatch allowance out?) {e}")
+            return
+        latency = time.time() - start
+        self.stats[f'{kind}_cycles'] += 1
+        self.stats['rows'] += rows
+        self.stats['last_latency'] = latency
+        print(f"{kind}: {rows} rows in {'%.3f' % latency}s (total {self.stats['rows']})")
+
+    async def poll(self, kind, sleep, cycles=None):
+        i = 0
+        while cycles is None or i < cycles:
+            started = time.time()
+            await self.cycle(kind)
+            i += 1
+            await asyncio.sleep(max(sleep - (time.time() - started), 0))
+
+    def run(self, cycles=None, sleep_ticker=SLEEP_TICKER, sleep_ohlc=SLEEP_OHLC):
+        loop = asyncio.get_event_loop()
+        ticker = loop.create_task(self.poll('ticker', sleep_ticker, cycles))
+        ohlc = loop.create_task(self.poll('ohlc', sleep_ohlc))
+        loop.run_until_complete(ticker)
+        ohlc.cancel()
+        loop.run_until_complete(asyncio.gather(ohlc, return_exceptions=True))
+        return self.stats
+
+
+def stub_responses(n_markets=200, n_candles=500):
+    """Canned responses shaped like Cryptowatch's, for offline benchmarking"""
+    def summary():
+        p = random.uniform(5000, 10000)
+        return dict(price=dict(last=p, high=p * 1.05, low=p * .95, change=dict(percentage=.01, absolute=p * .01)),
+                    volume=random.uniform(0, 1e4))
+    now = int(time.time()) // 60 * 60
+    candles = {'60': [[now - 60 * i] + [random.uniform(5000, 10000) for _ in range(4)] + [random.uniform(0, 50)]
+                      for i in range(n_candles)]}
+    responses = {'/markets/summaries': {f'exch{i}:btcusd': summary() for i in range(n_markets)}}
+    for m in OHLC_MARKETS.values():
+        responses[f'/markets/{m}/ohlc'] = candles
+    return responses
+
+
+def serve_stub(port, block=True, **kwargs):
+    responses = stub_responses(**kwargs)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(dict(result=responses.get(self.path, {}))).encode()
+            self.send_response(200 if self.path in responses else 404)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args): pass
+
+    server = HTTPServer(('localhost', port), Handler)
+    if block:
+        server.serve_forever()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--api', type=str, default=API, help="API root (point at a stub to benchmark offline)")
+    parser.add_argument('--stub', action="store_true", default=False, help="Serve canned responses locally and collect from them")
+    parser.add_argument('--serve-stub', type=int, default=None, help="Only serve the canned responses, on this port")
+    parser.add_argument('--cycles', type=int, default=None, help="Stop after this many ticker polls")
+    args = parser.parse_args()
+
+    if args.serve_stub:
+        return serve_stub(args.serve_stub)
+    if args.stub:
+        server = serve_stub(0, block=False)
+        args.api = f'http://localhost:{server.server_port}'
+
+    conn = engine.connect()
+    # Against a stub there's no rate-limit to respect, so go as fast as we can
+    sleeps = dict(sleep_ticker=0, sleep_ohlc=0) if args.stub else {}
+    stats = Collector(conn, api=args.api).run(cycles=args.cycles, **sleeps)
+    print(stats)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,22 @@
 """ Get CSVs from https://www.kaggle.com/mczielinski/bitcoin-historical-data
 Note there's a lot of nulls in there, see my empty-handling below & determine if right way to go.
+
+The CSVs are multi-million rows, so this streams them: read a chunk, convert the unix timestamps in-process, and
+bulk-load it straight into the final schema (COPY on Postgres, a batched executemany on the embedded backend). Each
+chunk is its own transaction, and loading resumes from the table's newest timestamp; so when a new Kaggle drop
+arrives, just re-run this and only the new rows go in. `--replace` starts a table over. Indexes get built after the
+load, not maintained row-by-row during it.
 """
 
+import argparse, glob, io, time
 import pandas as pd
-import numpy as np
 from os import path as os_path, getcwd
 from sys import path as sys_path
 sys_path.append(getcwd())
+from sqlalchemy import text
+from data import data
 from data.data import engine
 
-conn = engine.connect()
-
 column_renames = {
     'Timestamp': 'timestamp',
     'Open': 'open',
@@ -21,24 +27,94 @@ column_renames = {
     'Volume_(Currency)': 'volume_currency',
     'Weighted_Price': 'weighted_price'
 }
+value_cols = [c for c in column_renames.values() if c != 'timestamp']
 
+# Glob per table; each Kaggle drop changes the date range in the name, we take the newest
 filenames = {
-    'bitstamp': 'bitstampUSD_1-min_data_2012-01-01_to_2018-03-27',
-    'coinbase': 'coinbaseUSD_1-min_data_2014-12-01_to_2018-03-27',
-    'coincheck': 'coincheckJPY_1-min_data_2014-10-31_to_2018-03-27'
+    'bitstamp': 'bitstampUSD_1-min_data_*',
+    'coinbase': 'coinbaseUSD_1-min_data_*',
+    'coincheck': 'coincheckJPY_1-min_data_*'
 }
 
-for k in ['coinbase', 'coincheck', 'bitstamp']:
-    filename = filenames[k]
-    df = pd.read_csv(os_path.join(os_path.dirname(__file__), 'bitcoin-historical-data', f'{filename}.csv'))
-    df = df.rename(columns=column_renames)
 
-    print(f'{filename}: saving to DB')
-    df.to_sql(k, conn, if_exists='replace', chunksize=200)
+def create_table(conn, k):
+    ts_type = 'TIMESTAMP WITH TIME ZONE' if conn.engine.dialect.name == 'postgresql' else 'TIMESTAMP'
+    cols = ', '.join(f'{c} DOUBLE PRECISION' for c in value_cols)
+    conn.execute(f'CREATE TABLE IF NOT EXISTS "{k}" (timestamp {ts_type} NOT NULL, {cols})')
+
+
+def latest_timestamp(conn, k):
+    return conn.execute(f'SELECT max(timestamp) FROM "{k}"').fetchone()[0]
+
+
+def bulk_load(conn, k, df):
+    """One chunk, one transaction"""
+    with conn.begin():
+        if conn.engine.dialect.name == 'postgresql':
+            buf = io.StringIO()
+            df.to_csv(buf, header=False, index=False, date_format='%Y-%m-%d %H:%M:%S+00')  # NaN -> empty -> NULL
+            buf.seek(0)
+            cursor = conn.connection.cursor()
+            cursor.copy_expert(f'COPY "{k}" ({", ".join(df.columns)}) FROM STDIN WITH CSV', buf)
+        else:
+            df = df.assign(timestamp=df.timestamp.dt.strftime('%Y-%m-%d %H:%M:%S'))
+            records = df.astype(object).where(df.notnull(), None).to_dict('records')
+            placeholders = ', '.join(f':{c}' for c in df.columns)
+            conn.execute(text(f'INSERT INTO "{k}" ({", ".join(df.columns)}) VALUES ({placeholders})'), records)
+
+
+def load(conn, k, filename, chunksize, replace=False):
+    if replace:
+        conn.execute(f'DROP TABLE IF EXISTS "{k}"')
+    create_table(conn, k)
+    since = latest_timestamp(conn, k)
+    if since is not None:
+        since = pd.to_datetime(since, utc=True)
+        print(f'{filename}: resuming after {since}')
+
+    start, n_rows = time.time(), 0
+    for df in pd.read_csv(filename, chunksize=chunksize):
+        df = df.rename(columns=column_renames)
+        df['timestamp'] = pd.to_datetime(df.timestamp, unit='s', utc=True)
+        if since is not None:
+            df = df[df.timestamp > since]
+        if not len(df): continue
+        bulk_load(conn, k, df[['timestamp'] + value_cols])
+        n_rows += len(df)
+        print(f'{filename}: {n_rows} rows, {int(n_rows / (time.time() - start))} rows/sec')
+
+    print(f'{filename}: indexing')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS "{k}_timestamp" ON "{k}" (timestamp)')
+    print(f'{filename}: done, {n_rows} rows in {"%.1f" % (time.time() - start)}s')
+    return n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replace', action="store_true", default=False, help="Drop & reload tables, rather than resume from their newest row")
+    parser.add_argument('--chunksize', type=int, default=100000, help="CSV rows per bulk-load")
+    parser.add_argument('--tables', nargs='+', default=['coinbase', 'coincheck', 'bitstamp'])
+    args = parser.parse_args()
+
+    conn = engine.connect()
+    if args.replace:
+        # Rows are about to change behind the on-disk cache's back (it only knows how to append)
+        for arbitrage in (False, True):
+            data.ColumnCache(data.get_tables(arbitrage), arbitrage, source=str(engine.url)).clear()
+
+    for k in args.tables:
+        matches = sorted(glob.glob(os_path.join(os_path.dirname(__file__), 'bitcoin-historical-data',
+                                                f'{filenames[k]}.csv')))
+        if not matches:
+            print(f'{k}: no CSV found, skipping')
+            continue
+        load(conn, k, matches[-1], args.chunksize, replace=args.replace)
+
+    # Keep the aligned cache & its catalog (row counts etc) current with what we just ingested
+    for arbitrage in (False, True):
+        data.sync(conn, arbitrage)
+    conn.close()
+
 
-    print(f'{filename}: modifying columns')
-    conn.execute(f"""
-    ALTER TABLE "{k}" ALTER timestamp TYPE TIMESTAMP WITH TIME ZONE USING to_timestamp(timestamp) AT TIME ZONE 'UTC';
-    CREATE INDEX "{k}_timestamp" ON "{k}" (timestamp);
-    """)
-    print(f'{filename}: done')
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""One in-RAM copy of BitcoinEnv's feature arrays (all_observations, all_prices, all_prices_diff, the fit) for every
+process on the box. Each hypersearch.py tab / run.py used to hold its own copy, which is what maxes out RAM with a few
+`--gpu-split` tabs going. The first process to load a feature config publishes its arrays under the feature key to
+`/dev/shm` (POSIX shared memory as plain files, so tmpfs: RAM, never disk); the rest memory-map them read-only, same
+physical pages for all.
+
+It's a FeatureStore (data/features.py) rooted in /dev/shm, so publishing is the same atomic temp-dir-and-rename, plus
+reference counts: attaching drops a `refs/<pid>` file in the entry, and each process removes its own at exit. When
+the last live one goes, the entry goes (freeing the RAM). Refs of processes that died without cleaning up (kill -9)
+are pruned whenever anyone attaches or releases, so a crash doesn't pin the memory forever. Entries someone holds are
+never evicted to make room; if there's no room (max_bytes, or a small /dev/shm, eg Docker's 64MB default), publish()
+gives up and the process keeps its own copy, same as with sharing off.
+"""
+
+import os, glob, shutil, atexit
+from data.features import FeatureStore
+from data.cache import flock
+
+SHM_DIR = os.path.join('/dev/shm', 'tforce_btc_trader')
+MAX_BYTES = 4 * 1024**3
+
+
+def available(): return os.path.isdir(os.path.dirname(SHM_DIR))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # someone else's, but it's there
+    return True
+
+
+class SharedFeatures(FeatureStore):
+    def __init__(self, shm_dir=SHM_DIR, max_bytes=MAX_BYTES):
+        super().__init__(shm_dir, max_bytes)
+        self.attached = set()
+        atexit.register(self.release_all)
+
+    def _refs(self, key): return os.path.join(self._entry(key), 'refs')
+
+    def _live_refs(self, key):
+        """pids holding `key`, dropping any that aren't running anymore. Caller holds the lock"""
+        try:
+            pids = [int(p) for p in os.listdir(self._refs(key))]
+        except FileNotFoundError:
+            return []
+        live = []
+        for pid in pids:
+            if _alive(pid): live.append(pid)
+            else: os.remove(os.path.join(self._refs(key), str(pid)))
+        return live
+
+    def _evict(self, budget):
+        """FeatureStore's LRU eviction, but only of entries nobody (living) holds. Caller holds the lock"""
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(e[1] for e in entries)
+        for key, nbytes, _ in entries:
+            if total <= budget: break
+            if self._live_refs(key): continue
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= nbytes
+
+    def _room_for(self, nbytes):
+        """Whether `nbytes` more fits: under max_bytes counting what's held, and in the filesystem's free space.
+        Caller holds the lock"""
+        held = sum(b for key, b, _ in self.entries() if self._live_refs(key))
+        st = os.statvfs(self.dir)
+        return held + nbytes <= self.max_bytes and nbytes < st.f_bavail * st.f_frsize
+
+    def _sweep(self):
+        """Remove entries nobody (living) holds anymore. Caller holds the lock"""
+        for key, _, _ in self.entries():
+            if not self._live_refs(key): shutil.rmtree(self._entry(key), ignore_errors=True)
+
+    def attach(self, key):
+        """The published arrays for `key` (read-only memmaps, plus pickles), counting this process as a holder until
+        release(). None if nobody's published it."""
+        with flock(os.path.join(self.dir, '.lock')):
+            stored = self.get(key)
+            if stored is None: return None
+            os.makedirs(self._refs(key), exist_ok=True)
+            open(os.path.join(self._refs(key), str(os.getpid())), 'w').close()
+            self.attached.add(key)
+        return stored
+
+    def publish(self, key, spec=None, pickles=None, **arrays):
+        """put() + attach(); drop your own copy of `arrays` after and use what this returns. Entries left over from
+        crashed processes are cleared first, so they don't count against max_bytes. None if there's no room for it
+        (keep your own copy then)"""
+        nbytes = sum(arr.nbytes for arr in arrays.values())
+        with flock(os.path.join(self.dir, '.lock')):
+            self._sweep()
+            if not self._room_for(nbytes): return None
+        while True:
+            try:
+                self.put(key, spec=spec, pickles=pickles, **arrays)
+            except OSError:
+                # Out of space after all (someone else published meanwhile); drop our half-written temp dir
+                for tmp in glob.glob(self._entry(f'.{key}.*')): shutil.rmtree(tmp, ignore_errors=True)
+                return None
+            stored = self.attach(key)
+            if stored is not None: return stored
+            # Another publisher's _sweep() got it between our put & attach (it had no holders yet); again
+
+    def release(self, key):
+        """Stop holding `key`; removes the entry if that was the last live holder. Existing memmaps stay valid (the
+        files live until they're unmapped)"""
+        with flock(os.path.join(self.dir, '.lock')):
+            ref = os.path.join(self._refs(key), str(os.getpid()))
+            if os.path.exists(ref): os.remove(ref)
+            if not self._live_refs(key): shutil.rmtree(self._entry(key), ignore_errors=True)
+        self.attached.discard(key)
+
+    def release_all(self):
+        for key in list(self.attached): self.release(key)
+
+
+_instance = None
+
+
+def shared_features(max_bytes=MAX_BYTES):
+    """This process's SharedFeatures (one per process, so its refs are released once at exit)"""
+    global _instance
+    if _instance is None: _instance = SharedFeatures(max_bytes=max_bytes)
+    return _instance
@@ -0,0 +1,120 @@
+"""
+Test runs off the training thread. train_and_test stops training at each of its `n_tests` checkpoints for a
+deterministic pass over the 10k-row test window (40k for the final no-kill one), and with `-t 30` that's a good share
+of a trial. With `--overlap-tests`, each checkpoint instead snapshots the agent's weights (save_model) and hands the
+test to OverlappedTests: a second agent (same spec) on a worker thread restores the snapshot and runs the test on its
+own copy of the env (BitcoinEnv.test_env(), same features), while the main agent carries on training. TF releases
+the GIL while it runs the graph, so the two really do overlap.
+
+Results come back into acc.episode (sharpes/returns/uniques, printed like any test run) in checkpoint order, as they
+finish. early_stop only sees the ones that are in, so it can react a checkpoint or so later than it would have.
+Costs a second agent's memory (GPU too), so mind --gpu-split.
+
+FeedForwardPolicy is the other speed-up for those test runs, for conv2d nets. run_deterministic() used to agent.act()
+every step, the whole conv stack each time on one window. But the windows don't depend on what the agent does; only
+the stationary cash/value inputs do, and they go in after the conv layers (custom_net()). So the conv (series) part
+runs batched, a chunk of steps' windows per session run, and each step only runs the small dense head on top of its
+row of that, with the cash/value the last trades left.
+"""
+
+import os, glob, shutil, tempfile
+import numpy as np
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_STEPS = 512  # windows per batched series run. ~50MB of input at step_window=400 & ~30 features
+
+
+class OverlappedTests(object):
+    def __init__(self, env, make_agent):
+        """
+        :param env: the training BitcoinEnv (its prefetcher has the test windows ready)
+        :param make_agent: () -> a new agent like the one training (made on the worker thread, when first needed)
+        """
+        self.env, self.make_agent = env, make_agent
+        self.test_env = env.test_env()
+        self.agent = None
+        self.dir = tempfile.mkdtemp(prefix='tests_')
+        self.pool = ThreadPoolExecutor(max_workers=1)  # one at a time, in order
+        self.pending = []  # [(test_i, future)], oldest first
+
+    def _run(self, snapshot, window):
+        """Worker thread: the snapshot's deterministic test run; returns its EpisodeState"""
+        if self.agent is None: self.agent = self.make_agent()
+        self.agent.restore_model(file=snapshot)
+        for f in glob.glob(snapshot + '*'): os.remove(f)
+        self.test_env.use_window(window)
+        self.test_env.run_deterministic(SimpleNamespace(agent=self.agent), print_results=False)
+        return self.test_env.ep
+
+    def submit(self, agent, test_i, full_set=False):
+        """Snapshot `agent` (test run number `test_i`) and queue its test"""
+        snapshot = agent.save_model(os.path.join(self.dir, f'snapshot-{test_i}'), append_timestep=False)
+        window = self.env.prefetch.tests[full_set].result()
+        self.pending.append((test_i, self.pool.submit(self._run, snapshot, window)))
+
+    def collect(self, wait=False):
+        """Record finished test runs (in order; stops at the first still running, unless `wait`)"""
+        while self.pending and (wait or self.pending[0][1].done()):
+            test_i, future = self.pending.pop(0)
+            self.env.report_episode(future.result(), test_i)
+
+    def close(self):
+        self.collect(wait=True)
+        self.pool.shutdown()
+        if self.agent is not None: self.agent.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class FeedForwardPolicy(object):
+    def __init__(self, agent, env, series_out, chunk_steps=CHUNK_STEPS):
+        """Use of() instead, it checks the agent's network can do this
+        :param series_out: the net's series-only output in the act graph, before stationary's concatenated
+        """
+        self.agent, self.env, self.series_out, self.chunk_steps = agent, env, series_out, chunk_steps
+        self.model = agent.model
+        self.unique_action = 'type' in env.actions
+        self.chunk = None  # (first step, [chunk_steps, ...] series outputs)
+        self.checked, self.fallback = False, False
+
+    @classmethod
+    def of(cls, agent, env):
+        """A FeedForwardPolicy for `agent` on `env`, or None if its net has recurrent state (LSTM; every step depends
+        on the last) or nothing to split (stationary goes in at the start)"""
+        net = getattr(getattr(agent, 'model', None), 'network', None)
+        series_out = getattr(net, 'series_out', None)
+        if not env.conv2d or series_out is None or net.internals_spec(): return None
+        return cls(agent, env, series_out)
+
+    def _feed(self, series, stationary):
+        return self.model.get_feed_dict(states=dict(series=series, stationary=stationary), internals=dict(),
+                                        deterministic=True, independent=True)
+
+    def _embed(self, lo):
+        """Series part for steps [lo, lo + chunk_steps) of the current episode (fewer at its end), one session run"""
+        env = self.env
+        idx = np.arange(lo, min(lo + self.chunk_steps, env.limit))
+        series = env.get_states(idx)
+        out = self.model.monitored_session.run(self.series_out, self._feed(series, np.zeros((len(idx), 2))))
+        self.chunk = (lo, out)
+
+    def act(self, state, i):
+        """agent.act(state, deterministic=True, independent=True), `state` being step `i`'s"""
+        if self.fallback: return self.agent.act(state, deterministic=True, independent=True)
+        if self.chunk is None or not (0 <= i - self.chunk[0] < len(self.chunk[1])):
+            self._embed(i - i % self.chunk_steps)
+        lo, out = self.chunk
+        feed = self._feed([state['series']], [state['stationary']])
+        feed[self.series_out] = out[i - lo:i - lo + 1]
+        actions = self.model.monitored_session.run(self.model.actions_output, feed)
+        actions = {name: action[0] for name, action in actions.items()}
+        if self.unique_action: actions = actions['action']
+        if not self.checked:
+            # Once, against the real thing. If series_out wasn't from the act graph after all, we'd be off; fall back
+            self.checked = True
+            expected = self.agent.act(state, deterministic=True, independent=True)
+            pairs = [(expected, actions)] if self.unique_action else [(expected[k], actions[k]) for k in expected]
+            if not all(np.allclose(a, b) for a, b in pairs):
+                self.fallback = True
+                return expected
+        return actions
@@ -18,21 +18,22 @@ Each hyper is specified as `key: {type, vals, guess, pre/post/hydrate}`.
         database looking like this. Eg, baseline_mode, when set to True, does a number on many other hypers.
 """
 
-import argparse, json, math, time, pdb, os
+import argparse, math, time, pdb, os, copy
 from pprint import pprint
 from box import Box
 import numpy as np
 import pandas as pd
 import tensorflow as tf
-from sqlalchemy.sql import text
+from sqlalchemy.sql import select
 from tensorforce import TensorForceError
 from tensorforce.agents import agents as agents_dict
+from tensorforce.execution.threaded_runner import WorkerAgentGenerator
 from tensorforce.core.networks import layer as TForceLayers
 from tensorforce.core.networks.network import LayeredNetwork
 from sklearn.ensemble import GradientBoostingRegressor
 from sklearn.model_selection import GridSearchCV
 
-from btc_env import BitcoinEnv
+from btc_env import BitcoinEnv, WarmStart
 import utils
 from data import data
 
@@ -187,6 +188,10 @@ def custom_net(hypers, print_net=False, baseline=False):
             next_internals = dict()
             for i, layer in enumerate(self.layers):
                 if i == apply_stationary_here:
+                    if conv and i > 0 and not hasattr(self, 'series_out'):
+                        # Keep the series-only part's output (first apply() builds the act graph), so tests can run
+                        # it batched over a whole window & only the rest per step; see evaluator.FeedForwardPolicy
+                        self.series_out = x
                     x = tf.concat([x, stationary], axis=1)
 
                 layer_internals = {name: internals['{}_{}'.format(layer.scope, name)] for name in layer.internals_spec()}
@@ -370,7 +375,8 @@ hypers['custom'] = {
     # I'll revisit". Help wanted.
 
     # Currently disabling indicators in general. A good CNN should "see" those automatically in the window, right?
-    # If I'm wrong, experiment with these (see commit 6fc4ed2)
+    # If I'm wrong, experiment with these (see commit 6fc4ed2). Keep indicators_window's vals within
+    # indicators.WINDOWS, so trials pick them out of the precomputed bank rather than each running TA-Lib.
     'indicators_count': 0,
     'indicators_window': 0,
 
@@ -545,7 +551,8 @@ class HSearchEnv(object):
 
     TODO only tested with ppo_agent. Test with other agents
     """
-    def __init__(self, cli_args, agent='ppo_agent'):
+    def __init__(self, cli_args, agent='ppo_agent', warm=None):
+        """:param warm: a WarmStart, to run each trial's BitcoinEnv off of (--persistent; see main())"""
         net_type = cli_args.net_type
         hypers_ = hypers[agent].copy()
         hypers_.update(hypers['custom'])
@@ -562,10 +569,12 @@ class HSearchEnv(object):
         self.cli_args = cli_args
         self.conn = data.engine.connect()
         self.conn_runs = data.engine_runs.connect()
+        self.warm = warm
 
     def close(self):
         self.conn.close()
         self.conn_runs.close()
+        if self.warm: self.warm.close()
 
     def get_hypers(self, actions):
         """
@@ -631,28 +640,30 @@ class HSearchEnv(object):
     def execute(self, actions):
         flat, hydrated, network = self.get_hypers(actions)
 
-        env = BitcoinEnv(flat, self.cli_args)
-        agent = agents_dict[self.agent](
-            states=env.states,
-            actions=env.actions,
-            network=network,
-            **hydrated
-        )
+        env = BitcoinEnv(flat, self.cli_args, warm=self.warm)
+
+        def make_agent(worker_of=None):
+            # worker_of: make a worker agent over that agent's model instead (--n-envs, see rollouts.py)
+            agent_class, model = agents_dict[self.agent], {}
+            if worker_of is not None:
+                agent_class, model = WorkerAgentGenerator(agent_class), dict(model=worker_of.model)
+            return agent_class(
+                states=env.states,
+                actions=env.actions,
+                network=copy.deepcopy(network),
+                **copy.deepcopy(hydrated),
+                **model
+            )
+        agent = make_agent()
 
-        env.train_and_test(agent, self.cli_args.n_steps, self.cli_args.n_tests, -1)
+        env.train_and_test(agent, self.cli_args.n_steps, self.cli_args.n_tests, -1, make_agent=make_agent)
 
         step_acc, ep_acc = env.acc.step, env.acc.episode
         adv_avg = utils.calculate_score(ep_acc.returns)
         print(flat, f"\nScore={adv_avg}\n\n")
 
-        sql = """
-          insert into runs (hypers, sharpes, returns, uniques, prices, signals, agent, flag)
-          values (:hypers, :sharpes, :returns, :uniques, :prices, :signals, :agent, :flag)
-          returning id;
-        """
-        row = self.conn_runs.execute(
-            text(sql),
-            hypers=json.dumps(flat),
+        res = self.conn_runs.execute(data.runs.insert().values(
+            hypers=flat,
             sharpes=list(ep_acc.sharpes),
             returns=list(ep_acc.returns),
             uniques=list(ep_acc.uniques),
@@ -660,14 +671,15 @@ class HSearchEnv(object):
             signals=list(step_acc.signals),
             agent=self.agent,
             flag=self.cli_args.net_type
-        ).fetchone()
+        ))
 
         if ep_acc.returns[-1] > 0:
-            _id = str(row[0])
+            _id = str(res.inserted_primary_key[0])
             directory = os.path.join(os.getcwd(), "saves", _id)
             filestar = os.path.join(directory, _id)
             os.makedirs(directory, exist_ok=True)
             agent.save_model(filestar)
+            env.save_fit(directory)  # the fit too, so restoring the model (run.py) transforms data the same way
 
         agent.close()
         env.close()
@@ -675,8 +687,8 @@ class HSearchEnv(object):
 
     def get_winner(self, id=None):
         if id:
-            sql = "select id, hypers from runs where id=:id"
-            winner = self.conn_runs.execute(text(sql), id=id).fetchone()
+            runs = data.runs
+            winner = self.conn_runs.execute(select([runs.c.id, runs.c.hypers]).where(runs.c.id == id)).fetchone()
             winner = winner.hypers
             print(winner)
         else:
@@ -736,14 +748,16 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--guess', type=int, default=-1, help="Run the hard-coded 'guess' values first before exploring")
     parser.add_argument('--boost', action="store_true", default=False, help="Use custom gradient-boosting optimization, or bayesian optimization?")
+    parser.add_argument('--persistent', action="store_true", default=False, help="Keep DB connections & recently used features loaded across trials (only the agent gets rebuilt each trial)")
     utils.add_common_args(parser)
     args = parser.parse_args()
 
-    # Encode features
-    hsearch = HSearchEnv(cli_args=args)
+    # Encode features. With --persistent this HSearchEnv stays open & runs every trial, rather than one per trial
+    # (each with fresh DB connections, and a BitcoinEnv loading its features from scratch)
+    hsearch = HSearchEnv(cli_args=args, warm=WarmStart() if args.persistent else None)
     hypers_, hardcoded = hsearch.hypers, hsearch.hardcoded
     hypers_ = {k: v for k, v in hypers_.items() if k not in hardcoded}
-    hsearch.close()
+    if not args.persistent: hsearch.close()
 
     # Build a matrix of features,  length = max feature size
     max_num_vals = 0
@@ -808,19 +822,20 @@ def main():
 
     # Specify the "loss" function (which we'll maximize) as a single rl_hsearch instantiate-and-run
     def loss_fn(params):
-        hsearch = HSearchEnv(cli_args=args)
-        reward = hsearch.execute(vec2hypers(params))
-        hsearch.close()
+        if args.persistent: return [hsearch.execute(vec2hypers(params))]
+        trial = HSearchEnv(cli_args=args)
+        reward = trial.execute(vec2hypers(params))
+        trial.close()
         return [reward]
 
     guess_i = 0
     while True:
         # Every iteration, re-fetch from the database & pre-train new model. Acts same as saving/loading a model to disk,
         # but this allows to distribute across servers easily
-        conn_runs = data.engine_runs.connect()
-        sql = "select hypers, returns from runs where flag=:f"
-        runs = conn_runs.execute(text(sql), f=args.net_type).fetchall()
-        conn_runs.close()
+        conn_runs = hsearch.conn_runs if args.persistent else data.engine_runs.connect()
+        query = select([data.runs.c.hypers, data.runs.c.returns]).where(data.runs.c.flag == args.net_type)
+        runs = conn_runs.execute(query).fetchall()
+        if not args.persistent: conn_runs.close()
         X, Y = [], []
         for run in runs:
             X.append(hypers2vec(run.hypers))
@@ -0,0 +1,79 @@
+"""
+TA-Lib technical indicators for BitcoinEnv.xform_data, as a bank. `indicators_window` & `indicators_count` are hypers,
+and every trial used to run each indicator for its one window over the full history. Instead we compute every
+indicator for every window in WINDOWS once per data version, keep that bank in the feature store (data/features.py)
+next to the base features, and trials just pick their columns out of it (memory-mapped, so only the picked columns
+get read).
+
+MOM & SMA are done for all windows with numpy (a shift and a cumsum), the recursive ones (RSI, EMA, ATR) go through
+TA-Lib's C loops, one call per window. Either way, output matches `talib.<IND>(..., timeperiod=window)`, NaN lookback
+padding included.
+"""
+
+import numpy as np
+import talib
+
+# Sort these by effectiveness; `indicators_count` takes the first n. I'm no expert, so if this seems off please submit a
+# PR! Later after you've optimized the other hypers, come back here and create a hyper for every indicator you want to
+# try (zoom in on indicators)
+INDICATORS = [
+    'MOM',
+    'SMA',
+    # 'BBANDS',  # TODO signature different; special handling
+    'RSI',
+    'EMA',
+    'ATR'
+]
+
+# Windows the bank covers. If you search `indicators_window` in hypersearch.py, keep its vals in here; a window outside
+# this list still works, it's just computed per-trial like before.
+WINDOWS = [5, 10, 20, 30, 50, 100, 150, 200, 300]
+
+
+def col_name(table, indicator, window): return f'{table}_{indicator}_{window}'
+
+
+def _padded(values, lookback, n):
+    """`values` behind `lookback` NaNs, as TA-Lib pads its output (all NaN if there's not enough data)"""
+    out = np.full(n, np.nan)
+    if lookback < n: out[lookback:] = values
+    return out
+
+
+def momentum(close, windows):
+    """talib.MOM for each window: close[t] - close[t-w]"""
+    return {w: _padded(close[w:] - close[:max(len(close) - w, 0)], w, len(close)) for w in windows}
+
+
+def sma(close, windows):
+    """talib.SMA for each window, off one cumsum. Prices are offset by close[0] first so the running total stays small
+    (less float drift over millions of rows)."""
+    base = close[0] if len(close) else 0.
+    csum = np.concatenate([[0.], np.cumsum(close - base)])
+    return {w: _padded((csum[w:] - csum[:max(len(csum) - w, 0)]) / w + base, w - 1, len(close)) for w in windows}
+
+
+def compute(ohlcv, indicator, window):
+    """One indicator, one window.
+    :param ohlcv: dict of float64 arrays with keys open/high/low/close/volume
+    """
+    close = ohlcv['close']
+    if indicator == 'MOM': return momentum(close, [window])[window]
+    if indicator == 'SMA': return sma(close, [window])[window]
+    if indicator == 'ATR': return talib.ATR(ohlcv['high'], ohlcv['low'], close, timeperiod=window)
+    return getattr(talib, indicator)(close, timeperiod=window)
+
+
+def bank(ohlcv, table, windows=WINDOWS, indicators=INDICATORS):
+    """Every indicator for every window, as {col_name(table, indicator, window): array}"""
+    ohlcv = {k: np.ascontiguousarray(v, dtype=np.float64) for k, v in ohlcv.items()}
+    out = {}
+    if 'MOM' in indicators:
+        out.update({col_name(table, 'MOM', w): v for w, v in momentum(ohlcv['close'], windows).items()})
+    if 'SMA' in indicators:
+        out.update({col_name(table, 'SMA', w): v for w, v in sma(ohlcv['close'], windows).items()})
+    for ind in indicators:
+        if ind in ('MOM', 'SMA'): continue
+        for w in windows:
+            out[col_name(table, ind, w)] = compute(ohlcv, ind, w)
+    return out
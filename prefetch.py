@@ -0,0 +1,63 @@
+"""
+Background loading for train_and_test. It alternates a random TRAIN window and the fixed TEST window, and each
+use_dataset() used to recount the history's rows and slice (and with OUT_OF_CORE, page in the window's chunks) right
+when the agent wanted to start. EpisodePrefetcher prepares the next TRAIN window (BitcoinEnv.prepare_window()) on a
+background thread while the agent trains on the current one, and both TEST windows once up-front, so switching is
+just use_window() on something that's already there. With parallel rollouts (rollouts.py) it's a TRAIN window per env.
+
+Whatever time the agent still spends waiting on a window is recorded as `stalls` (seconds, one per switch), and
+train_and_test prints what accrued since the last test run with each one (stalled()), so you can see loading's actually
+hidden (it should be ~0).
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from data import data
+from btc_env import Mode
+
+
+class EpisodePrefetcher(object):
+    def __init__(self, env, n_train=1):
+        """
+        :param env: the BitcoinEnv to prepare windows for (features loaded, not in live mode)
+        :param n_train: TRAIN windows needed at a time (one per env training at once)
+        """
+        self.env = env
+        self.row_ct = data.count_rows(env.conn, arbitrage=env.hypers.arbitrage)  # once, not per window
+        # One worker: windows are prepared one after another, in order
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.tests = {full_set: self.pool.submit(env.prepare_window, Mode.TEST, full_set, self.row_ct)
+                      for full_set in (False, True)}
+        self.next_train = [self.pool.submit(env.prepare_window, Mode.TRAIN, False, self.row_ct)
+                           for _ in range(n_train)]
+        self.stalls = []
+        self.reported = 0  # stalls already counted by a stalled() call
+
+    def _wait(self, future):
+        start = time.time()
+        window = future.result()
+        self.stalls.append(time.time() - start)
+        return window
+
+    def train(self, envs=None):
+        """use_dataset(Mode.TRAIN), with the window prepared ahead; starts on the one after
+        :param envs: the envs to give windows to (default just env), at most n_train of them
+        """
+        for k, env in enumerate(envs or [self.env]):
+            window = self._wait(self.next_train[k])
+            self.next_train[k] = self.pool.submit(self.env.prepare_window, Mode.TRAIN, False, self.row_ct)
+            env.use_window(window)
+
+    def test(self, full_set=False):
+        """use_dataset(Mode.TEST, full_set). These windows are always the same, so they're prepared once & kept"""
+        self.env.use_window(self._wait(self.tests[full_set]))
+
+    def stalled(self):
+        """Seconds waited on windows since the last call (however many switches that was, eg one per env with
+        --n-envs), for printing with each test run"""
+        stalls, self.reported = self.stalls[self.reported:], len(self.stalls)
+        return sum(stalls)
+
+    def close(self):
+        for f in self.next_train: f.cancel()
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,67 @@
+"""
+Parallel rollouts for train_and_test, `--n-envs K`. With one BitcoinEnv through one Runner, a many-core box trains on
+one core: act() (a TF session run), then execute(), then observe(), one after another. Here there are K envs, each
+on its own random TRAIN window (BitcoinEnv.worker_env() copies, so same features, own episode state), and each runs
+the Runner loop in its own thread with its own agent. Those are worker agents over the main agent's model
+(TensorForce's WorkerAgentGenerator, what its ThreadedRunner does), so all K feed experience to the one network
+being trained. TF releases the GIL while it runs the graph, so the threads' session runs can overlap; the Python
+between them (execute() and the like, see trading.py) can't. How much that buys depends on how much of a step is the
+session run: `python bench.py rollouts` (a small dense layer standing in for the agent) shows about none, so don't
+count on it being faster. What it does give each update is experience from K windows at once.
+
+The timestep budget given to run() is shared between the K envs. When it runs out, each env's episode is cut short
+with one more step, observed as terminal, so the agent doesn't hold on to a half-finished episode.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from btc_env import Mode
+
+
+class ParallelRollouts(object):
+    def __init__(self, env, agent, make_agent, n_envs):
+        """
+        :param env: the training BitcoinEnv (env 0, with `agent`)
+        :param make_agent: (worker_of=agent) -> a worker agent sharing `agent`'s model, see hypersearch/run.py
+        :param n_envs: K, envs stepping at once (including `env`)
+        """
+        self.envs = [env] + [env.worker_env(Mode.TRAIN) for _ in range(n_envs - 1)]
+        self.agents = [agent] + [make_agent(worker_of=agent) for _ in range(n_envs - 1)]
+        self.pool = ThreadPoolExecutor(max_workers=n_envs)
+        self.lock = threading.Lock()
+        self.timesteps, self.stop = 0, False
+
+    def _spent(self, budget):
+        with self.lock: return self.stop or self.timesteps >= budget
+
+    def _take_step(self, budget):
+        """Count a timestep against the shared budget; False once it's used up"""
+        with self.lock:
+            if self.stop or self.timesteps >= budget: return False
+            self.timesteps += 1
+            return True
+
+    def _rollout(self, env, agent, budget):
+        """Runner.run(), in a worker thread: whole episodes until the budget's used up (the last one cut short, with
+        a terminal observe() so the agent closes it out)"""
+        while not self._spent(budget):
+            agent.reset()
+            state, terminal = env.reset(), False
+            while not terminal:
+                last = not self._take_step(budget)
+                state, terminal, reward = env.execute(agent.act(state))
+                agent.observe(terminal=terminal or last, reward=reward)
+                if last: return
+
+    def run(self, timesteps):
+        """`timesteps` env steps between all the envs, each on the window it was given (EpisodePrefetcher.train())"""
+        self.timesteps, self.stop = 0, False
+        futures = [self.pool.submit(self._rollout, env, agent, timesteps) for env, agent in zip(self.envs, self.agents)]
+        try:
+            for f in futures: f.result()
+        finally:
+            self.stop = True  # Ctrl-C (or one failing) stops the rest too
+
+    def close(self):
+        self.stop = True
+        self.pool.shutdown()
@@ -4,8 +4,9 @@ live, or "dry-run live" (--test-live), etc. Note, you need to run this file once
 train and save the model (hypersearch doesn't save models).
 """
 
-import argparse, os
+import argparse, os, copy
 from tensorforce.agents import agents as agents_dict
+from tensorforce.execution.threaded_runner import WorkerAgentGenerator
 import shutil
 
 import utils
@@ -36,19 +37,33 @@ def main():
     flat, hydrated, network = hs.get_winner(id=args.id)
     env = BitcoinEnv(flat, cli_args=args)
 
-    agent = agents_dict['ppo_agent'](
-        states=env.states,
-        actions=env.actions,
-        network=network,
-        **hydrated
-    )
+    def make_agent(worker_of=None):
+        # worker_of: make a worker agent over that agent's model instead (--n-envs, see rollouts.py)
+        agent_class, model = agents_dict['ppo_agent'], {}
+        if worker_of is not None:
+            agent_class, model = WorkerAgentGenerator(agent_class), dict(model=worker_of.model)
+        return agent_class(
+            states=env.states,
+            actions=env.actions,
+            network=copy.deepcopy(network),
+            **copy.deepcopy(hydrated),
+            **model
+        )
+    agent = make_agent()
 
     if live_ish:
         agent.restore_model(directory)
+        # Transform live data with the scaler fit at training time (saved alongside the model), unless asked not to
+        if args.clear_scalers:
+            try: os.remove(os.path.join(directory, 'scaler.pkl'))
+            except FileNotFoundError: pass
+        elif not env.load_fit(directory):
+            print("No saved scaler.pkl, live mode will fit one on its ramp-up")
         env.run_live(agent, test=args.test_live)
     else:
-        env.train_and_test(agent, args.n_steps, args.n_tests, args.early_stop)
+        env.train_and_test(agent, args.n_steps, args.n_tests, args.early_stop, make_agent=make_agent)
         agent.save_model(filestar)
+        env.save_fit(directory)
         agent.close()
         env.close()
 
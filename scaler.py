@@ -0,0 +1,111 @@
+"""
+Robust scaling (`(x - median) / (q99 - q1)`, per column; what `preprocessing.robust_scale(X, quantile_range=(1., 99.))`
+does) fit one chunk at a time. robust_scale needs the whole matrix in memory and nothing of it survives the call, so
+live mode used to pull 1e5 rows just to re-learn the scaling. Here each column keeps a KLL quantile sketch
+(https://arxiv.org/abs/1603.05346): bounded size whatever the row count, and mergeable, so partial fits over separate
+chunks (or processes) combine into the same kind of fit. The fitted scaler gets pickled next to the saved model
+(`saves/<name>/scaler.pkl`) and reloaded by live mode.
+
+Quantiles off the sketch are approximate in rank (about 1/K), not value; price ratios all sit around 1.0, so a
+relative-value sketch (DDSketch etc) would blow up q99 - q1 for those.
+"""
+
+import numpy as np
+
+K = 2048  # sketch accuracy; rank error is roughly 1/K
+CHUNK = 100000
+
+
+class QuantileSketch(object):
+    """KLL sketch over one column. levels[h] holds items standing in for 2**h of the originals each"""
+    def __init__(self, k=K, seed=0):
+        self.k, self.n = k, 0
+        self.levels = [np.empty(0)]
+        self.rng = np.random.RandomState(seed)  # fixed seed, so the same data gives the same fit
+
+    def _capacity(self, h):
+        return max(int(self.k * (2 / 3) ** (len(self.levels) - h - 1)), 2)
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            if len(self.levels[h]) > self._capacity(h):
+                if h + 1 == len(self.levels): self.levels.append(np.empty(0))
+                level = np.sort(self.levels[h])
+                odd = len(level) % 2
+                # Every other item goes up a level (at double the weight), from a random start; an odd one stays put
+                promote = level[odd:][self.rng.randint(2)::2]
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promote])
+                self.levels[h] = level[:odd]
+            h += 1
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]  # like nanpercentile
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.n += len(values)
+        self._compress()
+
+    def merge(self, other):
+        self.levels += [np.empty(0)] * (len(other.levels) - len(self.levels))
+        for h, level in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], level])
+        self.n += other.n
+        self._compress()
+
+    def quantiles(self, qs):
+        """:param qs: quantiles in [0, 1]"""
+        if not self.n: return np.full(len(qs), np.nan)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2. ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='mergesort')
+        values, cum = values[order], np.cumsum(weights[order])
+        idx = np.searchsorted(cum, np.asarray(qs) * cum[-1], side='left')
+        return values[np.clip(idx, 0, len(values) - 1)]
+
+
+class SketchScaler(object):
+    def __init__(self, quantile_range=(1., 99.), k=K):
+        self.quantile_range, self.k = quantile_range, k
+        self.sketches = None
+        self.center_ = self.scale_ = None
+
+    def partial_fit(self, X):
+        X = np.asarray(X)
+        if self.sketches is None:
+            self.sketches = [QuantileSketch(self.k) for _ in range(X.shape[1])]
+        for j, sketch in enumerate(self.sketches):
+            sketch.update(X[:, j])
+        self.center_ = self.scale_ = None
+        return self
+
+    def fit(self, X, chunksize=CHUNK):
+        for start in range(0, len(X), chunksize):
+            self.partial_fit(X[start:start + chunksize])
+        self._finalize()
+        return self
+
+    def merge(self, other):
+        """Fold another (partial) fit over other rows into this one, as if we'd seen its rows too"""
+        if self.sketches is None:
+            self.sketches = [QuantileSketch(self.k) for _ in other.sketches]
+        for mine, theirs in zip(self.sketches, other.sketches):
+            mine.merge(theirs)
+        self.center_ = self.scale_ = None
+        return self
+
+    def _finalize(self):
+        lo, hi = self.quantile_range
+        q = np.array([[s.quantiles([.5, lo / 100., hi / 100.]) for s in self.sketches]]).reshape(-1, 3)
+        self.center_ = q[:, 0]
+        scale = q[:, 2] - q[:, 1]
+        scale[~(scale > 10 * np.finfo(np.float64).eps)] = 1.  # constant columns stay put, same as sklearn
+        self.scale_ = scale
+
+    def transform(self, X, copy=True):
+        """:param copy: False scales X in-place (saves a copy of a big matrix), keeping its dtype"""
+        if self.center_ is None: self._finalize()
+        if copy: return (np.asarray(X) - self.center_) / self.scale_
+        X -= self.center_.astype(X.dtype)
+        X /= self.scale_.astype(X.dtype)
+        return X
@@ -0,0 +1,188 @@
+"""
+Incremental version of BitcoinEnv.xform_data for LIVE/TEST_LIVE. Batch xform_data over the ramp-up window is fine
+once, but re-running it over the whole frame every time a tick comes in makes tick->state latency grow with the
+window. FeatureStream keeps rolling state instead (last target price, each indicator's running sums/averages) and
+turns each new row into its observation row in constant time.
+
+The data-dependent bits of xform_data (the target's outlier quantile and the robust scaler's center/scale) are
+frozen at whatever the batch fit found (over the ramp-up, or saved with the model); see `BitcoinEnv.xform_fit`. With those, pushing the same
+rows through here gives the same observations as the batch transform (test.py checks). Indicator state follows
+TA-Lib's own recurrences (seeding included), so it matches them too, give or take the last float bit where TA-Lib's
+compiled arithmetic rounds differently. `--autoencode` isn't supported here (its autoencoder is refit per transform), so
+BitcoinEnv re-transforms the whole frame per tick with it on, the way it used to.
+"""
+
+from collections import deque
+import numpy as np
+import indicators
+
+NAN = float('nan')
+
+
+class Mom(object):
+    """talib.MOM"""
+    def __init__(self, n):
+        self.n, self.closes = n, deque(maxlen=n + 1)
+
+    def update(self, high, low, close):
+        self.closes.append(close)
+        return close - self.closes[0] if len(self.closes) > self.n else NAN
+
+
+class Sma(object):
+    """indicators.sma, ie the same offset cumsum, so it's float-for-float the same"""
+    def __init__(self, n):
+        self.n, self.base, self.csum, self.sums = n, None, 0., deque([0.], maxlen=n + 1)
+
+    def update(self, high, low, close):
+        if self.base is None: self.base = close
+        self.csum += close - self.base
+        self.sums.append(self.csum)
+        return (self.sums[-1] - self.sums[0]) / self.n + self.base if len(self.sums) > self.n else NAN
+
+
+class Ema(object):
+    """talib.EMA: seeded with the SMA of the first n, then k = 2/(n+1)"""
+    def __init__(self, n):
+        self.n, self.k, self.i, self.total, self.ema = n, 2. / (n + 1), 0, 0., NAN
+
+    def update(self, high, low, close):
+        self.i += 1
+        if self.i <= self.n:
+            self.total += close
+            if self.i < self.n: return NAN
+            self.ema = self.total / self.n
+        else:
+            self.ema = (close - self.ema) * self.k + self.ema
+        return self.ema
+
+
+class Rsi(object):
+    """talib.RSI: simple average of the first n gains/losses, Wilder-smoothed after"""
+    def __init__(self, n):
+        self.n, self.i, self.prev, self.gain, self.loss = n, 0, None, 0., 0.
+
+    def update(self, high, low, close):
+        if self.prev is None:
+            self.prev = close
+            return NAN
+        delta, self.prev = close - self.prev, close
+        self.i += 1
+        if self.i > self.n:
+            self.gain *= self.n - 1
+            self.loss *= self.n - 1
+        if delta < 0: self.loss -= delta
+        else: self.gain += delta
+        if self.i < self.n: return NAN
+        self.gain /= self.n
+        self.loss /= self.n
+        total = self.gain + self.loss
+        return 100 * (self.gain / total) if not -1e-8 < total < 1e-8 else 0.
+
+
+class Atr(object):
+    """talib.ATR: SMA of the first n true ranges, Wilder-smoothed after"""
+    def __init__(self, n):
+        self.n, self.i, self.prev_close, self.total, self.atr = n, 0, None, 0., NAN
+
+    def update(self, high, low, close):
+        if self.prev_close is None:
+            self.prev_close = close
+            return NAN
+        tr = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+        self.prev_close = close
+        self.i += 1
+        if self.i <= self.n:
+            self.total += tr
+            if self.i < self.n: return NAN
+            self.atr = self.total / self.n
+        else:
+            self.atr = (self.atr * (self.n - 1) + tr) / self.n
+        return self.atr
+
+
+STATES = dict(MOM=Mom, SMA=Sma, EMA=Ema, RSI=Rsi, ATR=Atr)
+
+
+class FeatureStream(object):
+    def __init__(self, tables_, target, indicators_count, indicators_window, diff_q, scaler):
+        """
+        :param tables_: data.get_tables(arbitrage), same as the batch transform used
+        :param diff_q, scaler: frozen fit from the batch transform (BitcoinEnv.xform_fit)
+        """
+        self.window = indicators_window if indicators_count else 0
+        self.diff_q, self.scaler = diff_q, scaler
+        self.columns = [f"{t['name']}_{c}" for t in tables_ for c in t['cols']]  # raw inputs, in push() order
+        idx = {c: i for i, c in enumerate(self.columns)}
+        self.target = idx[target]
+
+        # One (kind, column index) per output column, in xform_data's order; indicators hold their running state
+        self.plan = []
+        for table in tables_:
+            for col in table['cols']:
+                name_col = f"{table['name']}_{col}"
+                kind = 'diff' if name_col == target else 'ratio' if col in table['price_cols'] else 'raw'
+                self.plan.append((kind, idx[name_col]))
+            ohlcv = table.get('ohlcv', {})
+            if ohlcv and indicators_count:
+                hlc = tuple(idx[f"{table['name']}_{ohlcv[k]}"] for k in ('high', 'low', 'close'))
+                for name in indicators.INDICATORS[:indicators_count]:
+                    self.plan.append((STATES[name](indicators_window), hlc))
+
+        self.i = 0
+        self.last_price, self.last_diff = None, 0.
+        self.row = np.empty(len(self.plan))
+
+    def pct_change(self, price):
+        """The target's percent-change, as BitcoinEnv.diff() would with its outlier quantile frozen at diff_q"""
+        if self.last_price is None:
+            diff = 0.  # always NaN, nothing to compare to
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                diff = float(np.float64(price) / self.last_price - 1)
+            if not np.isfinite(diff) or diff > self.diff_q:
+                diff = self.last_diff  # outliers & infs get forward-filled
+        self.last_price, self.last_diff = price, diff
+        return diff
+
+    def push(self, values):
+        """Feed one new row (raw values in `self.columns` order).
+        :return: (observation, price), or None while the indicators are still within their warm-up window (same
+            rows xform_data trims off the start)
+        """
+        price = values[self.target]
+        row = self.row
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for j, (kind, src) in enumerate(self.plan):
+                if kind == 'diff': row[j] = self.pct_change(price)
+                elif kind == 'ratio': row[j] = np.float64(values[src]) / price
+                elif kind == 'raw': row[j] = values[src]
+                else: row[j] = np.float64(kind.update(*(values[k] for k in src))) / price
+        self.i += 1
+        if self.i <= self.window: return None
+        return self.scaler.transform(row), price
+
+    def warm(self, df):
+        """Push every row of `df` (eg the ramp-up the batch fit ran over), returning the emitted observations"""
+        out = [self.push(values) for values in df[self.columns].values]
+        return np.array([o for o, _ in filter(None, out)])
+
+
+class Rows(object):
+    """Append-only 1d/2d float array with amortised O(1) appends; `.array` is a view of the filled part"""
+    def __init__(self, initial):
+        initial = np.asarray(initial, dtype=np.float64)
+        self.n = len(initial)
+        self.buf = np.empty((max(self.n * 2, 16),) + initial.shape[1:])
+        self.buf[:self.n] = initial
+
+    def append(self, row):
+        if self.n == len(self.buf):
+            buf = np.empty((len(self.buf) * 2,) + self.buf.shape[1:])
+            buf[:self.n] = self.buf[:self.n]
+            self.buf = buf
+        self.buf[self.n] = row
+        self.n += 1
+
+    @property
+    def array(self): return self.buf[:self.n]
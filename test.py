@@ -1,9 +1,11 @@
 import pdb
 from data import data
-from data.data import F, Z
+from data.data import F, B, Z
 from btc_env import BitcoinEnv, Mode
 from hypersearch import HSearchEnv
+import numpy as np
 import pandas as pd
+from box import Box
 
 COUNT = 101
 
@@ -129,5 +131,607 @@ def main():
     assert env.acc.episode.advantages[-1] > 0
 
 
+def ohlcv_history(n):
+    """One OHLCV table as `data.tables`, and `n` rows of random history for it"""
+    data.tables = [
+        dict(
+            name='a',
+            ts='ts',
+            cols=dict(o=F, h=F, l=F, c=F, v=Z),
+            ohlcv=dict(open='o', high='h', low='l', close='c', volume='v'),
+            price_cols=['o', 'h', 'l', 'c']
+        )
+    ]
+    data.target = 'a_c'
+    c = np.random.rand(n).cumsum() + 100
+    c[n // 2] *= 3  # an outlier for diff()'s quantile mask
+    return pd.DataFrame(dict(a_o=c + np.random.randn(n) * .1, a_h=c + 1, a_l=c - 1, a_c=c, a_v=np.random.rand(n)))
+
+
+def bare_env(hypers, **cli_args):
+    """A BitcoinEnv with no DB behind it (and no features yet): set all_observations etc yourself"""
+    env = BitcoinEnv.__new__(BitcoinEnv)
+    env.hypers = Box(dict({'net.type': 'lstm', 'action_type': 'single_discrete', 'step_window': 20,
+                           'arbitrage': False, 'indicators_count': 0, 'indicators_window': 0}, **hypers))
+    env.cli_args = Box(dict(dict(autoencode=False, float32=False), **cli_args))
+    env.conv2d = env.hypers['net.type'] == 'conv2d'
+    env.conn, env.ep, env.mode, env.prefetch = None, None, Mode.TRAIN, None
+    env.start_cash, env.start_value, env.min_trade = .4, .4, .01
+    env.acc = Box(episode=dict(i=0, total_steps=0, sharpes=[], returns=[], uniques=[]), step=None,
+                  tests=dict(i=0, n_tests=0))
+    return env
+
+
+def test_feature_stream():
+    """streaming.FeatureStream (live ticks, O(1) each) must give the same observations as batch xform_data on the
+    same rows, for every indicator"""
+    df = ohlcv_history(3000)
+    for count, window in [(0, 0), (3, 30), (5, 14)]:
+        env = bare_env(dict(indicators_count=count, indicators_window=window))  # just the transforms
+        states, prices = env.xform_data(df)
+        streamed = env.feature_stream().warm(df)
+        assert streamed.shape == states.shape
+        assert np.allclose(streamed, states, rtol=1e-12, atol=1e-12)
+
+
+def test_vec_env():
+    """VecBitcoinEnv must step each of its episodes bit-for-bit like BitcoinEnv.execute() does, per action type"""
+    from vec_env import VecBitcoinEnv
+    n_rows, n_envs, n_steps = 20000, 8, 6000  # > EPISODE_LEN, so every row ends at least once
+    data.count_rows = lambda *args, **kwargs: n_rows
+    for net_type, action_type in [('lstm', 'single_discrete'), ('lstm', 'single_continuous'), ('conv2d', 'multi')]:
+        env = BitcoinEnv.__new__(BitcoinEnv)  # no DB, random features
+        env.hypers = Box({'net.type': net_type, 'action_type': action_type, 'step_window': 20, 'arbitrage': False})
+        env.conv2d, env.conn, env.ep, env.mode = net_type == 'conv2d', None, None, Mode.TRAIN
+        env.start_cash, env.start_value, env.min_trade = .4, .4, .01
+        env.acc = Box(episode=dict(i=0, total_steps=0, sharpes=[], returns=[], uniques=[]), step=None)
+        env.all_observations = np.random.randn(n_rows, 6)
+        env.all_prices = np.random.randn(n_rows).cumsum() + 10000
+        env.all_prices_diff = env.diff(env.all_prices)
+
+        if action_type == 'single_discrete': actions = np.random.randint(0, 3, (n_steps, n_envs))
+        elif action_type == 'single_continuous': actions = np.random.uniform(-1, 1, (n_steps, n_envs))
+        else: actions = dict(action=np.random.randint(0, 3, (n_steps, n_envs)),
+                             amount=np.random.uniform(0, 1, (n_steps, n_envs)))
+        act = (lambda t, k: actions[t, k]) if action_type != 'multi' else \
+            (lambda t, k: dict(action=actions['action'][t, k], amount=actions['amount'][t, k]))
+
+        vec = VecBitcoinEnv(env, n_envs)
+        # Record each row's episodes as (offset, first step, first state), then its steps
+        states = vec.reset()
+        episodes = [[(vec.offsets[k], 0, states['series'][k], [])] for k in range(n_envs)]
+        for t in range(n_steps):
+            step_actions = actions[t] if action_type != 'multi' else {k: v[t] for k, v in actions.items()}
+            states, terminals, rewards = vec.step(step_actions)
+            for k in range(n_envs):
+                offset, start, first, steps = episodes[k][-1]
+                if terminals[k]:
+                    steps.append((rewards[k], True, None, None))
+                    episodes[k].append((vec.offsets[k], t + 1, states['series'][k], []))
+                else:
+                    steps.append((rewards[k], False, states['series'][k], states['stationary'][k]))
+
+        n_episodes = 0
+        for k in range(n_envs):
+            for offset, start, first, steps in episodes[k]:
+                env.offset, env.limit = offset, env.EPISODE_LEN
+                env.prices_diff = env.all_prices_diff[offset:offset + env.limit]
+                assert np.array_equal(env.reset()['series'], first)
+                for j, (reward, terminal, series, stationary) in enumerate(steps):
+                    state, terminal_, reward_ = env.execute(act(start + j, k))
+                    assert bool(terminal_) == terminal and reward_ == reward
+                    if terminal: break
+                    assert np.array_equal(state['series'], series)
+                    assert np.array_equal(state['stationary'], stationary)
+                n_episodes += any(terminal for _, terminal, _, _ in steps)
+        assert n_episodes == len(env.acc.episode.sharpes)
+
+
+def test_backtest():
+    """backtest() over a whole action array must score it exactly as stepping BitcoinEnv.execute() does, and replay()
+    of the signals that gives must land on the same totals. The env steps on diff()'d prices (outliers masked), so
+    replay() has to mask them the same way"""
+    from backtest import backtest, replay
+    n = 5000
+    prices = np.random.randn(n).cumsum() + 10000
+    prices[np.random.randint(1, n, 100)] *= 1.05  # spikes, past the 99th percentile
+    for action_type in ('single_discrete', 'single_continuous', 'multi'):
+        if action_type == 'single_discrete': actions = np.random.randint(0, 3, n)
+        elif action_type == 'single_continuous': actions = np.random.uniform(-1, 1, n)
+        else: actions = dict(action=np.random.randint(0, 3, n), amount=np.random.uniform(0, 1, n))
+
+        env = BitcoinEnv.__new__(BitcoinEnv)
+        env.hypers = Box({'net.type': 'lstm', 'action_type': action_type})
+        env.conv2d, env.ep, env.mode = False, None, Mode.TEST
+        env.start_cash, env.start_value, env.min_trade = .4, .4, .01
+        env.acc = Box(episode=dict(i=0, total_steps=0), step=None)
+        env.all_observations = np.zeros((n, 1))
+        q = env.diff_quantile(prices)
+        env.offset, env.limit, env.prices_diff = 0, n, env.diff(prices, q=q)
+        env.reset()
+        for i in range(n):
+            action = actions[i] if action_type != 'multi' else {k: v[i] for k, v in actions.items()}
+            _, terminal, reward = env.execute(action)
+            if terminal: break
+
+        for ep in (backtest(action_type, actions, env.prices_diff, min_trade=.01),
+                   replay(env.ep.signals, prices, min_trade=.01, q=q),
+                   replay(env.ep.signals, prices, min_trade=.01, prices_diff=env.prices_diff)):
+            assert ep.i == env.ep.i and ep.sharpe() == reward == env.ep.sharpe()
+            assert np.array_equal(ep.signals, env.ep.signals)
+            for k in ('trade', 'hold'):
+                assert np.array_equal(ep.totals[k], env.ep.totals[k])
+
+
+def test_jit_kernel():
+    """The numba-compiled step kernel (JIT in config.json) must give the same totals/signals as the pure-Python one,
+    for every action type, killed or not"""
+    import trading
+    from backtest import backtest, pct_changes
+    if trading.numba is None:
+        print('numba not installed, skipping test_jit_kernel')
+        return
+    n = 20000
+    prices_diff = pct_changes(np.random.randn(n).cumsum() + 10000)
+    jit = trading.JIT
+    try:
+        for action_type in ('single_discrete', 'single_continuous', 'multi'):
+            for amount in (.05, 1.):
+                if action_type == 'single_discrete': actions = np.random.randint(0, 3, n)
+                elif action_type == 'single_continuous': actions = np.random.uniform(-amount, amount, n)
+                else: actions = dict(action=np.random.randint(0, 3, n), amount=np.random.uniform(0, amount, n))
+                for kill in (True, False):
+                    eps = []
+                    for trading.JIT in (False, True):
+                        eps.append(backtest(action_type, actions, prices_diff, min_trade=.01, kill=kill))
+                    py, jitted = eps
+                    assert py.i == jitted.i and py.cash == jitted.cash and py.value == jitted.value
+                    assert np.array_equal(py.signals, jitted.signals)
+                    for k in ('trade', 'hold'):
+                        assert np.array_equal(py.totals[k], jitted.totals[k])
+    finally:
+        trading.JIT = jit
+
+
+def test_sketch_scaler():
+    """SketchScaler (KLL sketches, fit in chunks) must land within 2.5% of sklearn's exact robust scaling, for its
+    center & scale, whether fit in one go or as two partial fits merge()d; including near-1 price ratios and a
+    constant column"""
+    from sklearn.preprocessing import RobustScaler
+    from scaler import SketchScaler, CHUNK
+    n = CHUNK * 2 + 5000  # a few chunks, each far past the sketch's size
+    X = np.column_stack([np.random.randn(n), np.random.lognormal(0, 1, n), 1 + np.random.randn(n) * 1e-3,
+                         np.random.rand(n) * 10, np.full(n, 3.)])
+    exact = RobustScaler(quantile_range=(1., 99.)).fit(X)
+    merged = SketchScaler().fit(X[:n // 3]).merge(SketchScaler().fit(X[n // 3:]))
+    for scaler in (SketchScaler().fit(X), merged):
+        scaler.transform(X[:1])  # finalizes center_/scale_
+        assert np.all(np.abs(scaler.center_ - exact.center_) <= .025 * exact.scale_)
+        assert np.all(np.abs(scaler.scale_ - exact.scale_) <= .025 * exact.scale_)
+
+
+def test_float32():
+    """--float32 must store observations as float32 all the way out to the states handed to the agent (lstm rows,
+    conv2d windows), within float32 rounding of the float64 ones. diff() on float32 prices gives the float64 result"""
+    df = ohlcv_history(3000)
+    for count, window in [(0, 0), (3, 30)]:
+        for net_type in ('lstm', 'conv2d'):
+            hypers = {'net.type': net_type, 'indicators_count': count, 'indicators_window': window}
+            envs = bare_env(hypers), bare_env(hypers, float32=True)
+            for env in envs:
+                env.all_observations, env.all_prices = env.xform_data(df)
+                env.all_prices_diff = env.diff(env.all_prices, q=env.xform_fit['diff_q'])
+                env.use_window(dict(mode=Mode.TRAIN, offset=100, limit=1000, block=None))
+            env64, env32 = envs
+            assert env64.all_observations.dtype == np.float64 and env32.all_observations.dtype == np.float32
+            # Price ratios sit near 1 and are stored before scaling, so their float32 rounding (~1e-7) gets scaled up
+            # by 1 / (q99 - q1) of a narrow column
+            assert np.allclose(env32.all_observations, env64.all_observations, rtol=1e-5, atol=5e-4)
+            assert env32.xform_fit['diff_q'] == env64.xform_fit['diff_q']
+            assert np.array_equal(env32.all_prices_diff, env64.all_prices_diff)
+            for i in (0, 1, 500):
+                s32, s64 = env32.get_next_state(i, [1., 1.])['series'], env64.get_next_state(i, [1., 1.])['series']
+                assert s32.dtype == np.float32 and s32.shape == s64.shape
+                assert np.allclose(s32, s64, rtol=1e-5, atol=5e-4)
+            assert env32.get_states(np.arange(10)).dtype == np.float32
+
+    # No outlier cutoff here: a diff within rounding of the cutoff could go either way
+    prices = df['a_c'].values
+    diff32, diff64 = env32.diff(prices.astype(np.float32), q=np.inf), env32.diff(prices, q=np.inf)
+    assert diff32.dtype == np.float64 and np.allclose(diff32, diff64, rtol=1e-4, atol=1e-6)
+
+
+def test_window_view():
+    """get_next_state()/get_states() off the strided window_view must hand out exactly what the old code sliced out of
+    all_observations: conv2d's [step_window, 1, cols] window ending on the step's row, lstm's row. Down to the very
+    first full window (starting on row 0), and through the last row"""
+    n, w = 500, 20
+    obs = np.random.randn(n, 6)
+
+    def sliced(env, i):
+        i += env.offset
+        if env.conv2d: return np.expand_dims(obs[i - w + 1:i + 1], axis=1)
+        return obs[i]
+
+    for net_type in ('lstm', 'conv2d'):
+        env = bare_env({'net.type': net_type, 'step_window': w})
+        env.all_observations, env.all_prices, env.all_prices_diff = obs, np.zeros(n), np.zeros(n)
+        first = w - 1 if env.conv2d else 0
+        for offset in (first, first + 1, 100):
+            env.use_window(dict(mode=Mode.TRAIN, offset=offset, limit=n - offset, block=None))
+            steps = np.arange(n - offset)
+            for i in steps:
+                assert np.array_equal(env.get_next_state(i, None)['series'], sliced(env, i))
+            assert np.array_equal(env.get_states(steps), np.stack([sliced(env, i) for i in steps]))
+        if env.conv2d:
+            # Views of the one buffer, which nobody can write through
+            assert np.shares_memory(env.get_next_state(0, None)['series'], obs)
+            assert not env.windows.flags.writeable
+
+
+def test_chunked_observations():
+    """OUT_OF_CORE (chunked.py): states out of the paged-in block must be the in-memory ones, for TRAIN and TEST
+    windows over a memmapped history, whichever chunks they straddle"""
+    import os, tempfile
+    from chunked import ChunkedObservations
+    n, w = 30000, 20
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'observations.npy')
+        np.save(path, np.random.randn(n, 6))
+        history = np.load(path, mmap_mode='r')
+        out_of_core = data.config_json.get('OUT_OF_CORE', False)
+        try:
+            for net_type in ('lstm', 'conv2d'):
+                envs = []
+                for data.config_json['OUT_OF_CORE'] in (False, True):
+                    env = bare_env({'net.type': net_type, 'step_window': w})
+                    env.all_observations, env.all_prices, env.all_prices_diff = history, np.zeros(n), np.zeros(n)
+                    envs.append(env)
+                mem, chunked = envs
+                assert mem.chunked is None
+                # Small chunks, so windows often start just past a chunk edge (conv2d's first window reaches back)
+                chunked.chunked = ChunkedObservations(history, chunk_rows=100)
+                for mode in [Mode.TRAIN] * 30 + [Mode.TEST]:
+                    window = chunked.prepare_window(mode, row_ct=n)
+                    chunked.use_window(window)
+                    mem.use_window(dict(window, block=None))
+                    assert len(chunked.observations) < n  # just the window's chunks
+                    steps = np.arange(min(window['limit'], n - window['offset']))
+                    for i in np.concatenate([steps[:2 * w], steps[-2:]]):
+                        assert np.array_equal(chunked.get_next_state(i, None)['series'],
+                                              mem.get_next_state(i, None)['series'])
+                    assert np.array_equal(chunked.get_states(steps), mem.get_states(steps))
+        finally:
+            data.config_json['OUT_OF_CORE'] = out_of_core
+            del history
+
+
+def test_prefetch():
+    """EpisodePrefetcher's windows, prepared in the background, must be the ones use_dataset() would've switched to
+    right then: the same random TRAIN windows in the same order (same seed), the same TEST windows, the same states.
+    In memory and out-of-core"""
+    import random
+    from prefetch import EpisodePrefetcher
+    n, w = 30000, 20
+    data.count_rows = lambda *args, **kwargs: n
+    history, prices = np.random.randn(n, 6), np.random.randn(n).cumsum() + 10000
+
+    def window(env):
+        steps = np.arange(min(env.limit, n - env.offset))
+        return env.mode, env.offset, env.limit, env.prices_diff.copy(), env.get_states(steps)
+
+    out_of_core = data.config_json.get('OUT_OF_CORE', False)
+    try:
+        for data.config_json['OUT_OF_CORE'] in (False, True):
+            for net_type in ('lstm', 'conv2d'):
+                envs = []
+                for _ in range(2):
+                    env = bare_env({'net.type': net_type, 'step_window': w})
+                    env.all_observations, env.all_prices, env.all_prices_diff = history, prices, env.diff(prices)
+                    envs.append(env)
+                sync, prefetched = envs
+
+                random.seed(0)
+                expected = []
+                for _ in range(5):
+                    sync.use_dataset(Mode.TRAIN)
+                    expected.append(window(sync))
+                for full_set in (False, True):
+                    sync.use_dataset(Mode.TEST, full_set)
+                    expected.append(window(sync))
+
+                random.seed(0)
+                prefetch, got = EpisodePrefetcher(prefetched), []
+                for _ in range(5):
+                    prefetch.train()
+                    got.append(window(prefetched))
+                for full_set in (False, True):
+                    prefetch.test(full_set)
+                    got.append(window(prefetched))
+                prefetch.close()
+
+                for (mode, offset, limit, prices_diff, states), want in zip(got, expected):
+                    assert (mode, offset, limit) == want[:3]
+                    assert np.array_equal(prices_diff, want[3]) and np.array_equal(states, want[4])
+                assert len(prefetch.stalls) == len(expected)
+    finally:
+        data.config_json['OUT_OF_CORE'] = out_of_core
+
+
+class StubAgent(object):
+    """Stands in for a TensorForce agent where only its decisions matter: acts deterministically off its state and
+    its "weights" (how many times it's been trained, see StubRunner), which save_model()/restore_model() carry over"""
+    def __init__(self, worker_of=None): self.weights = 0
+
+    def act(self, state, deterministic=False, independent=False):
+        return (self.weights * 7 + int(abs(state['series'].flat[0]) * 10)) % 3
+
+    def save_model(self, path, append_timestep=True):
+        with open(path + '.weights', 'w') as f: f.write(str(self.weights))
+        return path
+
+    def restore_model(self, directory=None, file=None):
+        with open(file + '.weights') as f: self.weights = int(f.read())
+
+    def close(self): pass
+
+
+class StubRunner(object):
+    """TensorForce's Runner, where a training run just bumps the agent's weights"""
+    def __init__(self, agent, environment): self.agent = agent
+
+    def run(self, timesteps): self.agent.weights += 1
+
+
+def test_overlapped_tests():
+    """--overlap-tests must record the same test results, in the same order, as stopping training for each one; the
+    worker runs every checkpoint's snapshot of the agent, not whatever it's trained into since"""
+    import btc_env
+    n = 400000  # the full-set test window is 40k rows past the 90% split
+    data.count_rows = lambda *args, **kwargs: n
+    history, prices = np.random.randn(n, 6), np.random.randn(n).cumsum() + 10000
+    results = []
+    runner, btc_env.Runner = btc_env.Runner, StubRunner
+    try:
+        for overlap in (False, True):
+            env = bare_env({'step_window': 20}, overlap_tests=overlap, n_envs=1)
+            env.min_trade = .001  # so 2% of .4 trades
+            env.all_observations, env.all_prices, env.all_prices_diff = history, prices, env.diff(prices)
+            env.train_and_test(StubAgent(), 1, 5, -1, make_agent=StubAgent)
+            results.append([list(env.acc.episode[k]) for k in ('sharpes', 'returns', 'uniques')])
+    finally:
+        btc_env.Runner = runner
+    serial, overlapped = results
+    assert len(serial[0]) == 7  # n_tests + 1 checkpoints, then the no-kill run
+    assert len(set(serial[0])) > 1  # each checkpoint's agent acts differently
+    assert serial == overlapped
+
+
+class StubConvModel(object):
+    """Just enough of a TensorForce model for evaluator.FeedForwardPolicy: a "conv" part (each window's sum) whose
+    output is `series_out`, under a dense head that takes it with the stationary inputs. Counts its session runs"""
+    network = Box(series_out='series_out', internals_spec=lambda: {})
+    actions_output = 'actions'
+
+    def __init__(self):
+        self.monitored_session = self
+        self.runs = Box(series=0, head=0)
+
+    def get_feed_dict(self, states, internals, deterministic, independent):
+        return dict(series=states['series'], stationary=states['stationary'])
+
+    def run(self, fetch, feed):
+        if 'series_out' in feed: series_out = feed['series_out']
+        else: series_out = np.asarray(feed['series']).reshape(len(feed['series']), -1).sum(1)
+        if fetch == 'series_out':
+            self.runs.series += 1
+            return series_out
+        self.runs.head += 1
+        stationary = np.asarray(feed['stationary'])
+        return dict(action=np.tanh(series_out * .1 + stationary[:, 0] - stationary[:, 1]))
+
+
+class StubConvAgent(object):
+    def __init__(self): self.model = StubConvModel()
+
+    def act(self, state, deterministic=False, independent=False):
+        feed = self.model.get_feed_dict(dict(series=[state['series']], stationary=[state['stationary']]), {}, 1, 1)
+        return self.model.run(self.model.actions_output, feed)['action'][0]
+
+
+def test_feed_forward_policy():
+    """FeedForwardPolicy (conv part batched a chunk of windows at a time, just the head per step) must take the same
+    actions as agent.act() on each state, across chunk edges, so a deterministic test run scores the same"""
+    from evaluator import FeedForwardPolicy, CHUNK_STEPS
+    from types import SimpleNamespace
+    n, limit = 20000, 3000
+    history, prices = np.random.randn(n, 6) * .1, np.random.randn(n).cumsum() + 10000
+    eps = []
+    for batched in (True, False):
+        env = bare_env({'net.type': 'conv2d', 'action_type': 'single_continuous', 'step_window': 20}, n_envs=1)
+        env.min_trade, env.actions_ = .001, dict(type='float', shape=())
+        env.all_observations, env.all_prices, env.all_prices_diff = history, prices, env.diff(prices)
+        env.use_window(dict(mode=Mode.TEST, offset=1000, limit=limit, block=None))
+        agent = StubConvAgent()
+        # Without a `model`, FeedForwardPolicy.of() passes & it's agent.act() every step
+        runner = SimpleNamespace(agent=agent if batched else SimpleNamespace(act=agent.act))
+        assert (FeedForwardPolicy.of(runner.agent, env) is not None) == batched
+        env.run_deterministic(runner, print_results=False)
+        eps.append(env.ep)
+        if batched:
+            # A series run per chunk, a head run per step (+1, its one check against agent.act(); more means it
+            # found a mismatch there and fell back to agent.act())
+            assert agent.model.runs.series == -(-env.ep.i // CHUNK_STEPS)
+            assert agent.model.runs.head == env.ep.i + 1
+    policy, per_step = eps
+    assert policy.i == per_step.i > CHUNK_STEPS
+    assert np.array_equal(policy.signals, per_step.signals) and policy.sharpe() == per_step.sharpe()
+
+
+def test_warm_start():
+    """hypersearch --persistent: envs on one WarmStart share its connection (and leave it open), look up the BTC
+    price once, and reuse a recent feature config's loaded features as-is instead of loading the history again"""
+    import tempfile, btc_env
+    from btc_env import WarmStart
+    from data.features import FeatureStore
+    from types import SimpleNamespace
+    df = ohlcv_history(3000)
+    calls = Box(connect=0, close=0, price=0, load=0)
+
+    class Conn(object):
+        def close(self): calls.close += 1
+
+    def connect():
+        calls.connect += 1
+        return Conn()
+
+    def db_to_dataframe(conn, arbitrage=True):
+        calls.load += 1
+        return df
+
+    def update_btc_price(env):
+        calls.price += 1
+        env.btc_price = 8000
+
+    def hypers(count):
+        return {'net.type': 'lstm', 'action_type': 'single_discrete', 'step_window': 20, 'arbitrage': False,
+                'indicators_count': count, 'indicators_window': 30}
+
+    cli_args = Box(autoencode=False, float32=False)
+    saved = data.engine, data.data_version, data.db_to_dataframe, btc_env.FeatureStore, \
+        BitcoinEnv.update_btc_price, dict(data.config_json)
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            data.engine = SimpleNamespace(connect=connect)
+            data.data_version = lambda conn, arbitrage=True: 'v1'
+            data.db_to_dataframe = db_to_dataframe
+            btc_env.FeatureStore = lambda max_bytes: FeatureStore(tmp, max_bytes)
+            BitcoinEnv.update_btc_price = update_btc_price
+            data.config_json['SHARED_FEATURES_GB'] = 0  # features from the WarmStart or the store, not /dev/shm
+
+            warm = WarmStart(n_features=2)
+            envs = {}
+            for count in (0, 3, 0, 3):
+                env = BitcoinEnv(hypers(count), cli_args, warm=warm)
+                env.close()
+                if count in envs: assert env.all_observations is envs[count].all_observations
+                envs[count] = env
+            assert env.conn is warm.conn and calls.connect == 1 and calls.close == 0
+            assert calls.price == 1 and calls.load == 2  # once per feature config
+
+            cold = BitcoinEnv(hypers(0), cli_args)  # off the store, its own connection, closed after
+            cold.close()
+            assert cold.conn is not warm.conn and calls.connect == 2 and calls.close == 1
+            assert calls.price == 2 and calls.load == 2
+            assert np.array_equal(cold.all_observations, envs[0].all_observations)
+            warm.close()
+            assert calls.close == 2
+        finally:
+            data.engine, data.data_version, data.db_to_dataframe, btc_env.FeatureStore, \
+                BitcoinEnv.update_btc_price, config_json = saved
+            data.config_json.clear()
+            data.config_json.update(config_json)
+
+
+def sqlite_history(path, n=500):
+    """A history DB in a SQLite file at `path`, as data.tables: `a` the primary table, `b` & `c` secondaries on their
+    own clocks. Both start after `a` does, `b` shares some of `a`'s timestamps exactly, and every column has NaN runs
+    (the F/B/Z rules' business). Returns a connection to it"""
+    from sqlalchemy import create_engine, text
+    data.tables = [
+        dict(name='a', ts='ts', cols=dict(o=F, v=Z, s=B)),
+        dict(name='b', ts='ts', cols=dict(o=F, s=B, v=Z)),
+        dict(name='c', ts='ts', cols=dict(o=F, v=Z)),
+    ]
+    start = pd.Timestamp('2018-01-01')
+    a_ts = start + pd.to_timedelta(np.random.randint(1, 120, n).cumsum(), unit='s')
+    tied = a_ts[20::3]
+    b_ts = tied.union(start + pd.to_timedelta(np.random.randint(1, 120, n).cumsum() + 1000, unit='s'))
+    c_ts = start + pd.to_timedelta(np.arange(n // 3) * 180 + 5000, unit='s')
+    conn = create_engine(f'sqlite:///{path}').connect()
+    for table, ts in zip(data.tables, (a_ts, b_ts, c_ts)):
+        cols = list(table['cols'])
+        values = np.random.rand(len(ts), len(cols))
+        for _ in range(len(ts) // 10):
+            lo = np.random.randint(len(ts))
+            values[lo:lo + np.random.randint(1, 20), np.random.randint(len(cols))] = np.nan
+        values[:5, 0] = values[-5:, -1] = np.nan  # nothing to ffill from / bfill from
+        conn.execute(f"create table {table['name']} (ts text, {', '.join(c + ' float' for c in cols)})")
+        conn.execute(text(f"insert into {table['name']} values (:ts, {', '.join(':' + c for c in cols)})"), [
+            dict(ts=str(t), **{c: None if np.isnan(v) else v for c, v in zip(cols, row)})
+            for t, row in zip(ts, values)
+        ])
+    return conn
+
+
+def lateral_history(conn, arbitrage=True):
+    """The rows _db_to_dataframe_lateral's SQL gives, NaNs not imputed: each secondary's latest row at-or-before the
+    primary row. SQLite has no lateral join, so as a correlated subquery per column"""
+    tables_ = data.get_tables(arbitrage)
+    first = tables_[0]
+    select = [f"a.{c}" for c in first['cols']]
+    for t in tables_[1:]:
+        select += [f"(select {c} from {t['name']} where {t['ts']} <= a.{first['ts']} order by {t['ts']} desc limit 1)"
+                   for c in t['cols']]
+    rows = conn.execute(f"select {', '.join(select)} from {first['name']} a order by a.{first['ts']}").fetchall()
+    return np.array([tuple(r) for r in rows], dtype=np.float64)  # None -> NaN
+
+
+def test_load_streaming():
+    """load_streaming (chunks off a cursor, imputed as they come by ChunkImputer) must give what the whole-frame load
+    did: the lateral-joined rows, then _impute(). At every chunk size ffill/bfill/zero runs cross chunk edges, bfill
+    runs are still open when a chunk ends, and the last rows have nothing to bfill from"""
+    import os, tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite_history(os.path.join(tmp, 'history.db'))
+        for arbitrage in (False, True):
+            tables_ = data.get_tables(arbitrage)
+            columns = [f"{t['name']}_{c}" for t in tables_ for c in t['cols']]
+            expected = data._impute(pd.DataFrame(lateral_history(conn, arbitrage), columns=columns), tables_)
+            assert expected.isnull().values.any()  # leading ffill & trailing bfill NaNs stay NaN
+            for chunksize in (1, 7, len(expected)):
+                df, ts = data.load_streaming(conn, arbitrage=arbitrage, chunksize=chunksize)
+                assert list(df.columns) == columns and len(ts) == len(df)
+                np.testing.assert_array_equal(df.values, expected.values)
+        conn.close()
+
+
+def test_stream_chunks():
+    """stream_chunks' in-process as-of join (_align over per-chunk secondary fetches) must give the lateral join's
+    rows: each secondary's latest row at-or-before the primary's, an exact timestamp tie included; NaN before a
+    secondary's first row; columns in table order. At every chunk size, and for (since, until] & limit windows"""
+    import os, tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite_history(os.path.join(tmp, 'history.db'))
+        expected = lateral_history(conn)
+        ts = [r[0] for r in conn.execute("select ts from a order by ts").fetchall()]
+        b_ts = {r[0] for r in conn.execute("select ts from b").fetchall()}
+        assert b_ts & set(ts)  # ties
+        a_cols = len(data.tables[0]['cols'])
+        assert np.isnan(expected[0, a_cols:]).all()  # before b & c start
+        windows = [(dict(), expected), (dict(since=ts[100], until=ts[400]), expected[101:401]),
+                   (dict(until=ts[400], limit=50), expected[351:401])]
+        for chunksize in (1, 7, len(ts)):
+            for window, rows in windows:
+                chunks = list(data.stream_chunks(conn, chunksize=chunksize, **window))
+                assert all(len(chunk) <= chunksize for _, chunk in chunks)
+                np.testing.assert_array_equal(np.concatenate([chunk for _, chunk in chunks]), rows)
+        conn.close()
+
+
 if __name__ == '__main__':
+    test_feature_stream()
+    test_vec_env()
+    test_backtest()
+    test_jit_kernel()
+    test_sketch_scaler()
+    test_float32()
+    test_window_view()
+    test_chunked_observations()
+    test_prefetch()
+    test_overlapped_tests()
+    test_feed_forward_policy()
+    test_warm_start()
+    test_load_streaming()
+    test_stream_chunks()
     main()
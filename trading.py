@@ -0,0 +1,268 @@
+"""
+The trading rules BitcoinEnv.execute() steps through (action -> percent, fees, min_trade, overdraft handling, the
+market move, trade-vs-hold totals), pulled out of the env so they don't need TensorForce and so every stepper shares
+one definition of them. EpisodeState is one episode's running state: a `__slots__` object over arrays preallocated to
+the episode length, written by index, in place of the Box-of-lists accumulator.
+
+action_pcts/trade_batch/EpisodeBatch are the same again over N episodes at once (see vec_env.py), as np.where's over
+arrays. They do the same float ops in the same order as the scalar versions, so each row comes out bit-for-bit what
+stepping that episode alone would give.
+
+_steps() is the accounting loop itself (trade, market move, totals) over plain arrays, for one step or many
+(EpisodeState.run()). With `"JIT": true` in config.json and numba installed, it and trade() get compiled; without
+numba, JIT stays off and it's plain Python. Same IEEE ops either way, so the same totals (test.py checks both).
+"""
+
+import types
+import numpy as np
+from data.data import Exchange, EXCHANGE, config_json
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+JIT = bool(config_json.get('JIT', False)) and numba is not None
+
+FEES = {
+    Exchange.GDAX: 0.0025,  # https://support.gdax.com/customer/en/portal/articles/2425097-what-are-the-fees-on-gdax-
+    Exchange.KRAKEN: 0.0026  # https://www.kraken.com/en-us/help/fees
+}
+FEE = FEES[EXCHANGE]
+
+# gdax min order size = .01btc; kraken = .002btc
+MIN_TRADES = {Exchange.GDAX: .01, Exchange.KRAKEN: .002}
+MIN_TRADE = MIN_TRADES[EXCHANGE]
+
+# In single_discrete, we allow sell2%, hold, buy2% (and nothing else)
+DISCRETE_PCTS = (-.02, 0, .02)
+# In multi, `action` is sell/hold/buy, which makes `amount` negative/zero/positive
+MULTI_SIGNS = (-1, 0, 1)
+
+
+def action_pct(action_type, actions):
+    """Percent of cash (buying, > 0) or value (selling, < 0) an action trades"""
+    if action_type == 'single_discrete':
+        return DISCRETE_PCTS[actions]
+    if action_type == 'single_continuous':
+        return actions
+    # multi: two actions, `action` (buy/sell/hold) and `amount` (how much). multi-action min_trade accounted for in
+    # the env constructor
+    return MULTI_SIGNS[actions['action']] * actions['amount']
+
+
+def action_pcts(action_type, actions):
+    """action_pct() for a batch of actions (multi: dict of action & amount arrays)"""
+    if action_type == 'single_discrete':
+        return np.asarray(DISCRETE_PCTS)[actions]
+    if action_type == 'single_continuous':
+        return np.asarray(actions, dtype=np.float64)
+    return np.asarray(MULTI_SIGNS)[actions['action']] * np.asarray(actions['amount'], dtype=np.float64)
+
+
+def trade(act_pct, cash, value, min_trade, start_total, fee=FEE):
+    """Perform the trade. In training mode, we'll let it dip into negative here, but then kill and punish (the env
+    does, on cash|value < 0). Trying to buy without min_trade's worth of cash (or sell without that much value) costs
+    `start_total`.
+    :return: (cash, value, act_btc)
+    """
+    act_btc = act_pct * (cash if act_pct > 0 else value)
+    if act_pct > 0:
+        if cash < min_trade:
+            act_btc = -start_total
+        elif act_btc < min_trade:
+            act_btc = 0
+        else:
+            value += act_btc - act_btc*fee
+        cash -= act_btc
+
+    elif act_pct < 0:
+        if value < min_trade:
+            act_btc = -start_total
+        elif abs(act_btc) < min_trade:
+            act_btc = 0
+        else:
+            cash += abs(act_btc) - abs(act_btc)*fee
+        value -= abs(act_btc)
+    return cash, value, act_btc
+
+
+def _steps(act_pct, pct_change, i, cash, value, hold_value, start_cash, min_trade, start_total, fee, kill,
+           trade_, hold, signals):
+    """execute()'s accounting for each of `act_pct`, starting at step `i`, writing trade_/hold/signals in place.
+    :param pct_change: the market move after each action (prices_diff[i + 1:], as long as act_pct)
+    :return: (i, cash, value, hold_value) after
+    """
+    for j in range(len(act_pct)):
+        cash, value, act_btc = _trade(act_pct[j], cash, value, min_trade, start_total, fee)
+        signals[i] = act_btc
+        value += pct_change[j] * value
+        trade_[i + 1] = value + cash
+
+        # calculate what the reward would be "if I held", to calculate the actual reward's _advantage_ over holding
+        hold_value += pct_change[j] * hold_value
+        hold[i + 1] = hold_value + start_cash
+        i += 1
+        if kill and (value < 0 or cash < 0): break
+    return i, cash, value, hold_value
+
+
+_trade = trade
+_compiled = None
+
+
+def _kernel():
+    """_steps, compiled if JIT (on first use; numba caches it to __pycache__ for the next process)"""
+    global _compiled
+    if not JIT: return _steps
+    if _compiled is None:
+        # numba resolves _trade when it compiles _steps, so point a copy of _steps at a compiled trade()
+        glob = dict(_steps.__globals__, _trade=numba.njit(cache=True)(trade))
+        _compiled = numba.njit(cache=True)(types.FunctionType(_steps.__code__, glob, '_steps'))
+    return _compiled
+
+
+def trade_batch(act_pct, cash, value, min_trade, start_total, fee=FEE):
+    """trade() over arrays (one element per episode). Conditions are written the way trade()'s if/elif fall through,
+    so NaNs land in the same branch.
+    :return: (cash, value, act_btc) arrays
+    """
+    buy, sell = act_pct > 0, act_pct < 0
+    act_btc = act_pct * np.where(buy, cash, value)
+    sold = np.abs(act_btc)
+    buy_broke, buy_small = cash < min_trade, act_btc < min_trade
+    sell_broke, sell_small = value < min_trade, sold < min_trade
+    filled_buy = buy & ~buy_broke & ~buy_small
+    filled_sell = sell & ~sell_broke & ~sell_small
+
+    new_value = np.where(filled_buy, value + (act_btc - act_btc*fee), value)
+    new_cash = np.where(filled_sell, cash + (sold - sold*fee), cash)
+    act_btc = np.where(buy & buy_broke, -start_total, np.where(buy & buy_small, 0., act_btc))
+    act_btc = np.where(sell & sell_broke, -start_total, np.where(sell & sell_small, 0., act_btc))
+    new_cash = np.where(buy, new_cash - act_btc, new_cash)
+    new_value = np.where(sell, new_value - np.abs(act_btc), new_value)
+    return new_cash, new_value, act_btc
+
+
+class EpisodeState(object):
+    __slots__ = ('i', 'cash', 'value', 'hold_value', 'start_cash', 'trade', 'hold', 'signal_buf', 'n_signals')
+
+    def __init__(self, limit, start_cash, start_value):
+        self.i = 0
+        self.cash, self.value, self.start_cash = start_cash, start_value, start_cash
+        self.hold_value = start_value
+        # trade/hold totals (one per step, plus the start) & signals (one per step, plus the terminal 0)
+        self.trade = np.empty(limit + 1)
+        self.hold = np.empty(limit + 1)
+        self.trade[0] = self.hold[0] = start_cash + start_value
+        self.signal_buf = np.empty(limit + 1)
+        self.n_signals = 0
+
+    def _grow(self):
+        """Only live mode outgrows its limit (it keeps appending ticks mid-episode)"""
+        for k in ('trade', 'hold', 'signal_buf'):
+            buf = getattr(self, k)
+            setattr(self, k, np.concatenate([buf, np.empty(len(buf))]))
+
+    def step(self, act_btc, pct_change):
+        """Record a trade (already applied to cash/value by trade()), then move the market by `pct_change`"""
+        i = self.i
+        if i + 2 > len(self.trade): self._grow()
+        self.signal_buf[i] = act_btc
+        self.value += pct_change * self.value
+        self.trade[i + 1] = self.value + self.cash
+
+        # calculate what the reward would be "if I held", to calculate the actual reward's _advantage_ over holding
+        self.hold_value += pct_change * self.hold_value
+        self.hold[i + 1] = self.hold_value + self.start_cash
+        self.i = self.n_signals = i + 1
+
+    def run(self, act_pct, prices_diff, min_trade, start_total, fee=FEE, kill=True):
+        """Trade & step through all of `act_pct` (as far as prices_diff goes), in one _steps() call. Same as trade()
+        + step() per action; cheaper for many at once, and compiled with JIT on.
+        :param prices_diff: the episode's whole window (step i moves by prices_diff[i + 1])
+        :param kill: stop early on cash|value < 0, the step that did it included
+        :return: steps taken
+        """
+        n = max(min(len(act_pct), len(prices_diff) - 1 - self.i), 0)
+        while self.i + n + 1 > len(self.trade): self._grow()
+        act_pct = np.asarray(act_pct[:n], dtype=np.float64)
+        pct_change = np.asarray(prices_diff[self.i + 1:self.i + 1 + n], dtype=np.float64)
+        if not JIT:  # plain Python floats; numpy scalars would be several times slower, the IEEE results the same
+            act_pct, pct_change = act_pct.tolist(), pct_change.tolist()
+        start = self.i
+        self.i, self.cash, self.value, self.hold_value = _kernel()(
+            act_pct, pct_change, self.i, float(self.cash), float(self.value), float(self.hold_value),
+            float(self.start_cash), float(min_trade), float(start_total), float(fee), kill, self.trade, self.hold,
+            self.signal_buf)
+        self.n_signals = self.i
+        return self.i - start
+
+    def finish(self):
+        """Add one last signal (to match length)"""
+        if self.n_signals + 1 > len(self.signal_buf): self._grow()
+        self.signal_buf[self.n_signals] = 0
+        self.n_signals += 1
+
+    @property
+    def signals(self): return self.signal_buf[:self.n_signals]
+
+    @property
+    def totals(self):
+        """trade & hold totals so far, {trade: [...], hold: [...]}"""
+        return dict(trade=self.trade[:self.i + 1], hold=self.hold[:self.i + 1])
+
+    def cumm_return(self):
+        trade, hold, i = self.trade, self.hold, self.i
+        return (trade[i] / trade[0] - 1) - (hold[i] / hold[0] - 1)
+
+    def sharpe(self):
+        """https://www.investopedia.com/terms/s/sharperatio.asp
+        = (portfolio_return - risk_free_rate) / (portfolio_std - risk_free_std)
+        """
+        if not np.any(self.trade[:self.i + 1]):
+            return 0.
+        numerator = self.cumm_return()  # (trade.pct_change() - hold.pct_change())[1:].mean()
+        denominator = 1  # FIXME cumm_return / std() in different scales, getting funky results
+        # denominator = trade.pct_change().std() - hold.pct_change().std()
+        return numerator / denominator
+
+
+class EpisodeBatch(object):
+    """EpisodeState for N episodes stepping in lockstep: row k is episode k. Rows start over independently (reset()),
+    eg when one episode ends while the rest carry on."""
+    def __init__(self, n, limit, start_cash, start_value):
+        self.n, self.limit = n, limit
+        self.start_cash, self.start_value = start_cash, start_value
+        self.i = np.zeros(n, dtype=np.int64)
+        self.cash, self.value, self.hold_value = np.empty(n), np.empty(n), np.empty(n)
+        # one row per episode, same layout as EpisodeState's arrays
+        self.trade, self.hold, self.signals = (np.empty((n, limit + 1)) for _ in range(3))
+        self.reset(np.arange(n))
+
+    def reset(self, rows):
+        self.i[rows] = 0
+        self.cash[rows], self.value[rows], self.hold_value[rows] = self.start_cash, self.start_value, self.start_value
+        self.trade[rows, 0] = self.hold[rows, 0] = self.start_cash + self.start_value
+
+    def step(self, act_btc, pct_change):
+        """EpisodeState.step() for every row"""
+        rows, i = np.arange(self.n), self.i
+        self.signals[rows, i] = act_btc
+        self.value += pct_change * self.value
+        self.trade[rows, i + 1] = self.value + self.cash
+        self.hold_value += pct_change * self.hold_value
+        self.hold[rows, i + 1] = self.hold_value + self.start_cash
+        self.i += 1
+
+    def episode(self, k):
+        """Row k as a (finished) EpisodeState of its own, copied out, so the row can be reset"""
+        i = int(self.i[k])
+        ep = EpisodeState.__new__(EpisodeState)
+        ep.i, ep.n_signals = i, i
+        ep.cash, ep.value, ep.hold_value = float(self.cash[k]), float(self.value[k]), float(self.hold_value[k])
+        ep.start_cash = self.start_cash
+        ep.trade, ep.hold = self.trade[k, :i + 1].copy(), self.hold[k, :i + 1].copy()
+        ep.signal_buf = np.append(self.signals[k, :i], np.empty(1))
+        ep.finish()
+        return ep
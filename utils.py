@@ -47,6 +47,9 @@ def add_common_args(parser):
     parser.add_argument('-t', '--n-tests', type=int, default=30, help="Number of times to split to training and run a test. This slows things down, so balance graph resolution w/ performance.")
     parser.add_argument('-s', '--n-steps', type=int, default=80, help="Number of 1k timesteps total to train. (using 50 means 500,000)")
     parser.add_argument('--autoencode', action="store_true", default=False, help="If you're running out of GPU memory, try --autoencode which scales things down")
+    parser.add_argument('--float32', action="store_true", default=False, help="Keep observations in float32 rather than float64 (half the RAM per tab, see --gpu-split)")
+    parser.add_argument('--overlap-tests', action="store_true", default=False, help="Run each test on a snapshot of the agent in another thread while training continues (a 2nd agent's worth of memory)")
+    parser.add_argument('--n-envs', type=int, default=1, help="Envs (random train windows) stepping at once in threads, each feeding the agent. More windows per update, not a speedup (see rollouts.py)")
     parser.add_argument('--clear-scalers', action="store_true", default=False, help="Should we delete the saved reward/state scaler.pkl objects, start over?")
 
 
@@ -0,0 +1,97 @@
+"""
+N BitcoinEnv episodes stepped in lockstep, for batched policy rollouts. BitcoinEnv.execute() is one step of one
+episode at a time, so on CPU boxes the per-step Python overhead is most of the cost. VecBitcoinEnv keeps every
+episode's cash/value/hold/totals as arrays over the batch (trading.EpisodeBatch) and steps them all with one
+`step(actions)`, returning batched states, terminals & rewards.
+
+Each episode gets its own random offset, from the same prepare_window(Mode.TRAIN) draw BitcoinEnv uses (just the
+offset: with OUT_OF_CORE no block gets read, each step only reads the rows it indexes). When one ends, its row is
+recorded (like episode_finished() does) and restarted at a new offset; the others carry on. Per episode, the
+states/terminals/rewards are bit-for-bit what BitcoinEnv.execute() gives for the same actions (test.py checks).
+"""
+
+import numpy as np
+from data import data
+from btc_env import Mode, window_view
+from trading import EpisodeBatch, action_pcts, trade_batch
+
+
+class VecBitcoinEnv(object):
+    def __init__(self, env, n_envs):
+        """
+        :param env: a BitcoinEnv, which has the features loaded. We use its data, hypers & accumulators (acc.episode
+            gets every finished episode), and its prepare_window() for offsets.
+        :param n_envs: how many episodes to step at once
+        """
+        self.env, self.n = env, n_envs
+        self.offsets = np.zeros(n_envs, dtype=np.int64)
+        self.limits = np.zeros(n_envs, dtype=np.int64)
+        self.batch = None
+        self.finished = []  # [(row, EpisodeState)] of episodes ended by the last step()
+        self.row_ct = data.count_rows(env.conn, arbitrage=env.hypers.arbitrage)  # once, not per restart
+        # Rows are all over the history, so index all of it (not env's per-episode block, see chunked.py)
+        self.windows = window_view(env.all_observations, env.hypers.step_window) if env.conv2d else None
+
+    def __str__(self): return 'VecBitcoinEnv'
+
+    @property
+    def states(self): return self.env.states
+
+    @property
+    def actions(self): return self.env.actions
+
+    def _start(self, rows):
+        """New episodes (fresh random offsets) in `rows`"""
+        for k in rows:
+            window = self.env.prepare_window(Mode.TRAIN, row_ct=self.row_ct, read=False)
+            self.offsets[k], self.limits[k] = window['offset'], window['limit']
+        self.batch.reset(rows)
+
+    def get_states(self):
+        """get_next_state() for every row, batched: {series: [n, ...], stationary: [n, 2]}"""
+        env, b = self.env, self.batch
+        idx = self.offsets + b.i
+        if env.conv2d:
+            series = self.windows[idx - env.hypers.step_window + 1]
+        else:
+            series = env.all_observations[idx]
+        stationary = np.stack([b.cash / env.start_cash, b.value / env.start_value], axis=1)
+        return dict(series=series, stationary=stationary)
+
+    def reset(self):
+        env = self.env
+        self.batch = EpisodeBatch(self.n, env.EPISODE_LEN, env.start_cash, env.start_value)
+        self._start(range(self.n))
+        self.finished = []
+        return self.get_states()
+
+    def step(self, actions):
+        """execute() for every episode.
+        :param actions: [n] array (single_*), or dict(action=[n], amount=[n]) for multi
+        :return: (next_states, terminals, rewards), batched. A terminal row's next state is already its new episode's
+            first state (what reset() would have returned); the ended episode is in self.finished.
+        """
+        env, b = self.env, self.batch
+        act_pct = action_pcts(env.hypers.action_type, actions)
+        start_total = env.start_cash + env.start_value
+        b.cash, b.value, act_btc = trade_batch(act_pct, b.cash, b.value, env.min_trade, start_total)
+        b.step(act_btc, env.all_prices_diff[self.offsets + b.i + 1])
+
+        terminals = (b.i + 1 >= self.limits) | (b.value < 0) | (b.cash < 0)
+        rewards = np.zeros(self.n)
+        self.finished = []
+        ended = np.flatnonzero(terminals)
+        if len(ended):
+            ep_acc = env.acc.episode
+            for k in ended:
+                ep = b.episode(k)
+                rewards[k] = ep.sharpe()
+                self.finished.append((k, ep))
+                signals = ep.signals
+                ep_acc.sharpes.append(float(rewards[k]))
+                ep_acc.returns.append(float(ep.cumm_return()))
+                ep_acc.uniques.append(float(len(np.unique(signals))))
+                ep_acc.total_steps += ep.i
+                ep_acc.i += 1
+            self._start(ended)
+        return self.get_states(), terminals, rewards
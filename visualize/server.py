@@ -1,9 +1,9 @@
 # Run as $ FLASK_APP=server.py flask run
 import json, pdb, pprint
 from flask import Flask, jsonify
-from data.data import engine_runs
+from data.data import engine_runs, runs
 from flask_cors import CORS
-from sqlalchemy import create_engine, text
+from sqlalchemy import select
 import utils
 
 app = Flask(__name__)
@@ -15,7 +15,8 @@ def get_runs():
     rows = []
     conn = engine_runs.connect()
     # TODO prices/actions in separate route
-    for row in conn.execute('select id, hypers, sharpes, returns, uniques from runs').fetchall():
+    query = select([runs.c.id, runs.c.hypers, runs.c.sharpes, runs.c.returns, runs.c.uniques])
+    for row in conn.execute(query).fetchall():
         row = dict(row.items())
         row['reward_avg'] = utils.calculate_score(row['returns'])
         rows.append(row)
@@ -28,8 +29,8 @@ def get_runs():
 @app.route("/signals/<run_id>")
 def get_actions(run_id):
     conn = engine_runs.connect()
-    query = 'select signals, prices from runs where id=:run_id'
-    row = conn.execute(text(query), run_id=run_id).fetchone()
+    query = select([runs.c.signals, runs.c.prices]).where(runs.c.id == int(run_id))
+    row = conn.execute(query).fetchone()
     conn.close()
 
     return jsonify(dict(row))